@@ -0,0 +1,390 @@
+"""Item analysis, pricing and impact estimates.
+
+Lives outside app.py because Streamlit re-executes the main script on every
+rerun; the model handle, the decode thread pool and the inference worker here
+are created once per process and shared by all sessions.
+
+The inference backend (see inference.py) is only imported and loaded on
+the background warm-up thread started by start_model_warmup(), so importing
+this module stays cheap.
+"""
+import copy
+import hashlib
+import logging
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+import numpy as np
+from PIL import Image
+
+from inference import BACKEND, load_backend, resolve_backend
+from preprocess import INPUT_SIZE, preprocess_batch
+from shops import DEFAULT_K, DEFAULT_RADIUS_KM, shop_index
+from similarity import item_embedding
+from utils import get_cached_analysis, save_cached_analysis
+
+# Analyses are memoized by photo content; bump when the output format changes
+ANALYSIS_VERSION = 2
+ANALYSIS_CACHE_SIZE = int(os.environ.get("SMARTCYCLE_ANALYSIS_CACHE_SIZE", 256))
+PERSIST_ANALYSES = os.environ.get("SMARTCYCLE_PERSIST_ANALYSES", "0") == "1"
+
+# Micro-batching: one forward pass per MAX_BATCH images or MAX_WAIT_MS, whichever comes first
+MAX_BATCH = int(os.environ.get("SMARTCYCLE_INFERENCE_MAX_BATCH", 32))
+MAX_WAIT_MS = float(os.environ.get("SMARTCYCLE_INFERENCE_MAX_WAIT_MS", 10))
+
+_model = None
+_model_lock = threading.Lock()
+_warmup_thread = None
+_warmup_lock = threading.Lock()
+
+
+def load_cnn_model():
+    """The classifier's inference backend, loaded once per process.
+
+    Blocks while another thread (usually the warm-up) is loading it.
+    """
+    global _model
+    with _model_lock:
+        if _model is None:
+            _model = load_backend()
+    return _model
+
+
+def model_ready():
+    return _model is not None
+
+
+def _warm_up():
+    try:
+        model = load_cnn_model()
+        # The first predict builds the inference function; pay that here too
+        model.predict_with_embeddings(np.zeros((1, *INPUT_SIZE, 3), dtype=np.float32))
+    except Exception:
+        # The page that needs the model retries the load and shows the error
+        logging.getLogger(__name__).exception("model warm-up failed")
+
+
+def start_model_warmup():
+    """Load the model on a background thread, once per process."""
+    global _warmup_thread
+    with _warmup_lock:
+        if _warmup_thread is None:
+            _warmup_thread = threading.Thread(target=_warm_up, name="model-warmup", daemon=True)
+            _warmup_thread.start()
+
+
+class InferenceWorker:
+    """Runs every session's forward passes on one thread, batched together.
+
+    submit() queues a stack of images and returns a Future of their rows of
+    what predict returns: by default (class probabilities, embeddings). The
+    worker takes the first waiting request, keeps collecting more until it
+    has max_batch images or max_wait_ms has passed, runs one predict over all
+    of them and hands each caller its rows.
+    """
+
+    def __init__(self, predict=None, max_batch=MAX_BATCH, max_wait_ms=MAX_WAIT_MS):
+        self._predict = predict or (lambda batch: load_cnn_model().predict_with_embeddings(batch))
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, batch):
+        future = Future()
+        self._ensure_started()
+        self._queue.put((batch, future))
+        return future
+
+    def predict(self, batch):
+        return self.submit(batch).result()
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="inference-worker", daemon=True)
+                self._thread.start()
+
+    def _collect(self):
+        pending = [self._queue.get()]
+        size = len(pending[0][0])
+        deadline = time.perf_counter() + self.max_wait
+        while size < self.max_batch:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                request = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            pending.append(request)
+            size += len(request[0])
+        return pending
+
+    def _run(self):
+        while True:
+            pending = self._collect()
+            try:
+                outputs = self._predict(np.concatenate([batch for batch, _ in pending]))
+            except Exception as e:
+                for _, future in pending:
+                    future.set_exception(e)
+                continue
+            start = 0
+            for batch, future in pending:
+                rows = slice(start, start + len(batch))
+                if isinstance(outputs, tuple):
+                    future.set_result(tuple(None if o is None else o[rows] for o in outputs))
+                else:
+                    future.set_result(outputs[rows])
+                start += len(batch)
+
+
+inference_worker = InferenceWorker()
+
+
+class AnalysisCache:
+    """Bounded LRU of analysis results, optionally backed by SQLite."""
+
+    def __init__(self, maxsize=ANALYSIS_CACHE_SIZE, persistent=PERSIST_ANALYSES):
+        self.maxsize = maxsize
+        self.persistent = persistent
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return copy.deepcopy(self._entries[key])
+        if self.persistent:
+            result = get_cached_analysis(key)
+            if result is not None:
+                self._remember(key, result)
+                return copy.deepcopy(result)
+        return None
+
+    def put(self, key, result):
+        self._remember(key, copy.deepcopy(result))
+        if self.persistent:
+            save_cached_analysis(key, result)
+
+    def _remember(self, key, result):
+        with self._lock:
+            self._entries[key] = result
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+
+analysis_cache = AnalysisCache()
+
+
+def _source_bytes(source):
+    if isinstance(source, Image.Image):
+        return source.tobytes()
+    if hasattr(source, "getvalue"):
+        return source.getvalue()
+    if isinstance(source, bytes):
+        return source
+    with open(source, "rb") as f:
+        return f.read()
+
+
+def analysis_key(sources):
+    """Content hash of the photos (in order) plus the backend and result version."""
+    digest = hashlib.sha256(f"{resolve_backend(BACKEND)}:{ANALYSIS_VERSION}".encode())
+    for source in sources:
+        digest.update(hashlib.sha256(_source_bytes(source)).digest())
+    return digest.hexdigest()
+
+# =======================================================
+# SIMULATED AI CORE
+# =======================================================
+class ItemAnalyzer:
+    CATEGORIES = ['Camera', 'Chair', 'CoffeeMaker', 'Laptop', 'Shoe', 'Sofa']
+    DEFECTS = ['Scratch', 'Dent', 'Discoloration', 'Minor Crack', 'Wear & Tear', 'Screen Issues']
+    CATEGORY_MAP = {
+        "Camera": "Electronics",
+        "Laptop": "Electronics",
+        "CoffeeMaker": "Appliances",
+        "Chair": "Furniture",
+        "Sofa": "Furniture",
+        "Shoe": "Clothing"
+    }
+
+    @staticmethod
+    def analyze_image(uploaded_file_or_pil):
+        return ItemAnalyzer.analyze_images([uploaded_file_or_pil])
+
+    @staticmethod
+    def analyze_images(sources, use_cache=True):
+        """Analyze several photos of the same item with one forward pass.
+
+        Photos are decoded and resized in parallel, stacked into one batch and
+        classified together, in the same forward pass as any other sessions'
+        photos waiting on the inference worker. Per-photo class probabilities are combined as
+        independent evidence (a product, renormalized), so photos that agree
+        give a more confident prediction than any single one.
+
+        Results are cached by photo content, so Streamlit reruns and
+        re-uploads of the same photos skip inference and show the same numbers.
+        """
+        sources = list(sources)
+        key = analysis_key(sources)
+        if use_cache:
+            cached = analysis_cache.get(key)
+            if cached is not None:
+                cached["cached"] = True
+                return cached
+
+        started = time.perf_counter()
+        batch, stages = preprocess_batch(sources)
+        preprocessed = time.perf_counter()
+
+        pred_probs, embeddings = inference_worker.predict(batch)
+        inferred = time.perf_counter()
+
+        result = ItemAnalyzer.interpret(pred_probs, key, embeddings)
+        result["timings_ms"] = {
+            "decode": 1000 * stages["decode"],
+            "resize": 1000 * stages["resize"],
+            "preprocess_wall": 1000 * (preprocessed - started),
+            "inference": 1000 * (inferred - preprocessed),
+            "total": 1000 * (inferred - started)
+        }
+        result["cached"] = False
+        if use_cache:
+            analysis_cache.put(key, result)
+        return result
+
+    @staticmethod
+    def interpret(pred_probs, key, embeddings=None):
+        """Analysis of one item from its photos' class probabilities.
+
+        `key` is the item's analysis_key(); it seeds the simulated condition
+        and defects so the same photos always get the same numbers. With the
+        photos' embeddings, "embedding" holds the item's (see
+        similarity.item_embedding) as a list, else None; it is stored in
+        listing_embeddings, not with the listing.
+        """
+        log_probs = np.log(np.clip(pred_probs, 1e-7, 1.0)).sum(axis=0)
+        combined = np.exp(log_probs - log_probs.max())
+        combined /= combined.sum()
+
+        pred_class_idx = int(np.argmax(combined))
+        model_name = ItemAnalyzer.CATEGORIES[pred_class_idx]
+        category = ItemAnalyzer.CATEGORY_MAP.get(model_name, "Other")
+        # Simulate defects & condition, seeded by the photos so they are stable
+        rng = np.random.default_rng(int(key[:16], 16))
+        condition_score = float(rng.uniform(0.7, 0.99))
+        defects = [str(d) for d in rng.choice(ItemAnalyzer.DEFECTS, size=rng.integers(0, 3), replace=False)]
+
+        return {
+            "category": category,
+            "model": model_name,
+            "condition_score": condition_score,
+            "defects": defects,
+            "confidence": float(combined[pred_class_idx]),
+            "per_image": [{
+                "model": ItemAnalyzer.CATEGORIES[int(np.argmax(probs))],
+                "confidence": float(np.max(probs)),
+                "probabilities": [float(p) for p in probs]
+            } for probs in pred_probs],
+            "embedding": None if embeddings is None else item_embedding(embeddings).tolist()
+        }
+
+
+def _per_category(categories, table, default):
+    """table.get(category, default) for every entry of an array, as floats."""
+    categories = np.asarray(categories, dtype=object)
+    values = np.empty((len(categories), *np.shape(default)), dtype=np.float64)
+    values[:] = default
+    for category, value in table.items():
+        values[categories == category] = value
+    return values
+
+
+class PricingEngine:
+    BASE_PRICES = {"Electronics": 500, "Appliances": 150, "Furniture": 200, "Clothing": 50}
+    DEFAULT_BASE_PRICE = 100
+
+    @staticmethod
+    def suggest_price(score, category, defects_count):
+        base = PricingEngine.BASE_PRICES.get(category, PricingEngine.DEFAULT_BASE_PRICE)
+        price = base * score * 1.1
+        price *= (1 - defects_count * 0.05)
+
+        return {
+            "suggested_price": float(price),
+            "min_price": float(price * 0.7),
+            "max_price": float(price * 1.3),
+            "quick_sale_price": float(price * 0.85)
+        }
+
+    @staticmethod
+    def suggest_prices(scores, categories, defects_counts):
+        """suggest_price for whole arrays at once; same keys, float64 arrays."""
+        price = _per_category(categories, PricingEngine.BASE_PRICES, PricingEngine.DEFAULT_BASE_PRICE)
+        price *= np.asarray(scores, dtype=np.float64)
+        price *= 1.1
+        price *= 1 - np.asarray(defects_counts) * 0.05
+        return {
+            "suggested_price": price,
+            "min_price": price * 0.7,
+            "max_price": price * 1.3,
+            "quick_sale_price": price * 0.85
+        }
+
+class LCACalculator:
+    IMPACT = {
+        'Electronics': {'co2': 50, 'water': 200, 'energy': 150},
+        'Appliances': {'co2': 30, 'water': 100, 'energy': 80},
+        'Furniture': {'co2': 20, 'water': 50, 'energy': 30},
+        'Clothing': {'co2': 5, 'water': 30, 'energy': 10},
+    }
+    DEFAULT_IMPACT = {'co2': 10, 'water': 50, 'energy': 20}
+
+    @staticmethod
+    def calculate(category, score):
+        imp = LCACalculator.IMPACT.get(category, LCACalculator.DEFAULT_IMPACT)
+        return {
+            "co2_saved": imp['co2'] * score,
+            "water_saved": imp['water'] * score,
+            "energy_saved": imp['energy'] * score,
+            "summary": LCACalculator.summary(imp['co2'] * score, imp['water'] * score, imp['energy'] * score)
+        }
+
+    @staticmethod
+    def summary(co2, water, energy):
+        return f"Reusing saves ~{co2:.0f}kg CO₂, {water:.0f}L water, {energy:.0f} kWh!"
+
+    @staticmethod
+    def calculate_many(categories, scores):
+        """calculate for whole arrays at once (without the summary text)."""
+        scores = np.asarray(scores, dtype=np.float64)
+        keys = ("co2", "water", "energy")
+        factors = _per_category(
+            categories,
+            {category: [imp[k] for k in keys] for category, imp in LCACalculator.IMPACT.items()},
+            [LCACalculator.DEFAULT_IMPACT[k] for k in keys]
+        )
+        return {
+            "co2_saved": factors[:, 0] * scores,
+            "water_saved": factors[:, 1] * scores,
+            "energy_saved": factors[:, 2] * scores
+        }
+
+class RecommendationEngine:
+    @staticmethod
+    def get_shops(lat, lon, radius=DEFAULT_RADIUS_KM, services=(), k=DEFAULT_K):
+        """The k nearest repair shops within `radius` km offering all `services`."""
+        return [
+            {**shop, "distance": distance}
+            for shop, distance in shop_index().nearest(lat, lon, radius, services, k)
+        ]
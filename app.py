@@ -1,27 +1,36 @@
 import streamlit as st
 from datetime import datetime
-import numpy as np
-import pandas as pd
 import hashlib
 import sqlite3
 from PIL import Image
 from auth import require_auth,login_signup_ui  # LOGIN SYSTEM
-import plotly
-import plotly.express
-import gdown
 import os
-from tensorflow.keras.models import load_model
-from tensorflow.keras.preprocessing.image import img_to_array, load_img
-import tensorflow as tf
-from utils import  save_listing, load_user_listings
+import html
+from utils import  save_listing, get_feed_page, list_feed_categories, best_match_truncated, RELEVANCE_WINDOW
+from utils import get_user_stats, get_listing_impacts, set_listing_status, get_user_listings_page
+from utils import get_user_coordinates, update_user_location
 from io import BytesIO
 from utils import init_db
-import base64
-import pydeck as pdk
+from imagestore import put_image, listing_image
+from chat_bus import message_bus
+from ai_core import (
+    ItemAnalyzer, PricingEngine, LCACalculator, RecommendationEngine,
+    load_cnn_model, model_ready, start_model_warmup, analysis_key
+    )
+from inference import needs_download
+from shops import SERVICES as SHOP_SERVICES, DEFAULT_RADIUS_KM
+from catalog import catalog, attach_images, PAGE_SIZE as CATALOG_PAGE_SIZE
+from similarity import save_embeddings, similar_listings, find_near_duplicates
+from session_memory import (
+    state_sizes, enforce_budget, record_session, sessions_report, evictions_total,
+    process_rss_bytes, is_admin, SESSION_BUDGET_MB
+    )
+from streamlit.runtime.scriptrunner import get_script_run_ctx
 from utils import (
     create_chatroom, send_message,
-    get_chatroom_messages, search_messages,DB_PATH,
-    list_user_chats,get_or_create_private_chat, user_can_access_chat
+    get_chatroom_messages, search_messages,DB_PATH, SNIPPET_START, SNIPPET_END,
+    list_user_chats,get_or_create_private_chat, user_can_access_chat,
+    mark_chat_read, UNREAD_CAP, MESSAGE_PAGE_SIZE
     )
 # =======================================================
 # PAGE CONFIG + CSS
@@ -58,7 +67,6 @@ st.markdown("""
 # =======================================================
 def init_session():
     defaults = {
-        "item_list": [],
         "nearby_shops": [],
         "selected_item": None,
         "user": None,
@@ -71,126 +79,9 @@ def init_session():
 init_session()
 init_db()
 
-MODEL_PATH = "item_analyzer_model.h5"
-GDRIVE_ID = "1zGqHM8xOEmNDj3EAuxxxruubNjL_Ksri"
-MODEL_URL = f"https://drive.google.com/uc?id={GDRIVE_ID}"
-
-@st.cache_resource
-def load_cnn_model():
-    # Download once if not present
-    if not os.path.exists(MODEL_PATH):
-        st.info("Downloading AI model…")
-        gdown.download(MODEL_URL, MODEL_PATH, quiet=False)
-    # Load model from local file
-    model = load_model(MODEL_PATH)
-    return model
-
-cnn_model = load_cnn_model()
-# =======================================================
-# SIMULATED AI CORE
-# =======================================================
-class ItemAnalyzer:
-    CATEGORIES = ['Camera', 'Chair', 'CoffeeMaker', 'Laptop', 'Shoe', 'Sofa']
-    DEFECTS = ['Scratch', 'Dent', 'Discoloration', 'Minor Crack', 'Wear & Tear', 'Screen Issues']
-
-    @staticmethod
-    def analyze_image(uploaded_file_or_pil):
-        # If already a PIL Image, use it; else open
-        if isinstance(uploaded_file_or_pil, Image.Image):
-            img = uploaded_file_or_pil
-        else:
-            img = Image.open(uploaded_file_or_pil).convert('RGB')
-
-        # Resize and normalize
-        img = img.resize((128, 128))
-        img_array = np.array(img) / 255.0
-        img_array = np.expand_dims(img_array, axis=0)
-
-        # Predict class
-        pred_probs = cnn_model.predict(img_array, verbose=0)
-        pred_class_idx = np.argmax(pred_probs, axis=1)[0]
-        model_name = ItemAnalyzer.CATEGORIES[pred_class_idx]
-        CATEGORY_MAP = {
-        "Camera": "Electronics",
-        "Laptop": "Electronics",
-        "CoffeeMaker": "Appliances",
-        "Chair": "Furniture",
-        "Sofa": "Furniture",
-        "Shoe": "Clothing"
-    }
-        category = CATEGORY_MAP.get(model_name, "Other")
-        # Simulate defects & condition
-        condition_score = float(np.random.uniform(0.7, 0.99))
-        defects = list(np.random.choice(ItemAnalyzer.DEFECTS, size=np.random.randint(0, 3), replace=False))
-
-        return {
-            "category": category,
-            "model": model_name,
-            "condition_score": condition_score,
-            "defects": defects,
-            "confidence": float(np.max(pred_probs))
-        }
-
-
-
-
-
-class PricingEngine:
-    @staticmethod
-    def suggest_price(score, category, defects_count):
-        base = {"Electronics": 500, "Appliances": 150, "Furniture": 200, "Clothing": 50}.get(category, 100)
-        price = base * score * 1.1
-        price *= (1 - defects_count * 0.05)
-
-        return {
-            "suggested_price": float(price),
-            "min_price": float(price * 0.7),
-            "max_price": float(price * 1.3),
-            "quick_sale_price": float(price * 0.85)
-        }
-
-class LCACalculator:
-    IMPACT = {
-        'Electronics': {'co2': 50, 'water': 200, 'energy': 150},
-        'Appliances': {'co2': 30, 'water': 100, 'energy': 80},
-        'Furniture': {'co2': 20, 'water': 50, 'energy': 30},
-        'Clothing': {'co2': 5, 'water': 30, 'energy': 10},
-    }
-
-    @staticmethod
-    def calculate(category, score):
-        imp = LCACalculator.IMPACT.get(category, {'co2': 10, 'water': 50, 'energy': 20})
-        return {
-            "co2_saved": imp['co2'] * score,
-            "water_saved": imp['water'] * score,
-            "energy_saved": imp['energy'] * score,
-            "summary": f"Reusing saves ~{imp['co2'] * score:.0f}kg CO₂, {imp['water'] * score:.0f}L water, {imp['energy'] * score:.0f} kWh!"
-        }
-
-class RecommendationEngine:
-    @staticmethod
-    def get_shops(lat, lon):
-        seed = int((lat * 1000 + lon * 1000)) % (2**32)
-        np.random.seed(seed)
-
-        shops = []
-        for i in range(np.random.randint(3, 7)):
-            shops.append({
-                "id": i,
-                "name": f"Repair Shop #{i+1}",
-                "distance": float(np.random.uniform(0.5, 5)),
-                "rating": float(np.random.uniform(4.0, 5.0)),
-                "reviews": np.random.randint(20, 200),
-                "eta_days": np.random.randint(1, 5),
-                "repair_cost_estimate": float(np.random.uniform(30, 150)),
-                "services": list(np.random.choice(
-                    ["Screen Fix", "Battery Replace", "Hardware Repair", "Water Damage"],
-                    size=np.random.randint(1, 3),
-                    replace=False
-                ))
-            })
-        return sorted(shops, key=lambda x: x["distance"])
-
+# Heavy ML imports and the model load happen off the request path; only the
+# Upload Item page waits for them
+start_model_warmup()
 # =======================================================
 # PAGES
 # =======================================================
@@ -216,6 +107,10 @@ def settings_page():
             location = st.text_input("Location", value=user.get("location", ""))
             user_type = st.selectbox("Account Type", ["Buyer", "Seller", "Repair Shop"], index=1)
         if st.button("💾 Save Changes", type="primary"):
+            if location != user.get("location"):
+                if update_user_location(user["email"], location) is None:
+                    st.warning("We couldn't place this location on the map, so distance filters won't include you.")
+                st.session_state.pop("feed", None)
             user["name"] = full_name
             user["location"] = location
             user["type"] = user_type
@@ -263,23 +158,50 @@ Upload the best possible photo for highest accuracy!
     st.markdown("## 📸 Upload & Analyze Item")
     uploaded_files = st.file_uploader("Upload item photos", type=["jpg","jpeg","png","webp"], accept_multiple_files=True)
     if uploaded_files:
+        if not model_ready():
+            if needs_download():
+                st.info("Downloading AI model…")
+            with st.spinner("Loading AI model…"):
+                load_cnn_model()
         uploaded_image=uploaded_files[0]
         st.success(f"{len(uploaded_files)} image(s) uploaded")
         img=Image.open(uploaded_image).convert("RGB")
         st.image(img,width=400)
-        analysis=ItemAnalyzer.analyze_image(img)
+        # All photos go through the model as one batch
+        analysis=ItemAnalyzer.analyze_images(uploaded_files)
         prices=PricingEngine.suggest_price(analysis["condition_score"],analysis["category"],len(analysis["defects"]))
         lca=LCACalculator.calculate(analysis["category"],analysis["condition_score"])
         st.metric("Category",analysis["category"])
         st.metric("Model",analysis["model"])
         st.metric("Condition",f"{analysis['condition_score']*100:.0f}%")
         st.metric("Confidence",f"{analysis['confidence']*100:.0f}%")
+        if len(uploaded_files)>1:
+            with st.expander("Per-photo results"):
+                for f,r in zip(uploaded_files,analysis["per_image"]):
+                    st.caption(f"{f.name}: {r['model']} ({r['confidence']*100:.0f}%)")
+        t=analysis["timings_ms"]
+        if analysis["cached"]:
+            st.caption("Analysis reused from cache (same photos as before)")
+        else:
+            st.caption(f"Analyzed in {t['total']:.0f} ms (decode {t['decode']:.0f} · resize {t['resize']:.0f} · inference {t['inference']:.0f})")
+        # Looked up once per set of photos, not on every rerun
+        photos_key=analysis_key(uploaded_files)
+        if st.session_state.get("upload_duplicates",{}).get("key")!=photos_key:
+            st.session_state.upload_duplicates={"key":photos_key,"items":find_near_duplicates(analysis["embedding"])}
+        duplicates=st.session_state.upload_duplicates["items"]
+        if duplicates:
+            st.warning("These photos look almost identical to listings already on SmartCycle:\n"+"\n".join(
+                f"- {d['analysis']['model']} by {'you' if d['user']==st.session_state.user['email'] else d['user']} ({d['similarity']*100:.0f}% match)"
+                for d in duplicates))
         description=st.text_area("Describe this item")
         if st.button("Create Listing"):
-            buf=BytesIO(); img.save(buf,format="PNG"); img_b64=base64.b64encode(buf.getvalue()).decode('utf-8')
-            item_data={"analysis":analysis,"prices":prices,"lca":lca,"description":description,"image":img_b64,"status":"active","timestamp":datetime.now().isoformat(),"user":st.session_state.user["email"]}
-            save_listing(st.session_state.user["email"],item_data)
-            st.session_state.item_list=load_user_listings(st.session_state.user["email"])
+            image_id=put_image(img)
+            # Kept in listing_embeddings for similarity search, not in the listing itself
+            embedding=analysis.pop("embedding")
+            item_data={"analysis":analysis,"prices":prices,"lca":lca,"description":description,"image_id":image_id,"status":"active","timestamp":datetime.now().isoformat(),"user":st.session_state.user["email"]}
+            item_id=save_listing(st.session_state.user["email"],item_data)
+            save_embeddings([item_id],[embedding])
+            st.session_state.pop("my_listings",None)
             st.success("Listing created successfully!"); st.balloons(); 
 
 
@@ -289,9 +211,13 @@ def dashboard_page():
     st.markdown("## 📊 Dashboard Overview")
     user = st.session_state.user
     user.setdefault("created_at", datetime.now())
-    user.setdefault("items_count", 0)
-    user.setdefault("co2_saved", 0)
-    my_items = [i for i in st.session_state.item_list if i.get("user") == user.get("email")]
+    stats = get_user_stats(user["email"])
+    # Summaries (no photos) of the pages viewed so far; "Load more" fetches the next
+    if "my_listings" not in st.session_state:
+        items, cursor = get_user_listings_page(user["email"])
+        st.session_state.my_listings = {"items": items, "cursor": cursor}
+    my_listings = st.session_state.my_listings
+    my_items = my_listings["items"]
 
     # ================= Quick Navigation =================
     st.markdown("### 🔹 Quick Navigation")
@@ -313,9 +239,9 @@ def dashboard_page():
 
     # ================= Metrics Row =================
     col1, col2, col3, col4 = st.columns(4)
-    with col1: st.metric("Items Listed", user.get('items_count', 0))
-    with col2: st.metric("CO₂ Saved", f"{user.get('co2_saved', 0):.0f} kg", delta="🌍")
-    with col3: st.metric("Green Score", f"{min(user.get('items_count',0)*10,100)}/100")
+    with col1: st.metric("Items Listed", stats["items_listed"])
+    with col2: st.metric("CO₂ Saved", f"{stats['co2_saved']:.0f} kg", delta="🌍")
+    with col3: st.metric("Green Score", f"{stats['green_score']}/100")
     with col4: st.metric("Member Since", user["created_at"].strftime("%b %Y"))
 
     st.divider()
@@ -328,30 +254,41 @@ def dashboard_page():
         st.markdown("### Your Active Listings")
         if my_items:
             for item in my_items:
-                img_data = item["image"]
-                if isinstance(img_data, str):
-                    img_bytes = base64.b64decode(img_data)
-                    st.image(img_bytes, width=300)
+                img_data = listing_image(item, "dashboard")
+                if img_data is not None:
+                    st.image(img_data, width=150)
+
+                st.markdown(f"**Model:** {item['model']} | **Category:** {item['category']}")
+                st.markdown(f"**Condition:** {item['condition_score']*100:.0f}% | **Price:** ${item['suggested_price']:.0f}")
+                st.markdown(f"**Description:** {item['description'] or 'No description'}")
+                if item["status"] == "active":
+                    if st.button("Mark as sold", key=f"sold_{item['id']}"):
+                        set_listing_status(item["id"], user["email"], "sold")
+                        item["status"] = "sold"
+                        # The feed only shows active listings
+                        st.session_state.pop("feed",None)
+                        st.rerun()
                 else:
-                    st.image(img_data, width=300)
-
-                st.markdown(f"**Model:** {item['analysis']['model']} | **Category:** {item['analysis']['category']}")
-                st.markdown(f"**Condition:** {item['analysis']['condition_score']*100:.0f}% | **Price:** ${item['prices']['suggested_price']:.0f}")
-                st.markdown(f"**Description:** {item.get('description','No description')}")
+                    st.caption(f"Status: {item['status']}")
                 st.divider()
+            if my_listings["cursor"] is not None and st.button("Load more", key="more_listings", use_container_width=True):
+                items, cursor = get_user_listings_page(user["email"], before_id=my_listings["cursor"])
+                my_items.extend(items)
+                my_listings["cursor"] = cursor
+                st.rerun()
         else:
             st.info("You haven't listed any items yet.")
 
     # ===== Impact Report =====
     with tab2:
         st.markdown("### Environmental Impact Summary")
-        if my_items:
-            impact_df = pd.DataFrame([{
-                "Item": i['analysis']['model'],
-                "CO₂ (kg)": i['lca']['co2_saved'],
-                "Water (L)": i['lca']['water_saved'],
-                "Energy (kWh)": i['lca']['energy_saved'],
-            } for i in my_items])
+        if stats["items_listed"]:
+            import pandas as pd
+            import plotly.express
+            impact_df = pd.DataFrame(
+                get_listing_impacts(user["email"]),
+                columns=["Item", "CO₂ (kg)", "Water (L)", "Energy (kWh)"]
+            )
             fig = plotly.express.bar(
                 impact_df,
                 x="Item",
@@ -362,56 +299,58 @@ def dashboard_page():
             st.plotly_chart(fig, use_container_width=True)
             st.subheader("Total Environmental Savings")
             st.markdown(f"""
-            - **CO₂ Saved:** {impact_df['CO₂ (kg)'].sum():.0f} kg  
-            - **Water Saved:** {impact_df['Water (L)'].sum():.0f} L  
-            - **Energy Saved:** {impact_df['Energy (kWh)'].sum():.0f} kWh  
+            - **CO₂ Saved:** {stats['co2_saved']:.0f} kg  
+            - **Water Saved:** {stats['water_saved']:.0f} L  
+            - **Energy Saved:** {stats['energy_saved']:.0f} kWh  
             """)
         else:
             st.info("Impact data will appear once you upload items 🌱")
   
 # ====================== Marketplace Page ======================
+MARKETPLACE_SORT_OPTIONS = {
+    "Newest": "newest",
+    "Price: Low to High": "price_asc",
+    "Price: High to Low": "price_desc",
+    "Eco Impact": "eco",
+}
+
 def marketplace_page():
     back_button()
     """Browse and search marketplace"""
     st.markdown("## 🛒 Marketplace")
+    listings = catalog()
     
     col1, col2, col3, col4 = st.columns(4)
     with col1:
-        category_filter = st.selectbox("Category", ["All", "Electronics", "Appliances", "Furniture", "Clothing"])
+        category_filter = st.selectbox("Category", ["All"] + listings.categories())
     with col2:
         price_range = st.slider("Price Range", 0, 1000, (0, 1000))
     with col3:
         condition_min = st.slider("Min Condition", 0.0, 1.0, 0.5, step=0.1)
     with col4:
-        sort_by = st.selectbox("Sort By", ["Newest", "Price: Low to High", "Price: High to Low", "Eco Impact"])
-    
-    # Ensure items is a list
-    filtered_items = list(st.session_state.get('items', []))
-    
-    if category_filter != "All":
-        filtered_items = [i for i in filtered_items if i['analysis']['category'] == category_filter]
-    
-    filtered_items = [i for i in filtered_items 
-                     if price_range[0] <= i['prices']['suggested_price'] <= price_range[1]]
+        sort_by = st.selectbox("Sort By", list(MARKETPLACE_SORT_OPTIONS))
     
-    filtered_items = [i for i in filtered_items 
-                     if i['analysis']['condition_score'] >= condition_min]
-    
-    # Sorting logic...
-
-    # Sort
-    if sort_by == "Price: Low to High":
-        filtered_items.sort(key=lambda x: x['prices']['suggested_price'])
-    elif sort_by == "Price: High to Low":
-        filtered_items.sort(key=lambda x: x['prices']['suggested_price'], reverse=True)
-    elif sort_by == "Eco Impact":
-        filtered_items.sort(key=lambda x: x['lca']['co2_saved'], reverse=True)
+    # Filters and sorts run against the shared catalog cache; the session
+    # only remembers how far down the results it has scrolled
+    query = {
+        "category": None if category_filter == "All" else category_filter,
+        "min_price": price_range[0],
+        "max_price": price_range[1],
+        "min_condition": condition_min,
+        "sort": MARKETPLACE_SORT_OPTIONS[sort_by],
+    }
+    view = st.session_state.get("marketplace")
+    if view is None or view["query"] != query:
+        view = {"query": query, "limit": CATALOG_PAGE_SIZE}
+        st.session_state.marketplace = view
+    filtered_items, total = listings.query(**query, limit=view["limit"])
     
     if not filtered_items:
         st.info("📭 No items found. Try adjusting filters.")
         return
     
-    st.markdown(f"### Found {len(filtered_items)} item(s)")
+    st.markdown(f"### Found {total} item(s)")
+    attach_images(filtered_items)
     
     # Display items in a grid
     cols = st.columns(3)
@@ -422,32 +361,29 @@ def marketplace_page():
                 unsafe_allow_html=True
             )
             # Use uploaded image if exists, else placeholder
-            if 'image' in item:
-                st.image(item['image'], width=150)
+            img_data = listing_image(item, "dashboard")
+            if img_data is not None:
+                st.image(img_data, width=150)
             else:
-                st.image(f"https://via.placeholder.com/150?text={item['analysis']['model']}")
+                st.image(f"https://via.placeholder.com/150?text={item['model']}")
             
-            st.markdown(f"**{item['analysis']['model']}**")
-            st.caption(f"Category: {item['analysis']['category']}")
-            st.caption(f"Condition: {item['analysis']['condition_score']*100:.0f}%")
-            st.metric("Price", f"${item['prices']['suggested_price']:.0f}")
-            st.caption(f"CO₂ Saved: {item['lca']['co2_saved']:.0f}kg")
+            st.markdown(f"**{item['model']}**")
+            st.caption(f"Category: {item['category']}")
+            st.caption(f"Condition: {item['condition_score']*100:.0f}%")
+            st.metric("Price", f"${item['suggested_price']:.0f}")
+            st.caption(f"CO₂ Saved: {item['co2_saved']:.0f}kg")
             
             if st.button("View Details", key=f"item_{item['id']}"):
                 st.session_state.selected_item = item
-                st.experimental_rerun()
+                st.rerun()
             
             st.markdown("</div>", unsafe_allow_html=True)
 
+    if total > len(filtered_items) and st.button("Load more", key="more_marketplace", use_container_width=True):
+        view["limit"] += CATALOG_PAGE_SIZE
+        st.rerun()
+
 # ====================== Repair Shops Page ======================
-CITY_COORDS = {
-    "Mumbai": (19.0760, 72.8777),
-    "Delhi": (28.7041, 77.1025),
-    "Bengaluru": (12.9716, 77.5946),
-    "Chennai": (13.0827, 80.2707),
-    "Kolkata": (22.5726, 88.3639),
-    "Hyderabad": (17.3850, 78.4867),
-}
 def repair_shops_page():
     back_button()
     st.markdown("## 🔧 Find Repair Shops")
@@ -458,7 +394,7 @@ def repair_shops_page():
     with col1:
         service_filter = st.selectbox(
             "Filter by Service",
-            ["All", "Screen Fix", "Battery Replace", "Hardware Repair", "Water Damage"]
+            ["All"] + SHOP_SERVICES
         )
         
     with col2:
@@ -469,14 +405,25 @@ def repair_shops_page():
         
     with col3:
         search_text = st.text_input("Search Shop Name")
+
+    # --- Search Location (defaults to the user's own) ---
+    home_lat, home_lon = get_user_coordinates(st.session_state.user["email"]) or (19.07, 72.87)
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        lat = st.number_input("Latitude", -90.0, 90.0, home_lat, format="%.4f")
+    with col2:
+        lon = st.number_input("Longitude", -180.0, 180.0, home_lon, format="%.4f")
+    with col3:
+        radius = st.slider("Radius (km)", 1, 100, DEFAULT_RADIUS_KM)
     
-    # --- Load Shops (simulated / DB) ---
+    # --- Load Shops (spatial index over the repair_shops table) ---
     if st.button("🔍 Search Shops", type="primary"):
-        st.session_state.nearby_shops = RecommendationEngine.get_shops(0, 0)  # lat/lon ignored here
+        services = [] if service_filter == "All" else [service_filter]
+        st.session_state.nearby_shops = RecommendationEngine.get_shops(lat, lon, radius, services, k=20)
 
     # --- Display Shops ---
     if 'nearby_shops' in st.session_state:
-        shops = st.session_state.nearby_shops
+        shops = list(st.session_state.nearby_shops)
         
         # --- Apply Filters ---
         if service_filter != "All":
@@ -491,16 +438,13 @@ def repair_shops_page():
         elif sort_by == "Repair Cost":
             shops.sort(key=lambda x: x['repair_cost_estimate'])
         elif sort_by == "Distance":
-            shops.sort(key=lambda x: x['distance'])  # simulated
+            shops.sort(key=lambda x: x['distance'])
         
         st.markdown(f"### Found {len(shops)} Repair Shops")
         
         # --- Display Shop Cards ---
         for shop in shops:
-            # Simulated coordinates for map link
-            shop_lat = 19.07 + np.random.uniform(-0.05, 0.05)
-            shop_lng = 72.87 + np.random.uniform(-0.05, 0.05)
-            maps_url = f"https://www.google.com/maps/search/?api=1&query={shop_lat},{shop_lng}"
+            maps_url = f"https://www.google.com/maps/search/?api=1&query={shop['lat']},{shop['lon']}"
             
             st.markdown(
                 f"<div style='border:1px solid #e5e7eb; padding:16px; border-radius:12px; margin:8px; background:white'>",
@@ -530,6 +474,69 @@ def repair_shops_page():
 
 
 
+def highlight_snippet(snippet):
+    # Escape the message text, then turn the FTS match markers into <mark> tags
+    return (html.escape(snippet)
+            .replace(SNIPPET_START, "<mark>")
+            .replace(SNIPPET_END, "</mark>"))
+
+def unread_label(count):
+    return f"{UNREAD_CAP - 1}+" if count >= UNREAD_CAP else str(count)
+
+CHAT_REFRESH_SECONDS = 2
+
+def load_chat_history(chatroom_id):
+    # Messages already shown stay in session state. After the first load the
+    # database is only asked for the delta, and only when the message bus says
+    # the room has something newer than what we hold.
+    rooms = st.session_state.setdefault("chat_history", {})
+    history = rooms.get(chatroom_id)
+    if history is None:
+        messages = get_chatroom_messages(chatroom_id)
+        history = {"messages": messages, "has_older": len(messages) == MESSAGE_PAGE_SIZE, "read_id": None}
+        rooms[chatroom_id] = history
+        return history
+
+    while True:
+        newest_id = history["messages"][-1]["id"] if history["messages"] else 0
+        if not message_bus.has_new(chatroom_id, newest_id):
+            return history
+        new = get_chatroom_messages(chatroom_id, after_id=newest_id)
+        history["messages"].extend(new)
+        if len(new) < MESSAGE_PAGE_SIZE:
+            return history
+
+@st.fragment(run_every=CHAT_REFRESH_SECONDS)
+def chat_messages(chatroom_id, unread):
+    # Re-runs on its own every few seconds without rerunning the page; an idle
+    # tab costs a dictionary lookup on the message bus, not a query.
+    history = load_chat_history(chatroom_id)
+    messages = history["messages"]
+
+    if history["has_older"] and st.button("⬆️ Load earlier messages"):
+        older = get_chatroom_messages(chatroom_id, before_id=messages[0]["id"])
+        history["messages"] = messages = older + messages
+        history["has_older"] = len(older) == MESSAGE_PAGE_SIZE
+
+    chat_container = st.container()
+    with chat_container:
+        for msg in messages:
+            sender = msg["sender"]
+            txt = msg["message"]
+            t = msg["time"]
+
+            if sender == st.session_state.user["email"]:
+                st.chat_message("user").write(f"{txt}\n\n*{t}*")
+            else:
+                st.chat_message("assistant").write(f"**{sender}:** {txt}\n\n*{t}*")
+
+    newest_id = messages[-1]["id"] if messages else 0
+    if history["read_id"] is None and not unread:
+        history["read_id"] = newest_id
+    if newest_id > (history["read_id"] or 0):
+        mark_chat_read(chatroom_id, st.session_state.user["email"], newest_id)
+        history["read_id"] = newest_id
+
 def chat_page():
     import sqlite3
     from datetime import datetime
@@ -574,7 +581,14 @@ def chat_page():
     # Create default chatroom if none
     if not chatrooms:
         default_id = create_chatroom("General Support")
-        chatrooms = [{"id": default_id, "name": "General Support"}]
+        chatrooms = [{"id": default_id, "name": "General Support", "unread": 0}]
+
+    # Access decisions are cached per session; every listed room is accessible
+    chat_access = st.session_state.setdefault("chat_access", {})
+    for room in chatrooms:
+        chat_access[(st.session_state.user["email"], room["id"])] = True
+    room_names = {room["id"]: room["name"] for room in chatrooms}
+    room_unread = {room["id"]: room.get("unread", 0) for room in chatrooms}
 
     col1, col2 = st.columns([1, 2])
 
@@ -602,22 +616,23 @@ def chat_page():
                     border:1px solid #d6ddea;
                     font-size:14px;
                 ">
-                    <strong>{r['sender']}</strong> in <em>{r['chatroom_name']}</em>:<br>
-                    {r['message']}
+                    <strong>{html.escape(r['sender'])}</strong> in <em>{html.escape(r['chatroom_name'])}</em>:<br>
+                    {highlight_snippet(r['snippet'])}
                 </div>
                 """, unsafe_allow_html=True)
             st.stop()
 
         st.markdown("### 💬 Chatrooms")
-        selected_chat_name = st.radio(
+        selected_chat_id = st.radio(
             "",
-            [room["name"] for room in chatrooms],
+            list(room_names),
+            format_func=lambda room_id: (
+                f"{room_names[room_id]} ({unread_label(room_unread[room_id])})"
+                if room_unread[room_id] else room_names[room_id]
+            ),
             label_visibility="collapsed"
         )
-
-        selected_chat_id = next(
-            room["id"] for room in chatrooms if room["name"] == selected_chat_name
-        )
+        selected_chat_name = room_names[selected_chat_id]
 
         # ---------------- Create Chatroom ----------------
         st.markdown("#### ➕ Create Chatroom")
@@ -644,26 +659,18 @@ def chat_page():
     with col2:
         if "force_chat_id" in st.session_state:
             selected_chat_id = st.session_state["force_chat_id"]
+            selected_chat_name = room_names.get(selected_chat_id, selected_chat_name)
             st.session_state.pop("force_chat_id", None)
 
         st.markdown(f"### 💬 Chat: **{selected_chat_name}**")
-        if not user_can_access_chat(selected_chat_id, st.session_state.user["email"]):
+        access_key = (st.session_state.user["email"], selected_chat_id)
+        if access_key not in chat_access:
+            chat_access[access_key] = user_can_access_chat(selected_chat_id, st.session_state.user["email"])
+        if not chat_access[access_key]:
             st.error("🚫 You are not authorized to view this chat.")
             st.stop()
 
-        messages = get_chatroom_messages(selected_chat_id)
-
-        chat_container = st.container()
-        with chat_container:
-            for msg in messages:
-                sender = msg["sender"]
-                txt = msg["message"]
-                t = msg["time"]
-
-                if sender == st.session_state.user["email"]:
-                    st.chat_message("user").write(f"{txt}\n\n*{t}*")
-                else:
-                    st.chat_message("assistant").write(f"**{sender}:** {txt}\n\n*{t}*")
+        chat_messages(selected_chat_id, room_unread.get(selected_chat_id, 0))
 
         msg_input = st.chat_input("Type your message...")
         if msg_input:
@@ -671,83 +678,106 @@ def chat_page():
             st.rerun()
 
 
+FEED_SORT_OPTIONS = {
+    "Best Match": "relevance",
+    "Newest": "newest",
+    "Price: Low to High": "price_asc",
+    "Price: High to Low": "price_desc",
+    "Condition": "condition",
+}
+FEED_RADIUS_OPTIONS = {"Anywhere": None, "5 km": 5, "10 km": 10, "25 km": 25, "50 km": 50, "100 km": 100}
+SIMILAR_ITEMS = 6
+
+def similar_items_section():
+    """Listings that look like the one whose "Similar items" was clicked (kept as similar_to)."""
+    source = st.session_state.get("similar_to")
+    if source is None:
+        return
+    st.markdown(f"### 🔁 Looks like: {source['model']}")
+    items = similar_listings(source["id"], k=SIMILAR_ITEMS)
+    if not items:
+        st.info("No visually similar listings found yet.")
+    cols = st.columns(SIMILAR_ITEMS)
+    for col, item in zip(cols, items):
+        with col:
+            img_data = listing_image(item, "dashboard")
+            if img_data is not None:
+                st.image(img_data, width=150)
+            st.markdown(f"**{item['analysis']['model']}**")
+            st.caption(f"${item['prices']['suggested_price']:.0f} · {item['similarity']*100:.0f}% match")
+            if st.button("Contact Seller", key=f"similar_contact_{item['id']}"):
+                st.session_state.selected_item = item
+                st.session_state.page = "Messages"
+                st.rerun()
+    if st.button("Clear", key="clear_similar"):
+        st.session_state.pop("similar_to", None)
+        st.rerun()
+    st.divider()
+
 def feed_page():
     back_button()
     st.markdown("## 🌐 Community Feed")
     st.caption("View all items uploaded by users across SmartCycle.")
 
-    # ------------------------- Load all items from DB -------------------------
-    all_users_items = []
-    # Assuming you have a list of all registered users in DB
-    import sqlite3, json
-    from utils import DB_PATH
-
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("SELECT email FROM users")
-    users = c.fetchall()
-
-    for (email,) in users:
-        c.execute("SELECT data_json FROM items WHERE user_email=? ORDER BY id DESC", (email,))
-        rows = c.fetchall()
-        for row in rows:
-            item = json.loads(row[0])
-            item["user"] = email  # Add email as seller
-            all_users_items.append(item)
-    conn.close()
-
-    if not all_users_items:
+    categories = list_feed_categories()
+    if not categories:
         st.info("No items available in the feed yet. Upload something to get started!")
         return
 
     # ------------------------- Filters -------------------------
     st.markdown("### 🔍 Filters")
-    col1, col2, col3 = st.columns(3)
+    col1, col2, col3, col4 = st.columns(4)
 
     with col1:
-        category_filter = st.selectbox(
-            "Category",
-            ["All"] + sorted({item["analysis"]["category"] for item in all_users_items})
-        )
+        category_filter = st.selectbox("Category", ["All"] + categories)
 
     with col2:
-        sort_by = st.selectbox(
-            "Sort By",
-            ["Newest", "Price: Low to High", "Price: High to Low", "Condition"]
-        )
+        sort_by = st.selectbox("Sort By", list(FEED_SORT_OPTIONS))
 
     with col3:
-        search = st.text_input("Search Model")
-
-    # ------------------------- Apply Filters -------------------------
-    filtered = all_users_items
-
-    if category_filter != "All":
-        filtered = [i for i in filtered if i["analysis"]["category"] == category_filter]
+        search = st.text_input("Search", placeholder="Model, category or description")
 
-    if search.strip():
-        filtered = [i for i in filtered if search.lower() in i["analysis"]["model"].lower()]
-
-    # Sort
-    if sort_by == "Newest":
-        filtered = sorted(filtered, key=lambda x: x.get("timestamp",""), reverse=True)
-    elif sort_by == "Price: Low to High":
-        filtered = sorted(filtered, key=lambda x: x['prices']['suggested_price'])
-    elif sort_by == "Price: High to Low":
-        filtered = sorted(filtered, key=lambda x: x['prices']['suggested_price'], reverse=True)
-    elif sort_by == "Condition":
-        filtered = sorted(filtered, key=lambda x: x['analysis']['condition_score'], reverse=True)
+    with col4:
+        within = st.selectbox("Within", list(FEED_RADIUS_OPTIONS))
+
+    radius_km = FEED_RADIUS_OPTIONS[within]
+    near = get_user_coordinates(st.session_state.user["email"]) if radius_km else None
+    if radius_km and near is None:
+        st.caption("Set a recognisable city in Settings to filter by distance.")
+        radius_km = None
+
+    # ------------------------- Load Page -------------------------
+    # Pages already fetched for the current filters stay in session state;
+    # "Load more" only queries the next page.
+    query = {
+        "category": None if category_filter == "All" else category_filter,
+        "search": search.strip() or None,
+        "status": "active",
+        "sort": FEED_SORT_OPTIONS[sort_by],
+        "near": near,
+        "radius_km": radius_km,
+    }
+    feed = st.session_state.get("feed")
+    if feed is None or feed["query"] != query:
+        items, cursor = get_feed_page(**query)
+        truncated = query["sort"] == "relevance" and best_match_truncated(query["search"])
+        feed = {"query": query, "items": items, "cursor": cursor, "truncated": truncated}
+        st.session_state.feed = feed
 
     st.divider()
+    similar_items_section()
 
     # ------------------------- Display Feed -------------------------
     st.markdown("### 📦 All Listings")
-    cols = st.columns(3)
+    if feed["truncated"]:
+        st.caption(f"Best Match ranks the newest {RELEVANCE_WINDOW:,} matches; older ones follow, newest first.")
+    if not feed["items"]:
+        st.info("No listings match these filters.")
+        return
 
-    import base64
-    from io import BytesIO
+    cols = st.columns(3)
 
-    for idx, item in enumerate(filtered):
+    for idx, item in enumerate(feed["items"]):
         with cols[idx % 3]:
             st.markdown("""
                 <div style="
@@ -759,13 +789,10 @@ def feed_page():
                 ">
             """, unsafe_allow_html=True)
 
-            # ----- Image decoding -----
-            if "image" in item and item["image"]:
-                try:
-                    img_bytes = base64.b64decode(item["image"])
-                    st.image(img_bytes, width=300)
-                except Exception as e:
-                    st.image("https://via.placeholder.com/300?text=No+Image")
+            # ----- Image -----
+            img_data = listing_image(item, "feed")
+            if img_data is not None:
+                st.image(img_data, width=300)
             else:
                 st.image("https://via.placeholder.com/300?text=No+Image")
 
@@ -777,36 +804,88 @@ def feed_page():
             st.caption(f"Seller: {item['user']}")
 
             # ----- Contact Seller -----
-            if st.button("Contact Seller", key=f"contact_{idx}"):
+            if st.button("Contact Seller", key=f"contact_{item['id']}"):
                 st.session_state.selected_item = item
                 st.session_state.page = "Messages"
                 st.rerun()
 
+            if st.button("🔍 Similar items", key=f"similar_{item['id']}"):
+                st.session_state.similar_to = {"id": item["id"], "model": item["analysis"]["model"]}
+                st.rerun()
+
             st.markdown("</div>", unsafe_allow_html=True)
 
+    if feed["cursor"] is not None and st.button("Load more", use_container_width=True):
+        items, cursor = get_feed_page(**query, cursor=feed["cursor"])
+        feed["items"].extend(items)
+        feed["cursor"] = cursor
+        st.rerun()
+
+# ====================== Diagnostics ======================
+def account_session_memory():
+    # Measured at the start of each run, i.e. what the session kept from the last one
+    sizes = state_sizes(st.session_state)
+    evicted = enforce_budget(st.session_state, sizes=sizes)
+    if evicted:
+        sizes = state_sizes(st.session_state)
+    ctx = get_script_run_ctx()
+    record_session(ctx.session_id if ctx else "local", st.session_state.user["email"], sizes, evicted)
+
+def diagnostics_page():
+    st.markdown("## 🩺 Diagnostics")
+    sessions = sessions_report()
+    mb = lambda n: f"{n / 1024 / 1024:.2f} MB" if n >= 1024 * 1024 else f"{n / 1024:.1f} KB"
+
+    col1, col2, col3, col4 = st.columns(4)
+    with col1: st.metric("Process RSS", mb(process_rss_bytes()))
+    with col2: st.metric("Sessions", len(sessions))
+    with col3: st.metric("Session state", mb(sum(s["total"] for s in sessions)))
+    with col4: st.metric("Evictions", evictions_total())
+    st.caption(f"Per-session budget: {SESSION_BUDGET_MB:g} MB (SMARTCYCLE_SESSION_BUDGET_MB)")
+    listings = catalog()
+    st.caption(f"Shared catalog cache: {len(listings)} listings, {mb(listings.nbytes())}, version {listings.version}")
+
+    st.markdown("### Sessions")
+    st.dataframe([{
+        "Session": s["session"][:8],
+        "User": s["user"],
+        "Size": mb(s["total"]),
+        "Largest keys": ", ".join(f"{k} ({mb(v)})" for k, v in list(s["sizes"].items())[:3]),
+        "Last run": datetime.fromtimestamp(s["updated_at"]).strftime("%H:%M:%S"),
+    } for s in sessions], use_container_width=True)
+
+    st.markdown("### This session")
+    st.dataframe([{"Key": k, "Bytes": v} for k, v in state_sizes(st.session_state).items()], use_container_width=True)
+
 # ====================== Main ======================
 def main():
     require_auth()
     if st.session_state.user is None:
         return
 
+    account_session_memory()
+
     st.sidebar.markdown(f"### 👤 {st.session_state.user['name']}")
+    pages = ["Dashboard", "Marketplace", "Upload Item", "Repair Shops","Messages",   # <-- add this
+    "Feed","Settings"]
+    if is_admin(st.session_state.user):
+        pages.append("Diagnostics")
     nav = st.sidebar.radio(
         "Navigation",
-        ["Dashboard", "Upload Item", "Repair Shops","Messages",   # <-- add this
-    "Feed","Settings"],
-        index=["Dashboard", "Upload Item", "Repair Shops","Messages",   # <-- add this
-    "Feed","Settings"].index(st.session_state.page)
+        pages,
+        index=pages.index(st.session_state.page) if st.session_state.page in pages else 0
     )
 
     if st.sidebar.button("Logout"):
         st.session_state.user = None
         st.session_state.page = "Dashboard"
+        st.session_state.pop("my_listings", None)
         st.stop()
 
     st.session_state.page = nav
 
     if nav == "Dashboard": dashboard_page()
+    elif nav == "Marketplace": marketplace_page()
     elif nav == "Upload Item": upload_item_page()
 
     elif nav == "Repair Shops": repair_shops_page()
@@ -814,6 +893,7 @@ def main():
     elif nav == "Messages": 
         chat_page()
     elif nav == "Feed": feed_page()    
+    elif nav == "Diagnostics": diagnostics_page()
 if __name__ == "__main__":
     main()
 
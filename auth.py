@@ -1,6 +1,6 @@
 # auth.py
 import streamlit as st
-from utils import create_user, get_user_by_email, update_last_login, hash_password, load_user_listings, init_db
+from utils import create_user, get_user_by_email, update_last_login, hash_password, init_db
 
 # Initialize DB at start
 init_db()
@@ -44,7 +44,6 @@ def login_signup_ui():
                 "location": location
             }
 
-            st.session_state.item_list = load_user_listings(email)
             st.session_state.page = "Dashboard"
             st.rerun()
 
@@ -67,7 +66,6 @@ def login_signup_ui():
             }
 
             update_last_login(email)
-            st.session_state.item_list = load_user_listings(email)
 
             st.success("Logged in successfully!")
             st.session_state.page = "Dashboard"
@@ -0,0 +1,128 @@
+"""Shared Marketplace catalog cache: build, incremental refresh and query cost.
+
+Builds a migrated database of N listings, then times the first catalog
+build, a refresh after a single new listing and after a status change, and
+Marketplace queries against the cache next to the equivalent SQL. Also
+compares the cache's footprint with every session holding its own list of
+listing dicts.
+
+    python benchmarks/bench_catalog.py --listings 1000000
+"""
+import argparse
+import random
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import catalog  # noqa: E402
+import utils  # noqa: E402
+from session_memory import deep_sizeof  # noqa: E402
+
+CATEGORIES = ["Electronics", "Appliances", "Furniture", "Clothing"]
+MODELS = ["Camera", "Chair", "CoffeeMaker", "Laptop", "Shoe", "Sofa"]
+
+QUERIES = {
+    "newest": dict(min_price=0, max_price=1000, min_condition=0.5, sort="newest"),
+    "Furniture, cheapest": dict(category="Furniture", min_price=0, max_price=1000, min_condition=0.5, sort="price_asc"),
+    "$100-200, eco impact": dict(min_price=100, max_price=200, min_condition=0.5, sort="eco"),
+    "condition >= 0.9, priciest": dict(min_condition=0.9, sort="price_desc"),
+}
+SQL_SORTS = {"newest": "id DESC", "price_asc": "suggested_price, id", "price_desc": "suggested_price DESC, id DESC",
+             "eco": "co2_saved DESC, id DESC"}
+
+
+def build(n, users=5000):
+    rng = random.Random(0)
+    with utils.db_connection() as conn:
+        conn.executemany("""
+            INSERT INTO items (user_email, data_json, created_at, category, model,
+                               condition_score, suggested_price, co2_saved, status)
+            VALUES (?, '{}', ?, ?, ?, ?, ?, ?, ?)
+        """, ((
+            f"user{rng.randrange(users)}@example.com", f"2025-01-01T{i:09d}", rng.choice(CATEGORIES),
+            rng.choice(MODELS), rng.uniform(0.5, 0.99), rng.uniform(10, 600), rng.uniform(1, 50),
+            rng.choice(["active"] * 9 + ["sold"]),
+        ) for i in range(n)))
+
+
+def sql_query(category=None, min_price=None, max_price=None, min_condition=None, sort="newest", limit=24):
+    where, params = ["status = 'active'"], []
+    for clause, value in (("category = ?", category), ("suggested_price >= ?", min_price),
+                          ("suggested_price <= ?", max_price), ("condition_score >= ?", min_condition)):
+        if value is not None:
+            where.append(clause)
+            params.append(value)
+    with utils.db_connection() as conn:
+        total = conn.execute(f"SELECT COUNT(*) FROM items WHERE {' AND '.join(where)}", params).fetchone()[0]
+        rows = conn.execute(f"SELECT id FROM items WHERE {' AND '.join(where)} ORDER BY {SQL_SORTS[sort]} LIMIT ?",
+                            params + [limit]).fetchall()
+    return [r[0] for r in rows], total
+
+
+def timed(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        times.append((time.perf_counter() - start) * 1000)
+    return statistics.median(times), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--listings", type=int, default=1_000_000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        utils.DB_PATH = Path(workdir) / "bench.db"
+        utils.init_db()
+        build(args.listings)
+
+        build_ms, cache = timed(catalog.catalog, 1)
+        print(f"{len(cache)} active listings cached in {build_ms / 1000:.2f}s, {cache.nbytes() / 1e6:.1f} MB")
+        sample = [{"id": i, "model": "Laptop", "category": "Electronics", "condition_score": 0.9,
+                   "suggested_price": 123.4, "co2_saved": 12.3, "user": f"user{i % 5000}@example.com"}
+                  for i in range(10_000)]
+        per_session = deep_sizeof(sample) / len(sample) * len(cache)
+        print(f"the same summaries as dicts, per session: {per_session / 1e6:.0f} MB\n")
+
+        utils.save_listing("new@example.com", {
+            "analysis": {"category": "Furniture", "model": "Chair", "condition_score": 0.8},
+            "prices": {"suggested_price": 42.0}, "lca": {"co2_saved": 5.0}, "status": "active",
+        })
+        new_ms, _ = timed(catalog.catalog, 1)
+        with utils.db_connection() as conn:
+            conn.execute("UPDATE items SET status = 'sold' WHERE id = 1")
+        sold_ms, _ = timed(catalog.catalog, 1)
+        idle_ms, _ = timed(catalog.catalog, args.repeat)
+        print(f"refresh: unchanged {idle_ms:.2f} ms, one new listing {new_ms:.1f} ms, one sold {sold_ms:.1f} ms\n")
+
+        print(f"{'query':<28} {'matches':>8} {'cache ms':>9} {'sql ms':>8}")
+        for name, q in QUERIES.items():
+            cache_ms, (page, total) = timed(lambda: cache.query(**q), args.repeat)
+            sql_ms, (ids, sql_total) = timed(lambda: sql_query(**q), 3)
+            assert sql_total == total, name
+            print(f"{name:<28} {total:>8} {cache_ms:>9.2f} {sql_ms:>8.1f}")
+
+        # At the cap, new listings evict the oldest instead of rebuilding
+        catalog.MAX_LISTINGS = len(cache)
+        rebuilds, times = cache.rebuilds, []
+        for _ in range(10):
+            newest = utils.save_listing("new@example.com", {
+                "analysis": {"category": "Furniture", "model": "Chair", "condition_score": 0.8},
+                "prices": {"suggested_price": 42.0}, "lca": {"co2_saved": 5.0}, "status": "active",
+            })
+            ms, _ = timed(catalog.catalog, 1)
+            times.append(ms)
+            assert cache.rebuilds == rebuilds and len(cache) == catalog.MAX_LISTINGS
+            assert cache.query(sort="newest", limit=1)[0][0]["id"] == newest
+        print(f"\nat the cap: one new listing {statistics.median(times):.1f} ms, no rebuilds")
+        utils.get_pool().close()
+
+
+if __name__ == "__main__":
+    main()
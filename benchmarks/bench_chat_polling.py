@@ -0,0 +1,104 @@
+"""Database queries per minute with many idle chat tabs open.
+
+Simulates a minute of wall-clock time in which N tabs refresh every few
+seconds while a handful of messages are posted, and counts the queries that
+reach SQLite for:
+
+  naive      every tab re-reads the whole room on each refresh
+  bus        tabs check the in-process message bus and fetch only deltas
+  bus+sqlite same, with the cross-process MAX(id) fallback enabled
+
+    python benchmarks/bench_chat_polling.py --tabs 200
+"""
+import argparse
+import sys
+import tempfile
+from contextlib import contextmanager
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import chat_bus  # noqa: E402
+import utils  # noqa: E402
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def count_queries(counter):
+    original = utils.db_connection
+
+    @contextmanager
+    def counting():
+        counter[0] += 1
+        with original() as conn:
+            yield conn
+    return original, counting
+
+
+def tab_refresh(mode, bus, room_id, history):
+    if mode == "naive":
+        utils.get_chatroom_messages(room_id, limit=1 << 62)
+        return
+    # Same logic as load_chat_history in app.py
+    newest_id = history[-1]["id"] if history else 0
+    if bus.has_new(room_id, newest_id):
+        history.extend(utils.get_chatroom_messages(room_id, after_id=newest_id))
+
+
+def run(mode, tabs, rooms, seconds, refresh, posts, workdir):
+    utils.DB_PATH = Path(workdir) / f"{mode.replace('+', '_')}.db"
+    utils.init_db()
+    room_ids = [utils.create_chatroom(f"Room {i}") for i in range(rooms)]
+    for room_id in room_ids:
+        for j in range(200):
+            utils.send_message(room_id, "seed@example.com", f"message {j}")
+
+    clock = FakeClock()
+    bus = chat_bus.MessageBus(shared=(mode == "bus+sqlite"), poll_interval=refresh, clock=clock)
+    utils.message_bus = bus
+
+    histories = [utils.get_chatroom_messages(room_ids[t % rooms]) for t in range(tabs)]
+    counter = [0]
+    original, counting = count_queries(counter)
+    utils.db_connection = counting
+    try:
+        post_every = seconds / posts if posts else None
+        next_post = 0
+        ticks = int(seconds / refresh)
+        for tick in range(ticks):
+            clock.now = tick * refresh
+            if post_every is not None and clock.now >= next_post * post_every:
+                utils.send_message(room_ids[next_post % rooms], "poster@example.com", "new!")
+                next_post += 1
+            for t in range(tabs):
+                tab_refresh(mode, bus, room_ids[t % rooms], histories[t])
+    finally:
+        utils.db_connection = original
+        utils.message_bus = chat_bus.message_bus
+        utils.get_pool().close()
+    return counter[0] * 60 / seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tabs", type=int, default=200)
+    parser.add_argument("--rooms", type=int, default=10)
+    parser.add_argument("--seconds", type=float, default=60)
+    parser.add_argument("--refresh", type=float, default=2.0)
+    parser.add_argument("--posts", type=int, default=6, help="messages posted during the run")
+    args = parser.parse_args()
+
+    print(f"{args.tabs} tabs, {args.rooms} rooms, refresh every {args.refresh}s, {args.posts} new messages\n")
+    for mode in ("naive", "bus", "bus+sqlite"):
+        with tempfile.TemporaryDirectory() as workdir:
+            qpm = run(mode, args.tabs, args.rooms, args.seconds, args.refresh, args.posts, workdir)
+        print(f"{mode:<11} {qpm:>10.0f} queries/min")
+
+
+if __name__ == "__main__":
+    main()
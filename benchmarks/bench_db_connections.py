@@ -0,0 +1,94 @@
+"""Ops/sec of the chat data functions with N concurrent simulated sessions.
+
+Compares the pooled WAL connection layer in utils.py against the previous
+behaviour (a fresh rollback-journal connection per call).
+
+    python benchmarks/bench_db_connections.py --sessions 1 4 16 --seconds 5
+"""
+import argparse
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import utils  # noqa: E402
+
+
+@contextmanager
+def fresh_connection():
+    conn = sqlite3.connect(utils.DB_PATH)
+    try:
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+
+def seed(rooms=20, messages_per_room=200):
+    utils.init_db()
+    room_ids = [utils.create_chatroom(f"Room {i}") for i in range(rooms)]
+    for room_id in room_ids:
+        for j in range(messages_per_room):
+            utils.send_message(room_id, f"user{j % 10}@example.com", f"hello {j}")
+    return room_ids
+
+
+def session(email, room_id, deadline, counter):
+    # One chat_page rerun: list rooms, check access, load messages, post one
+    ops = 0
+    while time.perf_counter() < deadline:
+        utils.list_user_chats(email)
+        utils.user_can_access_chat(room_id, email)
+        utils.get_chatroom_messages(room_id)
+        utils.send_message(room_id, email, "ping")
+        ops += 4
+    counter.append(ops)
+
+
+def run(mode, sessions, seconds, workdir):
+    utils.DB_PATH = Path(workdir) / f"{mode}.db"
+    original = utils.db_connection
+    if mode == "before":
+        utils.db_connection = fresh_connection
+    try:
+        room_ids = seed()
+        counter = []
+        deadline = time.perf_counter() + seconds
+        threads = [
+            threading.Thread(
+                target=session,
+                args=(f"user{i}@example.com", room_ids[i % len(room_ids)], deadline, counter),
+            )
+            for i in range(sessions)
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return sum(counter) / seconds
+    finally:
+        utils.db_connection = original
+        utils.get_pool().close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--seconds", type=float, default=5.0)
+    args = parser.parse_args()
+
+    print(f"{'sessions':>8} {'before ops/s':>14} {'after ops/s':>14} {'speedup':>8}")
+    for n in args.sessions:
+        with tempfile.TemporaryDirectory() as workdir:
+            before = run("before", n, args.seconds, workdir)
+        with tempfile.TemporaryDirectory() as workdir:
+            after = run("after", n, args.seconds, workdir)
+        print(f"{n:>8} {before:>14.0f} {after:>14.0f} {after / before:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
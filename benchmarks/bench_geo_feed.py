@@ -0,0 +1,120 @@
+"""Feed "within X km" queries: items_geo R*Tree vs a distance scan.
+
+Builds a migrated database of N listings whose sellers are spread over the
+gazetteer's places, then times utils.get_feed_page with a radius filter
+around a big city, a small one and open country, against the same filter
+computed with distance_km() over every located listing.
+
+    python benchmarks/bench_geo_feed.py --listings 1000000
+"""
+import argparse
+import csv
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import utils  # noqa: E402
+from geocode import GAZETTEER_PATH, bounding_box  # noqa: E402
+
+CATEGORIES = ["Electronics", "Appliances", "Furniture", "Clothing"]
+MODELS = ["Camera", "Chair", "CoffeeMaker", "Laptop", "Shoe", "Sofa"]
+
+METROS = {"Mumbai", "Delhi", "Bengaluru", "Chennai", "Kolkata", "Hyderabad", "Pune", "Ahmedabad"}
+CENTRES = {
+    "Mumbai": (19.0760, 72.8777),
+    "Mysuru": (12.2958, 76.6394),
+    "Deccan plateau": (16.5, 76.0),
+}
+QUERIES = {
+    "newest": dict(sort="newest"),
+    "cheapest": dict(sort="price_asc"),
+    "Electronics, newest": dict(category="Electronics", sort="newest"),
+}
+
+
+def build(n, users=20000):
+    rng = random.Random(0)
+    with open(GAZETTEER_PATH, newline="", encoding="utf-8") as f:
+        places = [row for row in csv.DictReader(f) if row["country"] == "India"]
+    # Most sellers live in a handful of metros, the rest spread over smaller cities
+    weights = [40 if p["name"] in METROS else 1 for p in places]
+    sellers = []
+    for u in range(users):
+        place = rng.choices(places, weights)[0]
+        sellers.append((f"user{u}@example.com", float(place["lat"]) + rng.gauss(0, 0.1), float(place["lon"]) + rng.gauss(0, 0.1)))
+
+    with utils.db_connection() as conn:
+        conn.executemany(
+            "INSERT INTO users (name, email, password, lat, lon) VALUES ('u', ?, '', ?, ?)", sellers)
+        rows = []
+        for i in range(n):
+            email, lat, lon = sellers[rng.randrange(users)]
+            rows.append((
+                email, "{}", f"2025-01-01T{i:09d}", lat, lon, rng.choice(CATEGORIES), rng.choice(MODELS),
+                rng.uniform(0.7, 0.99), rng.uniform(10, 600),
+            ))
+        conn.executemany("""
+            INSERT INTO items (user_email, data_json, created_at, lat, lon, category, model,
+                               condition_score, suggested_price)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, rows)
+        conn.execute("ANALYZE")
+
+
+def scan(near, radius_km, category=None, sort="newest"):
+    key, direction = utils.FEED_SORTS[sort]
+    where = "distance_km(lat, lon, ?, ?) <= ?" + (" AND category = ?" if category else "")
+    params = [near[0], near[1], radius_km] + ([category] if category else [])
+    with utils.db_connection() as conn:
+        return [r[0] for r in conn.execute(f"""
+            SELECT id FROM items NOT INDEXED WHERE {where}
+            ORDER BY {key} {direction}, id {direction} LIMIT ?
+        """, params + [utils.FEED_PAGE_SIZE]).fetchall()]
+
+
+def timed(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--listings", type=int, default=1_000_000)
+    parser.add_argument("--radii", type=float, nargs="+", default=[5, 25, 100])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        utils.DB_PATH = Path(workdir) / "bench.db"
+        utils.init_db()
+        start = time.perf_counter()
+        build(args.listings)
+        print(f"{args.listings} listings inserted (R*Tree kept by trigger) in {time.perf_counter() - start:.1f}s\n")
+
+        print(f"{'centre':<16} {'km':>5} {'query':<22} {'matches':>8} {'rtree ms':>9} {'scan ms':>9}")
+        for centre, near in CENTRES.items():
+            for radius in args.radii:
+                with utils.db_connection() as conn:
+                    matches = conn.execute("""
+                        SELECT COUNT(*) FROM items WHERE id IN (
+                            SELECT id FROM items_geo
+                            WHERE max_lat >= ? AND min_lat <= ? AND max_lon >= ? AND min_lon <= ?
+                        ) AND distance_km(lat, lon, ?, ?) <= ?
+                    """, (*bounding_box(*near, radius), *near, radius)).fetchone()[0]
+                for name, q in QUERIES.items():
+                    fast, (items, _) = timed(lambda: utils.get_feed_page(near=near, radius_km=radius, **q), args.repeat)
+                    slow, ids = timed(lambda: scan(near, radius, **q), 1)
+                    assert [i["id"] for i in items] == ids, (centre, radius, name)
+                    print(f"{centre:<16} {radius:>5.0f} {name:<22} {matches:>8} {fast:>9.2f} {slow:>9.1f}")
+        utils.get_pool().close()
+
+
+if __name__ == "__main__":
+    main()
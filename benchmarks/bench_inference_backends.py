@@ -0,0 +1,68 @@
+"""Load time, peak memory and latency of each inference backend.
+
+Each backend runs in a fresh interpreter so its imports and resident memory
+are measured on their own. Backends whose model file or runtime is missing
+are reported as skipped.
+
+    python inference.py export tflite --quantize float16
+    python benchmarks/bench_inference_backends.py --batch-sizes 1 8 --runs 20
+"""
+import argparse
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+MEASURE = """
+import json, resource, statistics, sys, time
+import numpy as np
+start = time.perf_counter()
+import inference
+backend = inference.load_backend(sys.argv[1])
+loaded = time.perf_counter() - start
+report = {"load_s": loaded, "latency_ms": {}}
+for batch_size in map(int, sys.argv[3:]):
+    batch = np.random.default_rng(0).random((batch_size, *inference.INPUT_SHAPE), dtype=np.float32)
+    backend.predict(batch)
+    samples = []
+    for _ in range(int(sys.argv[2])):
+        t = time.perf_counter()
+        backend.predict(batch)
+        samples.append(1000 * (time.perf_counter() - t))
+    report["latency_ms"][batch_size] = statistics.median(samples)
+report["peak_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+print(json.dumps(report))
+"""
+
+
+def measure(kind, runs, batch_sizes):
+    proc = subprocess.run(
+        [sys.executable, "-c", MEASURE, kind, str(runs), *map(str, batch_sizes)],
+        cwd=ROOT, capture_output=True, text=True,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.strip().splitlines()[-1])
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--backends", nargs="+", default=["keras", "tflite", "onnx"])
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8])
+    parser.add_argument("--runs", type=int, default=20)
+    args = parser.parse_args()
+
+    for kind in args.backends:
+        try:
+            report = measure(kind, args.runs, args.batch_sizes)
+        except RuntimeError as e:
+            print(f"{kind:<8} skipped: {e}")
+            continue
+        latencies = "  ".join(f"batch {b}: {ms:7.1f}ms" for b, ms in report["latency_ms"].items())
+        print(f"{kind:<8} load {report['load_s']:6.2f}s  peak RSS {report['peak_rss_mb']:7.0f} MB  {latencies}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""Throughput and latency of the shared inference worker under concurrent uploads.
+
+Simulates N sessions each analyzing a stream of photos and compares
+  direct  every session calls predict itself (serialized on the model)
+  worker  sessions submit to ai_core.InferenceWorker, which micro-batches
+
+By default the model is a stand-in whose forward pass costs
+--batch-cost-ms plus --image-cost-ms per image, which is what makes
+batching pay off on a real CNN. Pass --real to use the configured backend.
+
+    python benchmarks/bench_inference_worker.py --concurrency 1 4 16 64
+"""
+import argparse
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import ai_core  # noqa: E402
+
+
+def fixed_cost_model(batch_ms, image_ms, classes=6):
+    def predict(batch):
+        time.sleep((batch_ms + image_ms * len(batch)) / 1000)
+        return np.full((len(batch), classes), 1 / classes)
+    return predict
+
+
+def run(predict, concurrency, requests, images_per_request):
+    batch = np.zeros((images_per_request, *ai_core.INPUT_SIZE, 3), dtype=np.float32)
+    latencies = []
+
+    def session(_):
+        for _ in range(requests):
+            t = time.perf_counter()
+            predict(batch)
+            latencies.append(1000 * (time.perf_counter() - t))
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(session, range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "images_per_s": concurrency * requests * images_per_request / elapsed,
+        "p50": statistics.median(latencies),
+        "p99": latencies[min(len(latencies) - 1, int(0.99 * len(latencies)))],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16, 64])
+    parser.add_argument("--requests", type=int, default=20, help="analyses per session")
+    parser.add_argument("--images", type=int, default=1, help="photos per analysis")
+    parser.add_argument("--max-batch", type=int, default=ai_core.MAX_BATCH)
+    parser.add_argument("--max-wait-ms", type=float, default=ai_core.MAX_WAIT_MS)
+    parser.add_argument("--batch-cost-ms", type=float, default=20)
+    parser.add_argument("--image-cost-ms", type=float, default=2)
+    parser.add_argument("--real", action="store_true", help="use the configured inference backend")
+    args = parser.parse_args()
+
+    if args.real:
+        model_predict = ai_core.load_cnn_model().predict
+    else:
+        model_predict = fixed_cost_model(args.batch_cost_ms, args.image_cost_ms)
+
+    model_lock = threading.Lock()
+
+    def direct(batch):
+        with model_lock:
+            return model_predict(batch)
+
+    worker = ai_core.InferenceWorker(model_predict, args.max_batch, args.max_wait_ms)
+
+    print(f"{'sessions':>8}  {'mode':<6} {'images/s':>9} {'p50 ms':>8} {'p99 ms':>8}")
+    for concurrency in args.concurrency:
+        for mode, predict in (("direct", direct), ("worker", worker.predict)):
+            r = run(predict, concurrency, args.requests, args.images)
+            print(f"{concurrency:>8}  {mode:<6} {r['images_per_s']:9.1f} {r['p50']:8.1f} {r['p99']:8.1f}")
+
+
+if __name__ == "__main__":
+    main()
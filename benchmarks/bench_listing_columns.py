@@ -0,0 +1,148 @@
+"""Filter/sort latency over the typed listing columns vs decoding data_json.
+
+Builds a pre-migration items table with N listings, times the old paths
+(Python-side JSON decode, and json_extract in SQL), runs the schema migration,
+then times the same filters through utils.get_feed_page.
+
+    python benchmarks/bench_listing_columns.py --listings 100000
+"""
+import argparse
+import json
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import utils  # noqa: E402
+
+CATEGORIES = ["Electronics", "Appliances", "Furniture", "Clothing"]
+MODELS = ["Camera", "Chair", "CoffeeMaker", "Laptop", "Shoe", "Sofa"]
+
+QUERIES = {
+    "category + price range, cheapest first": dict(
+        category="Furniture", min_price=50, max_price=150, sort="price_asc"),
+    "min condition, best first": dict(min_condition=0.9, sort="condition"),
+    "active, newest first": dict(status="active", sort="newest"),
+}
+
+
+def build(path, n):
+    rng = random.Random(0)
+    conn = sqlite3.connect(path)
+    conn.execute("""
+        CREATE TABLE items (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_email TEXT NOT NULL,
+            data_json TEXT,
+            created_at TEXT
+        )
+    """)
+    rows = []
+    for i in range(n):
+        item = {
+            "analysis": {
+                "category": rng.choice(CATEGORIES),
+                "model": rng.choice(MODELS),
+                "condition_score": rng.uniform(0.7, 0.99),
+                "defects": [],
+            },
+            "prices": {"suggested_price": rng.uniform(10, 600)},
+            "lca": {"co2_saved": rng.uniform(1, 50)},
+            "description": "x" * 200,
+            "status": rng.choice(["active"] * 9 + ["sold"]),
+        }
+        rows.append((f"user{i % 1000}@example.com", json.dumps(item), f"2025-01-01T00:00:{i:06d}"))
+    conn.executemany("INSERT INTO items (user_email, data_json, created_at) VALUES (?, ?, ?)", rows)
+    conn.commit()
+    conn.close()
+
+
+def python_filter(conn, q):
+    items = [json.loads(r[0]) for r in conn.execute("SELECT data_json FROM items")]
+    if q.get("category"):
+        items = [i for i in items if i["analysis"]["category"] == q["category"]]
+    if q.get("min_price") is not None:
+        items = [i for i in items if q["min_price"] <= i["prices"]["suggested_price"] <= q["max_price"]]
+    if q.get("min_condition") is not None:
+        items = [i for i in items if i["analysis"]["condition_score"] >= q["min_condition"]]
+    if q.get("status"):
+        items = [i for i in items if i["status"] == q["status"]]
+    return items[:utils.FEED_PAGE_SIZE]
+
+
+def json_extract_filter(conn, q):
+    where, params = ["1"], []
+    if q.get("category"):
+        where.append("json_extract(data_json, '$.analysis.category') = ?")
+        params.append(q["category"])
+    if q.get("min_price") is not None:
+        where.append("json_extract(data_json, '$.prices.suggested_price') BETWEEN ? AND ?")
+        params += [q["min_price"], q["max_price"]]
+    if q.get("min_condition") is not None:
+        where.append("json_extract(data_json, '$.analysis.condition_score') >= ?")
+        params.append(q["min_condition"])
+    if q.get("status"):
+        where.append("json_extract(data_json, '$.status') = ?")
+        params.append(q["status"])
+    order = {
+        "price_asc": "json_extract(data_json, '$.prices.suggested_price')",
+        "condition": "json_extract(data_json, '$.analysis.condition_score') DESC",
+        "newest": "created_at DESC",
+    }[q["sort"]]
+    return conn.execute(
+        f"SELECT data_json FROM items WHERE {' AND '.join(where)} ORDER BY {order} LIMIT {utils.FEED_PAGE_SIZE}",
+        params,
+    ).fetchall()
+
+
+def timed(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--listings", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        utils.DB_PATH = Path(workdir) / "bench.db"
+        build(utils.DB_PATH, args.listings)
+
+        conn = sqlite3.connect(utils.DB_PATH)
+        before = {}
+        for name, q in QUERIES.items():
+            before[name] = (
+                timed(lambda: python_filter(conn, q), 1),
+                timed(lambda: json_extract_filter(conn, q), args.repeat),
+            )
+        conn.close()
+
+        start = time.perf_counter()
+        utils.init_db()
+        print(f"migration of {args.listings} listings: {time.perf_counter() - start:.2f}s\n")
+
+        print(f"{'query':<42} {'py decode ms':>12} {'json_extract ms':>16} {'columns ms':>11}")
+        for name, q in QUERIES.items():
+            after = timed(lambda: utils.get_feed_page(**q), args.repeat)
+            print(f"{name:<42} {before[name][0]:>12.1f} {before[name][1]:>16.1f} {after:>11.2f}")
+
+        # The feed shows active listings only: one marked sold drops out of it
+        page, _ = utils.get_feed_page(status="active")
+        sold = page[0]
+        assert utils.set_listing_status(sold["id"], sold["user"], "sold")
+        page, _ = utils.get_feed_page(status="active")
+        assert sold["id"] not in [item["id"] for item in page] and all(item["status"] == "active" for item in page)
+        utils.get_pool().close()
+
+
+if __name__ == "__main__":
+    main()
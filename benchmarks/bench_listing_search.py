@@ -0,0 +1,121 @@
+"""Feed search: listings_fts vs decoding every listing and substring matching.
+
+Builds a migrated database of N listings with free-text descriptions, then
+times utils.get_feed_page searches (ranked and newest-first, exact, prefix
+and misspelt words) against the old path of loading every listing and
+matching the search text in Python, then pages Best Match past its ranking
+window.
+
+    python benchmarks/bench_listing_search.py --listings 1000000
+"""
+import argparse
+import json
+import random
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import utils  # noqa: E402
+
+CATEGORIES = ["Electronics", "Appliances", "Furniture", "Clothing"]
+MODELS = ["Camera", "Chair", "CoffeeMaker", "Laptop", "Shoe", "Sofa"]
+BRANDS = ["dell", "lenovo", "canon", "nikon", "ikea", "philips", "nike", "adidas", "sony", "bosch"]
+WORDS = ["barely", "used", "scratch", "box", "original", "charger", "leather", "wooden", "vintage", "warranty",
+         "battery", "screen", "pickup", "only", "works", "perfectly", "minor", "dent", "gift", "spare"]
+
+SEARCHES = {
+    "laptop (model)": ("laptop", "relevance"),
+    "laptop, newest": ("laptop", "newest"),
+    "nikon (description)": ("nikon", "relevance"),
+    "lea (prefix)": ("lea", "relevance"),
+    "vintage leather sofa": ("vintage leather sofa", "relevance"),
+    "lenvo (typo)": ("lenvo", "relevance"),
+}
+
+
+def build(n):
+    rng = random.Random(0)
+    # A long tail of rare words (serials, colours, places) alongside the common ones
+    rare = [f"w{i:05d}" for i in range(50_000)]
+    with utils.db_connection() as conn:
+        conn.executemany("""
+            INSERT INTO items (user_email, data_json, created_at, category, model, condition_score, suggested_price)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, ((
+            f"user{i % 5000}@example.com",
+            json.dumps({"description": " ".join(
+                [rng.choice(BRANDS)] + rng.sample(WORDS, 4) + rng.sample(rare, 2))}),
+            f"2025-01-01T{i:09d}", rng.choice(CATEGORIES), rng.choice(MODELS),
+            rng.uniform(0.5, 0.99), rng.uniform(10, 600),
+        ) for i in range(n)))
+
+
+def python_search(text):
+    # What the feed did before: decode every listing, substring match
+    with utils.db_connection() as conn:
+        rows = conn.execute("SELECT id, data_json, model FROM items ORDER BY created_at DESC").fetchall()
+    hits = []
+    for item_id, data_json, model in rows:
+        item = json.loads(data_json)
+        if text.lower() in (model or "").lower() or text.lower() in item.get("description", "").lower():
+            hits.append(item_id)
+            if len(hits) == utils.FEED_PAGE_SIZE:
+                break
+    return hits
+
+
+def timed(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        times.append((time.perf_counter() - start) * 1000)
+    return statistics.median(times), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--listings", type=int, default=1_000_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        utils.DB_PATH = Path(workdir) / "bench.db"
+        utils.init_db()
+        start = time.perf_counter()
+        build(args.listings)
+        print(f"{args.listings} listings inserted (FTS kept by trigger) in {time.perf_counter() - start:.1f}s\n")
+
+        print(f"{'search':<24} {'fts ms':>8} {'next page ms':>13} {'py scan ms':>11}")
+        for name, (text, sort) in SEARCHES.items():
+            first_ms, (items, cursor) = timed(lambda: utils.get_feed_page(search=text, sort=sort), args.repeat)
+            next_ms, _ = timed(lambda: utils.get_feed_page(search=text, sort=sort, cursor=cursor), args.repeat)
+            scan_ms, _ = timed(lambda: python_search(text.split()[0]), 1)
+            print(f"{name:<24} {first_ms:>8.1f} {next_ms:>13.1f} {scan_ms:>11.0f}")
+
+        # Best Match past its window: the newest matches ranked, then the rest newest first
+        utils.RELEVANCE_WINDOW = 5 * utils.FEED_PAGE_SIZE
+        with utils.db_connection() as conn:
+            match = utils.listing_search_query(conn, "nikon")
+            newest = [r[0] for r in conn.execute(
+                "SELECT rowid FROM listings_fts WHERE listings_fts MATCH ? ORDER BY rowid DESC LIMIT ?",
+                (match, 2 * utils.RELEVANCE_WINDOW))]
+        seen, cursor, times = [], None, []
+        while len(seen) < len(newest):
+            start = time.perf_counter()
+            items, cursor = utils.get_feed_page(search="nikon", sort="relevance", cursor=cursor)
+            times.append((time.perf_counter() - start) * 1000)
+            seen += [item["id"] for item in items]
+        window = utils.RELEVANCE_WINDOW
+        assert utils.best_match_truncated("nikon")
+        assert sorted(seen[:window]) == sorted(newest[:window])
+        assert seen[window:len(newest)] == newest[window:]
+        print(f"\nBest Match paged past a {window}-match window: {statistics.median(times):.1f} ms a page")
+        utils.get_pool().close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""Message search latency: FTS5 index vs the previous LIKE '%q%' scan.
+
+    python benchmarks/bench_message_search.py --messages 1000000
+"""
+import argparse
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import utils  # noqa: E402
+
+WORDS = (
+    "laptop camera sofa chair shoe coffee maker screen battery repair price deal "
+    "pickup delivery broken scratch dent charger keyboard lens leather cushion "
+    "available tomorrow offer thanks hello question condition warranty receipt"
+).split()
+
+LIKE_SQL = """
+    SELECT m.id, m.chatroom_id, m.sender_email, m.message, m.created_at, c.name
+    FROM messages m
+    JOIN chatrooms c ON m.chatroom_id = c.id
+    WHERE
+        (
+            m.chatroom_id NOT IN (SELECT chatroom_id FROM chat_participants)
+            OR m.chatroom_id IN (SELECT chatroom_id FROM chat_participants WHERE user_email = ?)
+        )
+    AND (m.sender_email LIKE ? OR m.message LIKE ? OR c.name LIKE ?)
+    ORDER BY m.created_at DESC
+"""
+
+
+def seed(n, rooms=200, private_rooms=1000, vocabulary=20_000):
+    rng = random.Random(0)
+    # Chat-like text: a Zipf-distributed filler vocabulary plus one topic word per message
+    filler = [f"w{i}" for i in range(vocabulary)]
+    weights = [1 / (rank + 1) for rank in range(vocabulary)]
+    cum_weights = [0.0] * vocabulary
+    total = 0.0
+    for i, w in enumerate(weights):
+        total += w
+        cum_weights[i] = total
+    utils.init_db()
+    with utils.db_connection() as conn:
+        conn.executemany(
+            "INSERT INTO chatrooms (name, created_at) VALUES (?, '2025-01-01')",
+            [(f"Room {rng.choice(WORDS)} {i}",) for i in range(rooms + private_rooms)],
+        )
+        conn.executemany(
+            "INSERT INTO chat_participants (chatroom_id, user_email) VALUES (?, ?)",
+            [(rooms + i + 1, f"user{i % 500}@example.com") for i in range(private_rooms)]
+            + [(rooms + i + 1, f"user{(i + 1) % 500}@example.com") for i in range(private_rooms)],
+        )
+        conn.executemany(
+            "INSERT INTO messages (chatroom_id, sender_email, message, created_at) VALUES (?, ?, ?, ?)",
+            (
+                (
+                    rng.randint(1, rooms + private_rooms),
+                    f"user{rng.randint(0, 499)}@example.com",
+                    " ".join([rng.choice(WORDS)] + rng.choices(filler, cum_weights=cum_weights, k=rng.randint(4, 16))),
+                    f"2025-01-01T00:00:{i:07d}",
+                )
+                for i in range(n)
+            ),
+        )
+
+
+def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        samples.append(time.perf_counter() - start)
+    return min(samples) * 1000, len(result)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=1_000_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        utils.DB_PATH = Path(workdir) / "bench.db"
+        start = time.perf_counter()
+        seed(args.messages)
+        print(f"seeded {args.messages} messages (indexed on insert) in {time.perf_counter() - start:.1f}s\n")
+
+        user = "user7@example.com"
+        print(f"{'query':<22} {'LIKE ms':>10} {'rows':>8} {'FTS5 ms':>10} {'rows':>6}")
+        for query in ("warranty", "lap", "broken screen", "user42@example.com"):
+            q = f"%{query}%"
+            with utils.db_connection() as conn:
+                like_ms, like_rows = timed(lambda: conn.execute(LIKE_SQL, (user, q, q, q)).fetchall(), args.repeat)
+            fts_ms, fts_rows = timed(lambda: utils.search_messages(query, user), args.repeat)
+            print(f"{query:<22} {like_ms:>10.1f} {like_rows:>8} {fts_ms:>10.2f} {fts_rows:>6}")
+        utils.get_pool().close()
+
+
+if __name__ == "__main__":
+    main()
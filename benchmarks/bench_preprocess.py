@@ -0,0 +1,108 @@
+"""Per-stage preprocessing cost on a folder of photos.
+
+Compares the original pipeline (full-size decode, resize, float64 / 255.0,
+np.stack) with preprocess.preprocess_batch (reduced-size JPEG decode,
+float32 buffer, in-place normalization), one photo at a time and as a batch.
+Without --images, a few synthetic 12 MP JPEGs are generated.
+
+    python benchmarks/bench_preprocess.py --images ~/Pictures/listings
+"""
+import argparse
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from preprocess import INPUT_SIZE, preprocess_batch  # noqa: E402
+
+EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp")
+
+
+def synthetic_photos(directory, count):
+    rng = np.random.default_rng(0)
+    paths = []
+    for i in range(count):
+        # Smooth gradients plus noise compress like a real photo, unlike pure noise
+        y, x = np.mgrid[0:3000, 0:4000]
+        base = np.stack([x / 16 + i * 10, y / 12, (x + y) / 28], axis=-1) % 256
+        pixels = np.clip(base + rng.normal(0, 12, base.shape), 0, 255).astype(np.uint8)
+        path = Path(directory) / f"photo_{i}.jpg"
+        Image.fromarray(pixels).save(path, quality=90)
+        paths.append(str(path))
+    return paths
+
+
+def legacy(paths):
+    stages = {"decode": 0.0, "resize": 0.0, "normalize": 0.0}
+    arrays = []
+    for path in paths:
+        t0 = time.perf_counter()
+        img = Image.open(path).convert("RGB")
+        t1 = time.perf_counter()
+        img = img.resize(INPUT_SIZE)
+        t2 = time.perf_counter()
+        arrays.append(np.array(img) / 255.0)
+        stages["decode"] += t1 - t0
+        stages["resize"] += t2 - t1
+        stages["normalize"] += time.perf_counter() - t2
+    np.stack(arrays).astype(np.float32)
+    return stages
+
+
+def vectorized_serial(paths):
+    stages = {"decode": 0.0, "resize": 0.0, "normalize": 0.0}
+    for path in paths:
+        _, s = preprocess_batch([path])
+        stages["decode"] += s["decode"]
+        stages["resize"] += s["resize"]
+        stages["normalize"] += s["normalize"]
+    return stages
+
+
+def timed(fn, paths, runs):
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        stages = fn(paths)
+        samples.append((time.perf_counter() - start, stages))
+    return min(samples, key=lambda s: s[0])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--images", help="folder of sample photos")
+    parser.add_argument("--synthetic", type=int, default=8, help="photos to generate without --images")
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.images:
+            paths = sorted(str(p) for p in Path(args.images).rglob("*") if p.suffix.lower() in EXTENSIONS)
+        else:
+            paths = synthetic_photos(tmp, args.synthetic)
+        sizes = [Image.open(p).size for p in paths]
+        print(f"{len(paths)} photos, median {statistics.median(w * h for w, h in sizes) / 1e6:.1f} MP\n")
+
+        batch_out = np.empty((len(paths), INPUT_SIZE[1], INPUT_SIZE[0], 3), dtype=np.float32)
+        pipelines = (
+            ("original", legacy),
+            ("vectorized", vectorized_serial),
+            ("vectorized batch", lambda p: preprocess_batch(p, out=batch_out)[1]),
+        )
+        print(f"{'pipeline':<18} {'total ms/img':>12} {'decode':>8} {'resize':>8} {'normalize':>10}")
+        for name, fn in pipelines:
+            total, stages = timed(fn, paths, args.runs)
+            n = len(paths)
+            print(f"{name:<18} {1000 * total / n:12.1f} {1000 * stages['decode'] / n:8.1f} "
+                  f"{1000 * stages['resize'] / n:8.1f} {1000 * stages['normalize'] / n:10.2f}")
+        print("\n(decode/resize are summed per photo; the batch runs them in parallel)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""Catalog-wide repricing: scalar per-item calls vs the vectorized batch APIs.
+
+Times PricingEngine.suggest_price + LCACalculator.calculate in a Python loop
+against PricingEngine.suggest_prices + LCACalculator.calculate_many over the
+same N items (checking they agree), then runs the recompute job against a
+throwaway database of --db-listings listings.
+
+    python benchmarks/bench_pricing.py --items 1000000 --db-listings 100000
+"""
+import argparse
+import json
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import utils  # noqa: E402
+from ai_core import LCACalculator, PricingEngine  # noqa: E402
+from recompute_listings import recompute_listings  # noqa: E402
+
+CATEGORIES = np.array(["Electronics", "Appliances", "Furniture", "Clothing", "Other"], dtype=object)
+
+
+def catalog(n, seed=0):
+    rng = np.random.default_rng(seed)
+    return rng.uniform(0.7, 0.99, n), CATEGORIES[rng.integers(0, len(CATEGORIES), n)], rng.integers(0, 3, n)
+
+
+def scalar(scores, categories, defects):
+    prices, lca = [], []
+    for score, category, d in zip(scores.tolist(), categories.tolist(), defects.tolist()):
+        prices.append(PricingEngine.suggest_price(score, category, d))
+        lca.append(LCACalculator.calculate(category, score))
+    return prices, lca
+
+
+def vectorized(scores, categories, defects):
+    return PricingEngine.suggest_prices(scores, categories, defects), LCACalculator.calculate_many(categories, scores)
+
+
+def build_db(n):
+    utils.init_db()
+    scores, categories, defects = catalog(n, seed=1)
+    rows = []
+    for score, category, d in zip(scores.tolist(), categories.tolist(), defects.tolist()):
+        item = {
+            "analysis": {"category": category, "condition_score": score, "defects": ["Scratch"] * d},
+            "prices": PricingEngine.suggest_price(score, category, d),
+            "lca": LCACalculator.calculate(category, score),
+            "status": "active",
+        }
+        rows.append((json.dumps(item), *utils.listing_columns(item)))
+    with utils.db_connection() as conn:
+        conn.executemany(f"""
+            INSERT INTO items (user_email, data_json, created_at, {", ".join(utils.LISTING_COLUMNS)})
+            VALUES ('bench@example.com', ?, '2025-01-01', {", ".join("?" * len(utils.LISTING_COLUMNS))})
+        """, rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--items", type=int, default=1_000_000)
+    parser.add_argument("--db-listings", type=int, default=100_000)
+    args = parser.parse_args()
+
+    scores, categories, defects = catalog(args.items)
+
+    start = time.perf_counter()
+    scalar_prices, scalar_lca = scalar(scores, categories, defects)
+    scalar_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    prices, lca = vectorized(scores, categories, defects)
+    vector_s = time.perf_counter() - start
+
+    assert np.array_equal(prices["suggested_price"], [p["suggested_price"] for p in scalar_prices])
+    assert np.array_equal(lca["co2_saved"], [r["co2_saved"] for r in scalar_lca])
+
+    print(f"{args.items} items")
+    print(f"  scalar loop   {scalar_s:7.2f}s")
+    print(f"  vectorized    {vector_s:7.2f}s  ({scalar_s / vector_s:.0f}x faster, identical results)")
+
+    if args.db_listings:
+        with tempfile.TemporaryDirectory() as workdir:
+            utils.DB_PATH = Path(workdir) / "bench.db"
+            build_db(args.db_listings)
+            PricingEngine.BASE_PRICES["Electronics"] *= 1.1
+            start = time.perf_counter()
+            recompute_listings(log=lambda _: None)
+            elapsed = time.perf_counter() - start
+            utils.get_pool().close()
+        print(f"\nrecompute job over {args.db_listings} listings: {elapsed:.2f}s ({args.db_listings / elapsed:.0f} listings/s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""Nearest repair shops: grid index vs a brute-force scan.
+
+Builds a ShopIndex over N synthetic shops clustered around cities, then
+runs the same radius + service + top-k queries against the index and
+against a vectorized haversine scan of every shop, checking they agree.
+
+    python benchmarks/bench_repair_shops.py --shops 100000 --queries 2000
+"""
+import argparse
+import statistics
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from shops import SERVICES, ShopIndex, haversine_km, services_mask  # noqa: E402
+
+
+def synthetic_shops(n, cities=200, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = np.column_stack([rng.uniform(8, 32, cities), rng.uniform(68, 90, cities)])
+    city = rng.integers(0, cities, n)
+    lats = centers[city, 0] + rng.normal(0, 0.15, n)
+    lons = centers[city, 1] + rng.normal(0, 0.15, n)
+    masks = rng.integers(1, 1 << len(SERVICES), n)
+    return [{
+        "id": i, "lat": float(lats[i]), "lon": float(lons[i]),
+        "services": [s for b, s in enumerate(SERVICES) if masks[i] >> b & 1],
+    } for i in range(n)], centers
+
+
+def brute_force(lats, lons, masks, lat, lon, radius, services, k):
+    wanted = services_mask(services)
+    dist = haversine_km(lat, lon, lats, lons)
+    ok = (dist <= radius) & ((masks & wanted) == wanted)
+    idx = np.flatnonzero(ok)
+    idx = idx[np.argsort(dist[idx], kind="stable")[:k]]
+    return [(int(i), float(dist[i])) for i in idx]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--shops", type=int, default=100_000)
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--radius", type=float, default=10)
+    parser.add_argument("-k", type=int, default=10)
+    args = parser.parse_args()
+
+    shops, centers = synthetic_shops(args.shops)
+    start = time.perf_counter()
+    index = ShopIndex(shops)
+    print(f"{args.shops} shops, index built in {time.perf_counter() - start:.2f}s")
+
+    lats = np.array([s["lat"] for s in shops])
+    lons = np.array([s["lon"] for s in shops])
+    masks = np.array([services_mask(s["services"]) for s in shops])
+
+    rng = np.random.default_rng(1)
+    queries = []
+    for _ in range(args.queries):
+        lat, lon = centers[rng.integers(len(centers))] + rng.normal(0, 0.2, 2)
+        services = [SERVICES[rng.integers(len(SERVICES))]] if rng.random() < 0.5 else []
+        queries.append((float(lat), float(lon), services))
+
+    timings = {"grid index": [], "brute force": []}
+    for lat, lon, services in queries:
+        t = time.perf_counter()
+        got = index.nearest(lat, lon, args.radius, services, args.k)
+        timings["grid index"].append(time.perf_counter() - t)
+
+        t = time.perf_counter()
+        expected = brute_force(lats, lons, masks, lat, lon, args.radius, services, args.k)
+        timings["brute force"].append(time.perf_counter() - t)
+
+        assert [s["id"] for s, _ in got] == [i for i, _ in expected], (lat, lon, services)
+
+    for name, samples in timings.items():
+        samples = sorted(samples)
+        print(f"  {name:<12} p50 {1000 * statistics.median(samples):7.3f} ms   "
+              f"p99 {1000 * samples[int(0.99 * (len(samples) - 1))]:7.3f} ms")
+    print("  results identical")
+
+
+if __name__ == "__main__":
+    main()
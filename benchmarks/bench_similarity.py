@@ -0,0 +1,121 @@
+"""Listing similarity search: recall and latency of the exact and IVF/PQ indexes.
+
+Stores N synthetic embeddings in listing_embeddings (clustered like photos
+of the same kinds of item, with a share of near-duplicate re-uploads), builds
+the exact, IVF and IVF+PQ indexes from them and times "find similar" queries
+against each. Recall@k is measured against an exact float32 search over the
+original (unquantized) vectors; near-duplicate recall is the share of planted
+re-uploads found above DUPLICATE_THRESHOLD.
+
+    python benchmarks/bench_similarity.py --vectors 100000 1000000
+"""
+import argparse
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import similarity  # noqa: E402
+import utils  # noqa: E402
+
+DUPLICATE_SHARE = 0.02
+
+
+def synthetic_embeddings(n, dim, rng):
+    """Unit vectors around n/100 item kinds, some of them near-copies of others."""
+    kinds = similarity.normalize(rng.standard_normal((max(n // 100, 1), dim), dtype=np.float32))
+    vectors = np.empty((n, dim), dtype=np.float32)
+    for s in range(0, n, 65536):
+        e = min(s + 65536, n)
+        vectors[s:e] = kinds[rng.integers(0, len(kinds), e - s)]
+        vectors[s:e] += rng.standard_normal((e - s, dim), dtype=np.float32) * rng.uniform(0.03, 0.08, (e - s, 1))
+    duplicates = rng.choice(n // 2, int(n * DUPLICATE_SHARE), replace=False)
+    vectors[n - len(duplicates):] = vectors[duplicates] + rng.standard_normal((len(duplicates), dim), dtype=np.float32) * 0.005
+    return similarity.normalize(vectors), duplicates
+
+
+def store(vectors):
+    with utils.db_connection() as conn:
+        for s in range(0, len(vectors), 65536):
+            rows = []
+            for i, vector in enumerate(vectors[s:s + 65536], start=s + 1):
+                blob, scale = similarity.encode(vector)
+                rows.append((i, similarity.EMBEDDING_DTYPE, scale, blob))
+            conn.executemany("INSERT INTO listing_embeddings (item_id, dtype, scale, vector) VALUES (?, ?, ?, ?)", rows)
+
+
+def truth(vectors, queries, k):
+    scores = vectors @ vectors[queries].T
+    scores[queries, np.arange(len(queries))] = -np.inf
+    return [set(np.argpartition(-scores[:, j], k)[:k] + 1) for j in range(len(queries))]
+
+
+def measure(index, vectors, queries, expected, k, **kwargs):
+    times, recalls = [], []
+    for query, wanted in zip(queries, expected):
+        start = time.perf_counter()
+        hits = index.search(vectors[query], k, exclude={int(query) + 1}, **kwargs)
+        times.append((time.perf_counter() - start) * 1000)
+        recalls.append(len(wanted & {item_id for item_id, _ in hits}) / k)
+    return statistics.median(times), np.percentile(times, 95), float(np.mean(recalls))
+
+
+def footprint(directory):
+    return sum(f.stat().st_size for f in Path(directory).rglob("*.npy")) / 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--vectors", type=int, nargs="+", default=[100_000, 1_000_000])
+    parser.add_argument("--dim", type=int, default=256)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--pq", type=int, default=32)
+    args = parser.parse_args()
+
+    for n in args.vectors:
+        rng = np.random.default_rng(0)
+        vectors, duplicates = synthetic_embeddings(n, args.dim, rng)
+        queries = rng.choice(n, args.queries, replace=False)
+        expected = truth(vectors, queries, args.k)
+
+        with tempfile.TemporaryDirectory() as workdir:
+            utils.DB_PATH = Path(workdir) / "bench.db"
+            utils.init_db()
+            store(vectors)
+            print(f"\n{n} embeddings, {args.dim} dims, {similarity.EMBEDDING_DTYPE} "
+                  f"({args.queries} queries, recall@{args.k} vs exact float32)")
+            print(f"{'index':<26} {'build s':>8} {'disk MB':>8} {'p50 ms':>8} {'p95 ms':>8} {'recall':>7}")
+
+            configs = [("exact (mmap scan)", dict(ivf=False), [{}])]
+            configs.append(("IVF", dict(ivf=True), [dict(nprobe=p) for p in (8, 16, 32)]))
+            configs.append((f"IVF + PQ{args.pq}", dict(ivf=True, pq=args.pq), [dict(nprobe=p) for p in (16, 32)]))
+            for name, build, searches in configs:
+                index = similarity.SimilarityIndex(Path(workdir) / "index")
+                start = time.perf_counter()
+                with utils.db_connection() as conn:
+                    index.build(conn, **build)
+                    built = time.perf_counter() - start
+                    index.refresh(conn)
+                for search in searches:
+                    p50, p95, recall = measure(index, vectors, queries, expected, args.k, **search)
+                    label = f"{name} nprobe={search['nprobe']}" if search else name
+                    print(f"{label:<26} {built:>8.1f} {footprint(workdir + '/index'):>8.0f} "
+                          f"{p50:>8.2f} {p95:>8.2f} {recall:>7.3f}")
+
+            # Near-duplicate detection: each re-upload should find its original
+            copies = np.arange(n - len(duplicates), n)[:args.queries]
+            found = sum(
+                any(item_id == duplicates[i] + 1 and score >= similarity.DUPLICATE_THRESHOLD
+                    for item_id, score in index.search(vectors[copy], 5, exclude={int(copy) + 1}))
+                for i, copy in enumerate(copies))
+            print(f"near-duplicates found (>= {similarity.DUPLICATE_THRESHOLD}): {found}/{len(copies)}")
+            utils.get_pool().close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""Cold-start timings: time to login screen and time to first inference.
+
+Each measurement runs in a fresh interpreter so module imports are cold.
+
+  login screen     process start -> app.py rendered the login form (AppTest)
+  first inference  process start -> first ItemAnalyzer result, with the
+                   warm-up started at import time the way app.py does
+
+    python benchmarks/bench_startup.py --runs 3
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+LOGIN_SCREEN = """
+import time, json
+start = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+at = AppTest.from_file("app.py", default_timeout=600).run()
+assert any("Login" in m.value for m in at.markdown), "login screen not rendered"
+print(json.dumps({"seconds": time.perf_counter() - start}))
+"""
+
+FIRST_INFERENCE = """
+import time, json
+start = time.perf_counter()
+from PIL import Image
+import ai_core
+ai_core.start_model_warmup()
+img = Image.new("RGB", (1024, 768), (120, 90, 60))
+ai_core.ItemAnalyzer.analyze_images([img], use_cache=False)
+print(json.dumps({"seconds": time.perf_counter() - start}))
+"""
+
+
+def measure(code):
+    proc = subprocess.run(
+        [sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.strip().splitlines()[-1])
+    return json.loads(proc.stdout.strip().splitlines()[-1])["seconds"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    for name, code in (("time to login screen", LOGIN_SCREEN), ("time to first inference", FIRST_INFERENCE)):
+        try:
+            samples = [measure(code) for _ in range(args.runs)]
+        except RuntimeError as e:
+            print(f"{name:<24} failed: {e}")
+            continue
+        print(f"{name:<24} median {statistics.median(samples):6.2f}s  (min {min(samples):.2f}s, max {max(samples):.2f}s)")
+
+
+if __name__ == "__main__":
+    main()
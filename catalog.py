@@ -0,0 +1,273 @@
+"""Process-wide cache of active listing summaries for the Marketplace.
+
+Every session browses the same Catalog instead of loading listings itself.
+It keeps the columns the Marketplace filters, sorts and shows as NumPy
+arrays in id order (strings as codes into small tables, no images or
+descriptions), about 40 bytes per listing, and at most MAX_LISTINGS of the
+newest ones. Each sortable column also has a precomputed order, so a page
+is read off the order instead of sorting on every rerun.
+
+The cache stays current through the listing versions kept by triggers on
+items (see utils._migrate_listing_versions): each read compares the
+catalog version in the database with the one the cache last saw and applies
+only the listings written since. Deletes, listings older than the cache
+reaching back in, or a large batch of changes rebuild it instead. Once it
+is full, each new listing evicts the oldest one it holds, so writes stay
+incremental; the evicted rows are dropped at the next rebuild.
+"""
+import os
+import sys
+import threading
+
+import numpy as np
+
+from utils import db_connection
+
+MAX_LISTINGS = int(os.environ.get("SMARTCYCLE_CATALOG_MAX_LISTINGS", 1_000_000))
+PAGE_SIZE = 24
+# Changes beyond this share of the cache rebuild its sort orders from scratch
+# rather than merging each changed listing into them
+MERGE_LIMIT = 0.01
+SCAN_CHUNK = 4096
+
+# sort name -> (sorted column or None for newest, descending)
+SORTS = {
+    "newest": (None, True),
+    "price_asc": ("price", False),
+    "price_desc": ("price", True),
+    "eco": ("co2", True),
+    "condition": ("condition", True),
+}
+SORT_COLUMNS = ("price", "co2", "condition")
+
+ROW_SQL = """
+    SELECT id, version, status, category, model, user_email, condition_score, suggested_price, co2_saved
+    FROM items
+"""
+
+
+class Catalog:
+    def __init__(self):
+        self.version = 0
+        self.rebuilds = 0
+        # Listings below this id are evicted: older than the newest MAX_LISTINGS
+        self.floor = 0
+        self.ids = np.empty(0, dtype=np.int64)
+        self.alive = np.empty(0, dtype=bool)
+        self.price = np.empty(0, dtype=np.float32)
+        self.co2 = np.empty(0, dtype=np.float32)
+        self.condition = np.empty(0, dtype=np.float32)
+        self.category = np.empty(0, dtype=np.int16)
+        self.model = np.empty(0, dtype=np.int16)
+        self.seller = np.empty(0, dtype=np.int32)
+        self.orders = {}
+        # code -> string, and back
+        self.strings = {"category": [], "model": [], "seller": []}
+        self.codes = {"category": {}, "model": {}, "seller": {}}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return int(self.alive.sum())
+
+    def nbytes(self):
+        arrays = [self.ids, self.alive, self.price, self.co2, self.condition,
+                  self.category, self.model, self.seller, *self.orders.values()]
+        strings = sum(sys.getsizeof(s) for table in self.strings.values() for s in table)
+        return sum(a.nbytes for a in arrays) + strings
+
+    # ------------------- REFRESH -------------------
+    def _code(self, table, value):
+        codes = self.codes[table]
+        if value not in codes:
+            codes[value] = len(self.strings[table])
+            self.strings[table].append(value)
+        return codes[value]
+
+    def _columns(self, rows):
+        return {
+            "price": np.array([r[7] for r in rows], dtype=np.float32),
+            "co2": np.array([r[8] for r in rows], dtype=np.float32),
+            "condition": np.array([r[6] for r in rows], dtype=np.float32),
+            "category": np.array([self._code("category", r[3]) for r in rows], dtype=np.int16),
+            "model": np.array([self._code("model", r[4]) for r in rows], dtype=np.int16),
+            "seller": np.array([self._code("seller", r[5]) for r in rows], dtype=np.int32),
+        }
+
+    def rebuild(self, conn):
+        version = conn.execute("SELECT version FROM catalog_state").fetchone()[0]
+        rows = conn.execute(f"{ROW_SQL} WHERE status = 'active' ORDER BY id DESC LIMIT ?", (MAX_LISTINGS,)).fetchall()
+        rows.reverse()
+        self.strings = {table: [] for table in self.strings}
+        self.codes = {table: {} for table in self.codes}
+        self.ids = np.array([r[0] for r in rows], dtype=np.int64)
+        self.alive = np.ones(len(rows), dtype=bool)
+        for name, values in self._columns(rows).items():
+            setattr(self, name, values)
+        self._sort_all()
+        self.floor = int(self.ids[0]) if len(rows) == MAX_LISTINGS else 0
+        self.version = version
+        self.rebuilds += 1
+
+    def _evict(self, count):
+        # The oldest `count` active listings leave; their rows stay dead
+        # (and in the sort orders) until the next rebuild
+        oldest = np.flatnonzero(self.alive)[:count]
+        if len(oldest):
+            self.alive[:oldest[-1] + 1] = False
+            self.floor = int(self.ids[oldest[-1]]) + 1
+
+    def _sort_all(self):
+        # Stable, so ties stay in id order
+        self.orders = {name: np.argsort(getattr(self, name), kind="stable").astype(np.int32) for name in SORT_COLUMNS}
+
+    def _find(self, name, position):
+        """Index of `position` in the order for `name`, or where it belongs there."""
+        keys, order = getattr(self, name), self.orders[name]
+        key = keys[position]
+        lo, hi = 0, len(order)
+        # Bisect on (key, position): among equal keys the order runs by id
+        while lo < hi:
+            mid = (lo + hi) // 2
+            other = order[mid]
+            if keys[other] < key or (keys[other] == key and other < position):
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _unplace(self, positions):
+        # Before their values change
+        for name in SORT_COLUMNS:
+            self.orders[name] = np.delete(self.orders[name], [self._find(name, p) for p in positions])
+
+    def _place(self, positions):
+        for name in SORT_COLUMNS:
+            keys = getattr(self, name)
+            positions = positions[np.lexsort((positions, keys[positions]))]
+            at = [self._find(name, p) for p in positions]
+            self.orders[name] = np.insert(self.orders[name], at, positions).astype(np.int32, copy=False)
+
+    def refresh(self, conn):
+        """Bring the cache up to the database's catalog version."""
+        version, deleted_version = conn.execute("SELECT version, deleted_version FROM catalog_state").fetchone()
+        if version == self.version:
+            return
+        if deleted_version > self.version or self.version == 0:
+            return self.rebuild(conn)
+        rows = sorted(conn.execute(f"{ROW_SQL} WHERE version > ? AND id >= ?", (self.version, self.floor)).fetchall())
+        newest = int(self.ids[-1]) if len(self.ids) else 0
+        known = [r for r in rows if r[0] <= newest]
+        added = [r for r in rows if r[0] > newest and r[2] == "active"]
+
+        known_ids = np.array([r[0] for r in known], dtype=np.int64)
+        positions = np.searchsorted(self.ids, known_ids)
+        found = self.ids[positions] == known_ids if len(known) else np.zeros(0, dtype=bool)
+        if any(r[2] == "active" for r, f in zip(known, found) if not f):
+            # An older listing the cache doesn't hold became active again
+            return self.rebuild(conn)
+        known = [r for r, f in zip(known, found) if f]
+        positions = positions[found]
+
+        merge = len(known) + len(added) <= MERGE_LIMIT * (len(self.ids) + len(added))
+        if known:
+            if merge:
+                self._unplace(positions)
+            self.alive[positions] = [r[2] == "active" for r in known]
+            for name, values in self._columns(known).items():
+                getattr(self, name)[positions] = values
+        if added:
+            start = len(self.ids)
+            self.ids = np.concatenate([self.ids, [r[0] for r in added]])
+            self.alive = np.concatenate([self.alive, np.ones(len(added), dtype=bool)])
+            for name, values in self._columns(added).items():
+                setattr(self, name, np.concatenate([getattr(self, name), values]))
+            positions = np.concatenate([positions, np.arange(start, len(self.ids))])
+
+        if merge:
+            self._place(positions)
+        else:
+            self._sort_all()
+        if len(self) > MAX_LISTINGS:
+            self._evict(len(self) - MAX_LISTINGS)
+        if (~self.alive).sum() > len(self.ids) // 4:
+            return self.rebuild(conn)
+        self.version = version
+
+    # ------------------- QUERY -------------------
+    def _matching(self, category, min_price, max_price, min_condition):
+        mask = self.alive.copy()
+        if category is not None:
+            code = self.codes["category"].get(category)
+            if code is None:
+                return np.zeros_like(mask)
+            mask &= self.category == code
+        if min_price is not None:
+            mask &= self.price >= min_price
+        if max_price is not None:
+            mask &= self.price <= max_price
+        if min_condition is not None:
+            mask &= self.condition >= min_condition
+        return mask
+
+    def _summary(self, i):
+        return {
+            "id": int(self.ids[i]),
+            "user": self.strings["seller"][self.seller[i]],
+            "category": self.strings["category"][self.category[i]],
+            "model": self.strings["model"][self.model[i]],
+            "condition_score": float(self.condition[i]),
+            "suggested_price": float(self.price[i]),
+            "co2_saved": float(self.co2[i]),
+        }
+
+    def query(self, category=None, min_price=None, max_price=None, min_condition=None,
+              sort="newest", offset=0, limit=PAGE_SIZE):
+        """One page of active listings as summaries, plus how many match in total."""
+        column, descending = SORTS[sort]
+        with self._lock:
+            mask = self._matching(category, min_price, max_price, min_condition)
+            if column is None:
+                order = np.arange(len(self.ids) - 1, -1, -1)
+            else:
+                order = self.orders[column][::-1] if descending else self.orders[column]
+            # Walk the precomputed order only until the page is filled
+            wanted, hits, found = offset + limit, [], 0
+            for start in range(0, len(order), SCAN_CHUNK):
+                chunk = order[start:start + SCAN_CHUNK]
+                chunk = chunk[mask[chunk]]
+                hits.append(chunk)
+                found += len(chunk)
+                if found >= wanted:
+                    break
+            page = np.concatenate(hits)[offset:wanted] if hits else []
+            return [self._summary(i) for i in page], int(mask.sum())
+
+    def categories(self):
+        with self._lock:
+            used = np.unique(self.category[self.alive])
+            return sorted(self.strings["category"][c] for c in used if self.strings["category"][c])
+
+
+_catalog = Catalog()
+
+
+def catalog():
+    """The process-wide Catalog, brought up to date with the database."""
+    with _catalog._lock, db_connection() as conn:
+        _catalog.refresh(conn)
+    return _catalog
+
+
+def attach_images(summaries):
+    """Add image_id / has_inline_image (as listing_image expects) to a page of summaries."""
+    if not summaries:
+        return summaries
+    with db_connection() as conn:
+        rows = conn.execute(f"""
+            SELECT id, json_extract(data_json, '$.image_id'), json_type(data_json, '$.image') = 'text'
+            FROM items WHERE id IN ({", ".join("?" * len(summaries))})
+        """, [s["id"] for s in summaries]).fetchall()
+    images = {row[0]: row[1:] for row in rows}
+    for summary in summaries:
+        summary["image_id"], summary["has_inline_image"] = images.get(summary["id"], (None, False))
+    return summaries
@@ -0,0 +1,53 @@
+"""Process-wide notifications for new chat messages.
+
+utils.send_message publishes (room id, message id) here after committing.
+Open chat tabs compare the room's newest id against what they have already
+rendered and only query the database when something new arrived.
+
+With several app processes behind a load balancer, a message may have been
+written by another process. Set SMARTCYCLE_CHAT_BUS=sqlite and the bus also
+checks MAX(id) for a room in SQLite, at most once per poll interval per room
+for the whole process, no matter how many tabs are watching.
+"""
+import os
+import threading
+import time
+
+SHARED = os.environ.get("SMARTCYCLE_CHAT_BUS", "local") == "sqlite"
+POLL_INTERVAL = float(os.environ.get("SMARTCYCLE_CHAT_POLL_SECONDS", 2.0))
+
+
+class MessageBus:
+    def __init__(self, shared=SHARED, poll_interval=POLL_INTERVAL, clock=time.monotonic):
+        self.shared = shared
+        self.poll_interval = poll_interval
+        self._clock = clock
+        self._latest = {}      # room id -> newest message id seen
+        self._polled_at = {}   # room id -> when SQLite was last asked
+        self._lock = threading.Lock()
+
+    def publish(self, chatroom_id, message_id):
+        with self._lock:
+            if message_id > self._latest.get(chatroom_id, 0):
+                self._latest[chatroom_id] = message_id
+
+    def latest(self, chatroom_id):
+        """Newest known message id in a room (0 if none seen)."""
+        if self.shared:
+            self._poll(chatroom_id)
+        return self._latest.get(chatroom_id, 0)
+
+    def has_new(self, chatroom_id, after_id):
+        return self.latest(chatroom_id) > after_id
+
+    def _poll(self, chatroom_id):
+        now = self._clock()
+        with self._lock:
+            if now - self._polled_at.get(chatroom_id, float("-inf")) < self.poll_interval:
+                return
+            self._polled_at[chatroom_id] = now
+        from utils import latest_message_id  # utils imports this module
+        self.publish(chatroom_id, latest_message_id(chatroom_id))
+
+
+message_bus = MessageBus()
@@ -0,0 +1,88 @@
+"""Offline geocoding of free-text locations against data/gazetteer.csv.
+
+The gazetteer lists cities (plus alternate names and well-known
+neighbourhoods) with their coordinates, so a location typed at signup such
+as "Bandra West, Mumbai 400050" or "Bangalore" resolves without any network
+call. Locations are geocoded once, when a user signs up or changes it;
+`python geocode.py` backfills users and listings saved before that.
+"""
+import csv
+import difflib
+import functools
+import math
+import re
+from pathlib import Path
+
+GAZETTEER_PATH = Path(__file__).parent / "data" / "gazetteer.csv"
+EARTH_RADIUS_KM = 6371.0
+# How close a misspelt place name has to be (difflib ratio) to still match
+FUZZY_CUTOFF = 0.85
+
+
+def _normalize(text):
+    return " ".join(re.sub(r"[^a-z0-9]+", " ", text.lower()).split())
+
+
+@functools.lru_cache(maxsize=1)
+def gazetteer():
+    """Normalized place name or alias -> (lat, lon)."""
+    places = {}
+    with open(GAZETTEER_PATH, newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            coords = (float(row["lat"]), float(row["lon"]))
+            for name in [row["name"], *row["aliases"].split("|")]:
+                if name.strip():
+                    places.setdefault(_normalize(name), coords)
+    return places
+
+
+def geocode(location):
+    """(lat, lon) for a free-text location, or None if nothing in it is recognised.
+
+    Comma-separated parts are tried in order, most specific first; within a
+    part the longest run of words naming a known place wins, so postcodes
+    and street names around it are ignored. Finally near-misses are
+    accepted ("Banglore").
+    """
+    if not location:
+        return None
+    places = gazetteer()
+    parts = [p for p in (_normalize(part) for part in re.split(r"[,;/()]", location)) if p]
+
+    for part in parts:
+        words = part.split()
+        for length in range(len(words), 0, -1):
+            for start in range(len(words) - length + 1):
+                coords = places.get(" ".join(words[start:start + length]))
+                if coords:
+                    return coords
+
+    for part in parts:
+        match = difflib.get_close_matches(part, places, n=1, cutoff=FUZZY_CUTOFF)
+        if match:
+            return places[match[0]]
+    return None
+
+
+def distance_km(lat1, lon1, lat2, lon2):
+    """Great-circle distance; registered as an SQL function on every connection."""
+    if None in (lat1, lon1, lat2, lon2):
+        return None
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    a = math.sin((p2 - p1) / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(math.radians(lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+def bounding_box(lat, lon, radius_km):
+    """(min_lat, max_lat, min_lon, max_lon) enclosing a circle."""
+    dlat = math.degrees(radius_km / EARTH_RADIUS_KM)
+    cos_lat = math.cos(math.radians(lat))
+    dlon = 180.0 if cos_lat < 1e-6 else min(180.0, dlat / cos_lat)
+    return lat - dlat, lat + dlat, lon - dlon, lon + dlon
+
+
+if __name__ == "__main__":
+    from utils import backfill_coordinates, init_db  # utils imports this module
+    init_db()
+    users, items = backfill_coordinates()
+    print(f"geocoded {users} users, located {items} listings")
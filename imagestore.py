@@ -0,0 +1,167 @@
+"""Content-addressed storage for listing photos.
+
+Each photo is stored once on disk under its SHA-256, next to pre-generated
+thumbnails for the sizes the pages render. Listings only keep the hash in
+`data_json["image_id"]`.
+"""
+import argparse
+import base64
+import hashlib
+import json
+import os
+import tempfile
+from io import BytesIO
+from pathlib import Path
+
+from PIL import Image, ImageOps, features
+
+from utils import db_connection, get_listing_inline_image
+
+MEDIA_DIR = Path(__file__).parent / "media"
+
+# thumbnail name -> longest edge in px
+THUMBNAIL_SIZES = {
+    "feed": 300,
+    "dashboard": 150,
+}
+THUMBNAIL_FORMAT = "WEBP" if features.check("webp") else "JPEG"
+THUMBNAIL_EXT = THUMBNAIL_FORMAT.lower().replace("jpeg", "jpg")
+
+ORIGINAL_QUALITY = 90
+THUMBNAIL_QUALITY = 80
+
+
+def original_path(image_id):
+    return MEDIA_DIR / "originals" / image_id[:2] / f"{image_id}.jpg"
+
+
+def thumbnail_path(image_id, size="feed"):
+    return MEDIA_DIR / "thumbs" / size / image_id[:2] / f"{image_id}.{THUMBNAIL_EXT}"
+
+
+def _write_atomic(path, data):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path.parent)
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def _encode(img, fmt, quality):
+    buf = BytesIO()
+    img.save(buf, format=fmt, quality=quality)
+    return buf.getvalue()
+
+
+def _make_thumbnail(img, image_id, size):
+    path = thumbnail_path(image_id, size)
+    if path.exists():
+        return path
+    edge = THUMBNAIL_SIZES[size]
+    thumb = img.copy()
+    thumb.thumbnail((edge, edge))
+    _write_atomic(path, _encode(thumb, THUMBNAIL_FORMAT, THUMBNAIL_QUALITY))
+    return path
+
+
+def put_image(img):
+    """Store a PIL image (or encoded image bytes) and return its content hash.
+
+    The original is re-encoded as JPEG, which also drops EXIF/GPS metadata.
+    Storing the same photo twice is a no-op.
+    """
+    if not isinstance(img, Image.Image):
+        img = Image.open(BytesIO(img))
+    img = ImageOps.exif_transpose(img).convert("RGB")
+
+    data = _encode(img, "JPEG", ORIGINAL_QUALITY)
+    image_id = hashlib.sha256(data).hexdigest()
+
+    path = original_path(image_id)
+    if not path.exists():
+        _write_atomic(path, data)
+    for size in THUMBNAIL_SIZES:
+        _make_thumbnail(img, image_id, size)
+    return image_id
+
+
+def get_thumbnail(image_id, size="feed"):
+    """Path of a thumbnail, regenerated from the original if it went missing."""
+    path = thumbnail_path(image_id, size)
+    if not path.exists():
+        with Image.open(original_path(image_id)) as img:
+            _make_thumbnail(img.convert("RGB"), image_id, size)
+    return str(path)
+
+
+def listing_image(item, size="feed"):
+    """Something st.image can render for a listing, or None if it has no photo."""
+    if item.get("image_id"):
+        try:
+            return get_thumbnail(item["image_id"], size)
+        except FileNotFoundError:
+            return None
+    # Listings saved before the blob store carry the base64 image inline
+    if item.get("image"):
+        return base64.b64decode(item["image"])
+    if item.get("has_inline_image"):
+        # Listing summaries leave it out; fetched only for cards being shown
+        data = get_listing_inline_image(item["id"])
+        return base64.b64decode(data) if data else None
+    return None
+
+
+# ------------------- MIGRATION -------------------
+def migrate_inline_images(batch_size=50, log=print):
+    """Move base64 images out of items.data_json into the blob store.
+
+    Rows are read one at a time and their photos stored outside any
+    transaction; the rewritten rows are then written `batch_size` at a time
+    in short transactions, so other writers are only held up for the
+    UPDATEs. A row changed in the meantime is left for the next run; the
+    migration can be interrupted and re-run.
+    """
+    migrated = 0
+    last_id = 0
+    pending = []
+
+    def write(pending):
+        with db_connection() as conn:
+            done = sum(conn.execute("UPDATE items SET data_json=? WHERE id=? AND data_json=?", update).rowcount
+                       for update in pending)
+        log(f"migrated {migrated + done} listings (last id {last_id})")
+        return done
+
+    while True:
+        with db_connection() as conn:
+            row = conn.execute("""
+                SELECT id, data_json FROM items
+                WHERE id > ? AND json_type(data_json, '$.image') = 'text'
+                ORDER BY id LIMIT 1
+            """, (last_id,)).fetchone()
+        if row is None:
+            break
+        last_id, data_json = row
+
+        item = json.loads(data_json)
+        try:
+            item["image_id"] = put_image(base64.b64decode(item.pop("image")))
+        except Exception as e:
+            log(f"item {last_id}: skipped ({e})")
+            continue
+
+        pending.append((json.dumps(item), last_id, data_json))
+        if len(pending) == batch_size:
+            migrated += write(pending)
+            pending = []
+    if pending:
+        migrated += write(pending)
+
+    log(f"done: {migrated} listings migrated")
+    return migrated
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Move inline listing images into the blob store")
+    parser.add_argument("--batch-size", type=int, default=50)
+    args = parser.parse_args()
+    migrate_inline_images(batch_size=args.batch_size)
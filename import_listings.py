@@ -0,0 +1,133 @@
+"""Bulk-import a seller's existing inventory as listings.
+
+    python import_listings.py seller@example.com photos/
+    python import_listings.py seller@example.com inventory.csv
+
+A directory imports every photo as its own listing. A CSV manifest has an
+`image` column (several photos of one item separated by "|", relative to the
+CSV) and an optional `description` column.
+
+Photos are decoded, stored and preprocessed on a process pool while the
+previous chunk is classified in one batched forward pass and written in one
+transaction. Every listing records its source, so an interrupted import can
+simply be re-run and picks up where it stopped.
+"""
+import argparse
+import csv
+import multiprocessing
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from itertools import islice
+from pathlib import Path
+
+import numpy as np
+
+from ai_core import ItemAnalyzer, LCACalculator, PricingEngine, analysis_key, load_cnn_model
+from imagestore import put_image
+from preprocess import preprocess_batch
+from similarity import save_embeddings
+from utils import get_user_by_email, imported_sources, init_db, save_listings
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp")
+CHUNK_SIZE = 64
+
+
+def read_jobs(source):
+    """(source key, photo paths, description) per listing, streamed."""
+    source = Path(source)
+    if source.is_dir():
+        for path in sorted(source.rglob("*")):
+            if path.suffix.lower() in IMAGE_EXTENSIONS:
+                yield str(path.relative_to(source)), [str(path)], ""
+        return
+    with open(source, newline="") as f:
+        for row in csv.DictReader(f):
+            images = [p.strip() for p in row["image"].split("|") if p.strip()]
+            yield row["image"], [str(source.parent / p) for p in images], row.get("description") or ""
+
+
+def _prepare(job):
+    # Runs in a worker process: everything per listing except inference
+    key, paths, description = job
+    photos = [Path(p).read_bytes() for p in paths]
+    batch, _ = preprocess_batch(photos)
+    return key, description, analysis_key(photos), put_image(photos[0]), batch
+
+
+def _build_listings(user_email, prepared):
+    """Listings for a chunk, and their embeddings (kept apart, in listing_embeddings)."""
+    probs, embeddings = load_cnn_model().predict_with_embeddings(np.concatenate([p[4] for p in prepared]))
+    listings, vectors = [], []
+    start = 0
+    for source_key, description, cache_key, image_id, batch in prepared:
+        rows = slice(start, start + len(batch))
+        analysis = ItemAnalyzer.interpret(probs[rows], cache_key, None if embeddings is None else embeddings[rows])
+        vectors.append(analysis.pop("embedding"))
+        start += len(batch)
+        listings.append({
+            "analysis": analysis,
+            "prices": PricingEngine.suggest_price(analysis["condition_score"], analysis["category"], len(analysis["defects"])),
+            "lca": LCACalculator.calculate(analysis["category"], analysis["condition_score"]),
+            "description": description,
+            "image_id": image_id,
+            "status": "active",
+            "timestamp": datetime.now().isoformat(),
+            "user": user_email,
+            "import_source": source_key,
+        })
+    return listings, vectors
+
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def import_listings(user_email, source, workers=None, chunk_size=CHUNK_SIZE, log=print):
+    """Import listings from a directory or CSV manifest; returns how many were created."""
+    done = imported_sources(user_email)
+    jobs = (job for job in read_jobs(source) if job[0] not in done)
+    if done:
+        log(f"resuming: {len(done)} listings already imported")
+
+    imported = skipped = 0
+    started = time.perf_counter()
+    # spawn, not fork: the parent loads the model, which is not fork-safe
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        chunks = _chunks(jobs, chunk_size)
+        pending = [(job, pool.submit(_prepare, job)) for job in next(chunks, [])]
+        while pending:
+            # Keep the pool busy with the next chunk while this one is classified and saved
+            upcoming = [(job, pool.submit(_prepare, job)) for job in next(chunks, [])]
+            prepared = []
+            for job, future in pending:
+                try:
+                    prepared.append(future.result())
+                except Exception as e:
+                    skipped += 1
+                    log(f"{job[0]}: skipped ({e})")
+            if prepared:
+                listings, vectors = _build_listings(user_email, prepared)
+                save_embeddings(save_listings(user_email, listings), vectors)
+                imported += len(prepared)
+            elapsed = time.perf_counter() - started
+            log(f"imported {imported} listings ({skipped} skipped) in {elapsed:.1f}s, {imported / elapsed:.1f} listings/s")
+            pending = upcoming
+    return imported
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bulk-import listings from a photo directory or CSV manifest")
+    parser.add_argument("email", help="seller account that will own the listings")
+    parser.add_argument("source", help="directory of photos or CSV manifest")
+    parser.add_argument("--workers", type=int, help="worker processes (default: CPU count)")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="listings per forward pass and transaction")
+    args = parser.parse_args()
+
+    init_db()
+    if get_user_by_email(args.email) is None:
+        sys.exit(f"no user with email {args.email}")
+    import_listings(args.email, args.source, args.workers, args.chunk_size)
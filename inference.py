@@ -0,0 +1,265 @@
+"""Inference backends for the item classifier.
+
+The Keras .h5 model is the source of truth. It can be exported once to
+TFLite (optionally float16/int8 quantized) or ONNX; at runtime the slimmest
+backend whose model file and interpreter are both available is used.
+
+    python inference.py export tflite --quantize float16
+    python inference.py export onnx
+    python inference.py check --images path/to/photos
+
+SMARTCYCLE_INFERENCE_BACKEND=keras|tflite|onnx forces a backend; the default
+"auto" prefers tflite, then onnx, then keras.
+
+Besides the class probabilities, predict_with_embeddings() returns each
+photo's penultimate-layer activations, the image embedding that similarity.py
+searches. Exports carry both outputs; a TFLite/ONNX file exported before
+that only has the probabilities, and its embeddings come back as None.
+"""
+import argparse
+import importlib.util
+import os
+import threading
+from pathlib import Path
+
+import numpy as np
+
+MODEL_PATH = "item_analyzer_model.h5"
+GDRIVE_ID = "1zGqHM8xOEmNDj3EAuxxxruubNjL_Ksri"
+MODEL_URL = f"https://drive.google.com/uc?id={GDRIVE_ID}"
+TFLITE_MODEL_PATH = "item_analyzer_model.tflite"
+ONNX_MODEL_PATH = "item_analyzer_model.onnx"
+
+INPUT_SHAPE = (128, 128, 3)
+BACKEND = os.environ.get("SMARTCYCLE_INFERENCE_BACKEND", "auto")
+
+
+def _installed(module):
+    try:
+        return importlib.util.find_spec(module) is not None
+    except ModuleNotFoundError:
+        return False
+
+
+def resolve_backend(kind=BACKEND):
+    """Which backend load_backend(kind) would use, without importing anything heavy."""
+    if kind != "auto":
+        return kind
+    if os.path.exists(TFLITE_MODEL_PATH) and (_installed("tflite_runtime") or _installed("tensorflow")):
+        return "tflite"
+    if os.path.exists(ONNX_MODEL_PATH) and _installed("onnxruntime"):
+        return "onnx"
+    return "keras"
+
+
+def needs_download(kind=BACKEND):
+    return resolve_backend(kind) == "keras" and not os.path.exists(MODEL_PATH)
+
+
+# ------------------- BACKENDS -------------------
+def embedding_model(model):
+    """The Keras classifier with its penultimate layer's output added: (embeddings, probabilities)."""
+    import tensorflow as tf
+    return tf.keras.Model(model.inputs, [model.layers[-2].output, model.output])
+
+
+def _flat(embeddings):
+    return None if embeddings is None else np.asarray(embeddings, dtype=np.float32).reshape(len(embeddings), -1)
+
+
+class KerasBackend:
+    name = "keras"
+
+    def __init__(self, path=MODEL_PATH):
+        # Download once if not present
+        if not os.path.exists(path):
+            import gdown
+            gdown.download(MODEL_URL, path, quiet=False)
+        # Load model from local file
+        from tensorflow.keras.models import load_model
+        self.model = load_model(path)
+        self.embedder = embedding_model(self.model)
+
+    def predict(self, batch):
+        return self.model.predict(batch, verbose=0)
+
+    def predict_with_embeddings(self, batch):
+        embeddings, probs = self.embedder.predict(batch, verbose=0)
+        return probs, _flat(embeddings)
+
+
+class TFLiteBackend:
+    name = "tflite"
+
+    def __init__(self, path=TFLITE_MODEL_PATH):
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            from tensorflow.lite import Interpreter
+        self.interpreter = Interpreter(model_path=str(path), num_threads=os.cpu_count())
+        self.interpreter.allocate_tensors()
+        self._input = self.interpreter.get_input_details()[0]
+        self._outputs = self._output_details()
+        # An interpreter holds its tensors in place; one caller at a time
+        self._lock = threading.Lock()
+
+    def _output_details(self):
+        # The converter doesn't keep the Keras output order; the
+        # probabilities are the narrower output
+        return sorted(self.interpreter.get_output_details(), key=lambda d: int(np.prod(d["shape"][1:])))
+
+    def _run(self, batch):
+        batch = np.asarray(batch, dtype=np.float32)
+        with self._lock:
+            if tuple(self._input["shape"]) != batch.shape:
+                self.interpreter.resize_tensor_input(self._input["index"], batch.shape)
+                self.interpreter.allocate_tensors()
+                self._input = self.interpreter.get_input_details()[0]
+                self._outputs = self._output_details()
+
+            if self._input["dtype"] == np.int8:
+                scale, zero_point = self._input["quantization"]
+                batch = np.clip(np.round(batch / scale + zero_point), -128, 127).astype(np.int8)
+            self.interpreter.set_tensor(self._input["index"], batch)
+            self.interpreter.invoke()
+            outputs = []
+            for detail in self._outputs:
+                out = self.interpreter.get_tensor(detail["index"])
+                if detail["dtype"] == np.int8:
+                    scale, zero_point = detail["quantization"]
+                    out = (out.astype(np.float32) - zero_point) * scale
+                outputs.append(np.array(out, dtype=np.float32))
+            return outputs
+
+    def predict(self, batch):
+        return self._run(batch)[0]
+
+    def predict_with_embeddings(self, batch):
+        probs, *embeddings = self._run(batch)
+        return probs, _flat(embeddings[0] if embeddings else None)
+
+
+class OnnxBackend:
+    name = "onnx"
+
+    def __init__(self, path=ONNX_MODEL_PATH):
+        import onnxruntime as ort
+        self.session = ort.InferenceSession(str(path), providers=["CPUExecutionProvider"])
+        self._input_name = self.session.get_inputs()[0].name
+        # Probabilities first: the narrower output
+        width = lambda o: int(np.prod([d for d in o.shape[1:] if isinstance(d, int)]))
+        self._output_names = [o.name for o in sorted(self.session.get_outputs(), key=width)]
+
+    def predict(self, batch):
+        return self.predict_with_embeddings(batch)[0]
+
+    def predict_with_embeddings(self, batch):
+        probs, *embeddings = self.session.run(self._output_names, {self._input_name: np.asarray(batch, dtype=np.float32)})
+        return probs, _flat(embeddings[0] if embeddings else None)
+
+
+BACKENDS = {
+    "keras": KerasBackend,
+    "tflite": TFLiteBackend,
+    "onnx": OnnxBackend,
+}
+
+
+def load_backend(kind=BACKEND):
+    return BACKENDS[resolve_backend(kind)]()
+
+
+# ------------------- EXPORT -------------------
+def _calibration_batches(images_dir, limit=200):
+    from preprocess import preprocess_batch
+    paths = sorted(p for p in Path(images_dir).rglob("*") if p.suffix.lower() in (".jpg", ".jpeg", ".png", ".webp"))
+    for path in paths[:limit]:
+        yield [preprocess_batch([str(path)])[0]]
+
+
+def export_tflite(quantize=None, calibration_dir=None, out=TFLITE_MODEL_PATH):
+    """Convert the Keras model to TFLite.
+
+    quantize: None (float32), "float16" (half-size weights), "dynamic"
+    (int8 weights) or "int8" (int8 weights and activations, calibrated on
+    calibration_dir; inputs and outputs stay float32).
+    """
+    import tensorflow as tf
+    converter = tf.lite.TFLiteConverter.from_keras_model(KerasBackend().embedder)
+    if quantize == "float16":
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.target_spec.supported_types = [tf.float16]
+    elif quantize == "dynamic":
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    elif quantize == "int8":
+        if not calibration_dir:
+            raise ValueError("int8 quantization needs --calibration-dir with sample photos")
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.representative_dataset = lambda: _calibration_batches(calibration_dir)
+    elif quantize is not None:
+        raise ValueError(f"unknown quantization {quantize!r}")
+    Path(out).write_bytes(converter.convert())
+    return out
+
+
+def export_onnx(out=ONNX_MODEL_PATH, opset=13):
+    import tensorflow as tf
+    import tf2onnx
+    spec = (tf.TensorSpec((None, *INPUT_SHAPE), tf.float32, name="input"),)
+    tf2onnx.convert.from_keras(KerasBackend().embedder, input_signature=spec, opset=opset, output_path=out)
+    return out
+
+
+# ------------------- PARITY CHECK -------------------
+def check_parity(kind, images_dir=None, samples=64, seed=0):
+    """Compare a backend against Keras on sample photos (or random inputs).
+
+    Returns top-1 agreement, the largest absolute probability difference
+    and, if the candidate has embeddings, the lowest cosine similarity
+    between its embeddings and Keras'.
+    """
+    if images_dir:
+        batch = np.concatenate([b[0] for b in _calibration_batches(images_dir, limit=samples)])
+    else:
+        batch = np.random.default_rng(seed).random((samples, *INPUT_SHAPE), dtype=np.float32)
+
+    reference, reference_embeddings = KerasBackend().predict_with_embeddings(batch)
+    candidate, candidate_embeddings = load_backend(kind).predict_with_embeddings(batch)
+    report = {
+        "samples": len(batch),
+        "top1_agreement": float(np.mean(reference.argmax(axis=1) == candidate.argmax(axis=1))),
+        "max_abs_diff": float(np.max(np.abs(reference - candidate))),
+    }
+    if candidate_embeddings is not None:
+        cosine = (reference_embeddings * candidate_embeddings).sum(axis=1) / (
+            np.linalg.norm(reference_embeddings, axis=1) * np.linalg.norm(candidate_embeddings, axis=1) + 1e-12)
+        report["min_embedding_cosine"] = float(cosine.min())
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export and check item classifier backends")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    export = sub.add_parser("export", help="convert the Keras model")
+    export.add_argument("format", choices=["tflite", "onnx"])
+    export.add_argument("--quantize", choices=["float16", "dynamic", "int8"])
+    export.add_argument("--calibration-dir", help="sample photos for int8 calibration")
+
+    check = sub.add_parser("check", help="accuracy parity against the Keras model")
+    check.add_argument("--backend", choices=["tflite", "onnx"], default="tflite")
+    check.add_argument("--images", help="folder of sample photos (default: random inputs)")
+
+    args = parser.parse_args()
+    if args.command == "export":
+        if args.format == "tflite":
+            path = export_tflite(args.quantize, args.calibration_dir)
+        else:
+            path = export_onnx()
+        print(f"wrote {path} ({os.path.getsize(path) / 1e6:.1f} MB)")
+    else:
+        report = check_parity(args.backend, args.images)
+        print(f"{args.backend} vs keras on {report['samples']} inputs: "
+              f"top-1 agreement {report['top1_agreement']:.1%}, "
+              f"max |Δp| {report['max_abs_diff']:.4f}"
+              + (f", min embedding cosine {report['min_embedding_cosine']:.4f}" if "min_embedding_cosine" in report else ""))
@@ -0,0 +1,84 @@
+"""Re-price and re-score every listing after PricingEngine or LCACalculator changes.
+
+    python recompute_listings.py --chunk-size 20000
+
+Listings are read in id order a chunk at a time, priced and scored with the
+vectorized PricingEngine.suggest_prices / LCACalculator.calculate_many, and
+written back (typed columns and data_json) with one executemany and commit
+per chunk. Re-running it is harmless, so an interrupted job can simply be
+started again.
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+
+from ai_core import LCACalculator, PricingEngine
+from utils import db_connection, init_db
+
+CHUNK_SIZE = 20000
+
+UPDATE_SQL = """
+    UPDATE items SET
+        suggested_price = ?,
+        co2_saved = ?,
+        water_saved = ?,
+        energy_saved = ?,
+        data_json = json_set(data_json, '$.prices', json(?), '$.lca', json(?))
+    WHERE id = ?
+"""
+
+
+def recompute_chunk(ids, categories, scores, defects_counts):
+    """Rows for UPDATE_SQL, one per listing.
+
+    The numbers are computed for the whole chunk at once; only building the
+    JSON for data_json is per listing.
+    """
+    prices = PricingEngine.suggest_prices(scores, categories, defects_counts)
+    lca = LCACalculator.calculate_many(categories, scores)
+    price_keys, lca_keys = list(prices), list(lca)
+    rows = []
+    for item_id, price_values, lca_values in zip(
+        ids, zip(*(prices[k].tolist() for k in price_keys)), zip(*(lca[k].tolist() for k in lca_keys))
+    ):
+        item_lca = dict(zip(lca_keys, lca_values))
+        item_lca["summary"] = LCACalculator.summary(*lca_values)
+        rows.append((
+            price_values[0], *lca_values,
+            json.dumps(dict(zip(price_keys, price_values))), json.dumps(item_lca),
+            item_id,
+        ))
+    return rows
+
+
+def recompute_listings(chunk_size=CHUNK_SIZE, log=print):
+    updated = 0
+    last_id = 0
+    started = time.perf_counter()
+    with db_connection() as conn:
+        while True:
+            rows = conn.execute("""
+                SELECT id, category, condition_score,
+                       COALESCE(json_array_length(data_json, '$.analysis.defects'), 0)
+                FROM items WHERE id > ? ORDER BY id LIMIT ?
+            """, (last_id, chunk_size)).fetchall()
+            if not rows:
+                break
+            ids, categories, scores, defects_counts = zip(*rows)
+            conn.executemany(UPDATE_SQL, recompute_chunk(ids, categories, np.array(scores), np.array(defects_counts)))
+            conn.commit()
+
+            last_id = ids[-1]
+            updated += len(rows)
+            log(f"recomputed {updated} listings (last id {last_id}), {updated / (time.perf_counter() - started):.0f}/s")
+    return updated
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Re-price and re-score all listings")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    args = parser.parse_args()
+    init_db()
+    recompute_listings(args.chunk_size)
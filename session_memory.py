@@ -0,0 +1,137 @@
+"""Approximate memory use of Streamlit session_state, per key and per session.
+
+Every script run records its session's per-key sizes in a process-wide table
+(see record_session), which the Diagnostics page reads. enforce_budget()
+shrinks a session that has grown past SESSION_BUDGET_MB by replacing or
+dropping the values listed in EVICTION_POLICY, largest first. Every value
+there is a cache the pages rebuild from the database on their next render.
+
+Sizes are estimates: a deep sys.getsizeof walk that counts shared objects
+once per session.
+"""
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+from PIL import Image
+
+SESSION_BUDGET_MB = float(os.environ.get("SMARTCYCLE_SESSION_BUDGET_MB", 8))
+ADMIN_EMAILS = {e.strip() for e in os.environ.get("SMARTCYCLE_ADMIN_EMAILS", "").split(",") if e.strip()}
+# Sessions that stopped rerunning this long ago are dropped from the table
+SESSION_TTL = 30 * 60
+
+
+def deep_sizeof(obj, seen=None):
+    """Approximate bytes held by obj and everything reachable through containers."""
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+
+    if isinstance(obj, np.ndarray):
+        return sys.getsizeof(obj) + (0 if obj.base is not None else obj.nbytes)
+    if isinstance(obj, Image.Image):
+        # Pixel data lives in C memory that getsizeof doesn't see
+        return sys.getsizeof(obj) + obj.width * obj.height * len(obj.getbands())
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_sizeof(k, seen) + deep_sizeof(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(deep_sizeof(v, seen) for v in obj)
+    elif hasattr(obj, "__dict__"):
+        size += deep_sizeof(vars(obj), seen)
+    return size
+
+
+def state_sizes(state):
+    """{key: approximate bytes} for a session_state (or any mapping), largest first."""
+    seen = set()
+    sizes = {str(key): deep_sizeof(state[key], seen) for key in list(state.keys())}
+    return dict(sorted(sizes.items(), key=lambda kv: kv[1], reverse=True))
+
+
+# ------------------- EVICTION -------------------
+def _item_reference(item):
+    # Keep what identifies the listing and its seller, not its data
+    return {k: item[k] for k in ("id", "user") if k in item} if isinstance(item, dict) else None
+
+
+# key -> function returning the replacement value, or None to drop the key
+EVICTION_POLICY = {
+    "selected_item": _item_reference,
+    "feed": lambda feed: None,
+    "my_listings": lambda listings: None,
+    "chat_history": lambda history: None,
+    "chat_access": lambda access: None,
+    "nearby_shops": lambda shops: None,
+}
+
+
+def enforce_budget(state, budget_bytes=None, sizes=None):
+    """Shrink state below budget_bytes; returns the keys that were evicted."""
+    budget_bytes = SESSION_BUDGET_MB * 1024 * 1024 if budget_bytes is None else budget_bytes
+    sizes = state_sizes(state) if sizes is None else sizes
+    total = sum(sizes.values())
+    evicted = []
+    for key, size in sizes.items():
+        if total <= budget_bytes:
+            break
+        if key not in EVICTION_POLICY or key not in state:
+            continue
+        replacement = EVICTION_POLICY[key](state[key])
+        if replacement is None:
+            del state[key]
+            total -= size
+        else:
+            state[key] = replacement
+            total += deep_sizeof(replacement) - size
+        evicted.append(key)
+    return evicted
+
+
+# ------------------- PROCESS-WIDE TABLE -------------------
+_sessions = {}
+_evictions = {"count": 0}
+_lock = threading.Lock()
+
+
+def record_session(session_id, user_email, sizes, evicted=()):
+    now = time.time()
+    with _lock:
+        _sessions[session_id] = {
+            "user": user_email,
+            "sizes": sizes,
+            "total": sum(sizes.values()),
+            "updated_at": now,
+        }
+        _evictions["count"] += len(evicted)
+        for stale in [sid for sid, s in _sessions.items() if now - s["updated_at"] > SESSION_TTL]:
+            del _sessions[stale]
+
+
+def sessions_report():
+    """Recorded sessions, largest first."""
+    with _lock:
+        rows = [{"session": sid, **info} for sid, info in _sessions.items()]
+    return sorted(rows, key=lambda r: r["total"], reverse=True)
+
+
+def evictions_total():
+    return _evictions["count"]
+
+
+def process_rss_bytes():
+    """Current resident set size of this process (peak RSS where /proc is unavailable)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def is_admin(user):
+    return bool(user) and user.get("email") in ADMIN_EMAILS
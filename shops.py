@@ -0,0 +1,158 @@
+"""Repair-shop catalog and nearest-shop search.
+
+Shops live in the repair_shops table, seeded from data/repair_shops.csv
+(`python shops.py --dataset other.csv` replaces them). Each process builds a
+ShopIndex from the table, and rebuilds it when the table's version (bumped
+by triggers on every write) moves: shops bucketed into a lat/lon grid,
+stored as NumPy arrays sorted by cell. A query only looks at the cells overlapping
+the search radius, filters on a services bitmask and computes haversine
+distances for those candidates in one vectorized pass.
+"""
+import argparse
+import csv
+import math
+import threading
+from pathlib import Path
+
+import numpy as np
+
+from utils import db_connection, init_db
+
+DATASET_PATH = Path(__file__).parent / "data" / "repair_shops.csv"
+SERVICES = ["Screen Fix", "Battery Replace", "Hardware Repair", "Water Damage"]
+
+EARTH_RADIUS_KM = 6371.0
+CELL_DEGREES = 0.1   # ~11 km of latitude per grid cell
+DEFAULT_RADIUS_KM = 10
+DEFAULT_K = 10
+
+SHOP_COLUMNS = ("id", "name", "city", "lat", "lon", "rating", "reviews", "eta_days", "repair_cost_estimate", "services")
+
+
+def haversine_km(lat, lon, lats, lons):
+    """Great-circle distance from one point to arrays of points."""
+    lat, lon = np.radians(lat), np.radians(lon)
+    lats, lons = np.radians(lats), np.radians(lons)
+    a = np.sin((lats - lat) / 2) ** 2 + np.cos(lat) * np.cos(lats) * np.sin((lons - lon) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+
+
+def services_mask(services):
+    return sum(1 << SERVICES.index(s) for s in services if s in SERVICES)
+
+
+class ShopIndex:
+    """Grid index over shops (dicts with at least lat, lon and a services list)."""
+
+    def __init__(self, shops, cell_degrees=CELL_DEGREES):
+        self.cell = cell_degrees
+        self.n_cols = math.ceil(360 / cell_degrees) + 1
+        lats = np.array([s["lat"] for s in shops], dtype=np.float64)
+        lons = np.array([s["lon"] for s in shops], dtype=np.float64)
+        masks = np.array([services_mask(s["services"]) for s in shops], dtype=np.int64)
+
+        order = np.argsort(self._cells(lats, lons), kind="stable")
+        self.shops = [shops[i] for i in order]
+        self.lats, self.lons, self.masks = lats[order], lons[order], masks[order]
+        self.keys = self._cells(self.lats, self.lons)
+
+    def __len__(self):
+        return len(self.shops)
+
+    def _cells(self, lats, lons):
+        rows = np.floor((np.asarray(lats) + 90) / self.cell).astype(np.int64)
+        cols = np.floor((np.asarray(lons) + 180) / self.cell).astype(np.int64)
+        return rows * self.n_cols + cols
+
+    def _candidates(self, lat, lon, radius_km):
+        # Cells overlapping the radius' bounding box: one contiguous run of
+        # the sorted keys per grid row
+        dlat = radius_km / 111.0
+        dlon = radius_km / (111.0 * max(math.cos(math.radians(lat)), 1e-6))
+        row0 = math.floor((max(lat - dlat, -90) + 90) / self.cell)
+        row1 = math.floor((min(lat + dlat, 90) + 90) / self.cell)
+        if dlon >= 180:
+            col0, col1 = 0, self.n_cols - 1
+        else:
+            col0 = math.floor((max(lon - dlon, -180) + 180) / self.cell)
+            col1 = math.floor((min(lon + dlon, 180) + 180) / self.cell)
+        rows = np.arange(row0, row1 + 1) * self.n_cols
+        starts = np.searchsorted(self.keys, rows + col0, side="left")
+        ends = np.searchsorted(self.keys, rows + col1, side="right")
+        if len(starts) == 0:
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate([np.arange(s, e) for s, e in zip(starts, ends)])
+
+    def nearest(self, lat, lon, radius_km=DEFAULT_RADIUS_KM, services=(), k=DEFAULT_K):
+        """Up to k shops within radius_km offering all `services`, nearest first.
+
+        Returns (shop, distance_km) pairs.
+        """
+        if any(s not in SERVICES for s in services):
+            return []
+        idx = self._candidates(lat, lon, radius_km)
+        wanted = services_mask(services)
+        if wanted:
+            idx = idx[(self.masks[idx] & wanted) == wanted]
+        dist = haversine_km(lat, lon, self.lats[idx], self.lons[idx])
+        inside = dist <= radius_km
+        idx, dist = idx[inside], dist[inside]
+        if len(idx) > k:
+            top = np.argpartition(dist, k)[:k]
+            idx, dist = idx[top], dist[top]
+        order = np.argsort(dist, kind="stable")
+        return [(self.shops[i], float(d)) for i, d in zip(idx[order], dist[order])]
+
+
+# ------------------- CATALOG -------------------
+def load_dataset(path=DATASET_PATH, replace=False):
+    """Fill repair_shops from a CSV (services separated by "|"); returns the row count."""
+    with db_connection() as conn:
+        if not replace and conn.execute("SELECT 1 FROM repair_shops LIMIT 1").fetchone():
+            return 0
+        with open(path, newline="") as f:
+            rows = [tuple(row.get(col) or None for col in SHOP_COLUMNS) for row in csv.DictReader(f)]
+        conn.execute("DELETE FROM repair_shops")
+        conn.executemany(f"""
+            INSERT INTO repair_shops ({", ".join(SHOP_COLUMNS)})
+            VALUES ({", ".join("?" * len(SHOP_COLUMNS))})
+        """, rows)
+    return len(rows)
+
+
+def load_shops():
+    with db_connection() as conn:
+        rows = conn.execute(f"SELECT {', '.join(SHOP_COLUMNS)} FROM repair_shops").fetchall()
+    shops = []
+    for row in rows:
+        shop = dict(zip(SHOP_COLUMNS, row))
+        shop["services"] = [s for s in (shop["services"] or "").split("|") if s]
+        shops.append(shop)
+    return shops
+
+
+_index = None
+_index_version = None
+_index_lock = threading.Lock()
+
+
+def shop_index():
+    """The process-wide ShopIndex, rebuilt whenever repair_shops has changed."""
+    global _index, _index_version
+    with _index_lock:
+        if _index is None:
+            load_dataset()
+        with db_connection() as conn:
+            version = conn.execute("SELECT version FROM repair_shops_state").fetchone()[0]
+        if _index is None or version != _index_version:
+            _index = ShopIndex(load_shops())
+            _index_version = version
+    return _index
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load the repair-shop catalog")
+    parser.add_argument("--dataset", default=str(DATASET_PATH), help="CSV of shops")
+    args = parser.parse_args()
+    init_db()
+    print(f"loaded {load_dataset(args.dataset, replace=True)} repair shops")
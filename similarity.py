@@ -0,0 +1,455 @@
+"""Visual similarity search over listing photos.
+
+The classifier's penultimate layer gives every photo an embedding (see
+inference.py). A listing keeps the normalized mean of its photos' in
+listing_embeddings, as int8 with a per-listing scale (or float16), a few
+hundred bytes each; similar listings are the ones whose embeddings have the
+largest dot product, i.e. cosine similarity, with the query's.
+
+Searches run over an index built from that table into INDEX_DIR: the
+vectors as one memory-mapped .npy matrix, scanned exactly a chunk at a time.
+For large catalogs the build can also group the vectors into IVF lists
+around k-means centroids, so a query scans only the lists nearest to it,
+optionally ranking those by product-quantized (PQ) codes and re-scoring just
+the best exactly. Embeddings written after the last build are searched
+exactly from memory until the next one.
+
+    python similarity.py build                  # IVF from IVF_MIN_VECTORS up
+    python similarity.py build --ivf --pq 32    # IVF lists, 32-byte PQ codes
+    python similarity.py backfill               # embed listings saved without one
+"""
+import argparse
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+
+from utils import db_connection, get_listings, init_db
+
+INDEX_DIR = Path(__file__).parent / "media" / "embeddings"
+EMBEDDING_DTYPE = os.environ.get("SMARTCYCLE_EMBEDDING_DTYPE", "int8")
+DEFAULT_K = 12
+# Cosine similarity from which an upload is flagged as a near-duplicate
+DUPLICATE_THRESHOLD = float(os.environ.get("SMARTCYCLE_DUPLICATE_THRESHOLD", 0.95))
+
+# Builds without --ivf/--exact use IVF lists from this many vectors
+IVF_MIN_VECTORS = 200_000
+# Embeddings searched from memory before a new build is started in the background
+REBUILD_TAIL = int(os.environ.get("SMARTCYCLE_SIMILARITY_REBUILD_TAIL", 20_000))
+NPROBE = 16
+# PQ candidates re-scored exactly
+RERANK = 256
+KMEANS_ITERATIONS = 20
+KMEANS_SAMPLE_PER_CENTROID = 64
+PQ_SAMPLE = 65536
+# Rows converted to float32 at a time; small enough to stay in cache
+SCAN_CHUNK = 1024
+BUILD_CHUNK = 65536
+
+
+# ------------------- ENCODING -------------------
+def normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=-1, keepdims=True), 1e-12)
+
+
+def item_embedding(embeddings):
+    """One unit vector for an item from its photos' embeddings (one row per photo)."""
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    return normalize(normalize(embeddings.reshape(len(embeddings), -1)).mean(axis=0))
+
+
+def encode(vector, dtype=EMBEDDING_DTYPE):
+    """(blob, scale) of a vector for listing_embeddings: vector ≈ frombuffer(blob) * scale."""
+    vector = normalize(vector)
+    if dtype == "int8":
+        scale = float(np.abs(vector).max()) / 127 or 1.0
+        return np.round(vector / scale).astype(np.int8).tobytes(), scale
+    if dtype == "float16":
+        return vector.astype(np.float16).tobytes(), 1.0
+    raise ValueError(f"unknown embedding dtype {dtype!r}")
+
+
+def decode(blob, dtype, scale):
+    return np.frombuffer(blob, dtype=dtype).astype(np.float32) * scale
+
+
+def save_embeddings(item_ids, vectors):
+    """Store listings' embeddings (None entries are skipped)."""
+    rows = []
+    for item_id, vector in zip(item_ids, vectors):
+        if vector is not None:
+            blob, scale = encode(vector)
+            rows.append((item_id, EMBEDDING_DTYPE, scale, blob))
+    with db_connection() as conn:
+        conn.executemany(
+            "INSERT OR REPLACE INTO listing_embeddings (item_id, dtype, scale, vector) VALUES (?, ?, ?, ?)", rows)
+
+
+def get_embedding(item_id):
+    with db_connection() as conn:
+        row = conn.execute(
+            "SELECT vector, dtype, scale FROM listing_embeddings WHERE item_id = ?", (item_id,)).fetchone()
+    return None if row is None else normalize(decode(*row))
+
+
+# ------------------- K-MEANS -------------------
+def _nearest(x, centroids, spherical):
+    # Largest dot product; for Euclidean k-means, smallest |x - c|^2
+    scores = x @ centroids.T
+    if not spherical:
+        scores -= 0.5 * (centroids ** 2).sum(axis=1)
+    return scores.argmax(axis=1)
+
+
+def kmeans(x, k, spherical=True, iterations=KMEANS_ITERATIONS, seed=0):
+    x = np.ascontiguousarray(x, dtype=np.float32)
+    rng = np.random.default_rng(seed)
+    centroids = x[rng.choice(len(x), k, replace=False)].copy()
+    for _ in range(iterations):
+        labels = np.concatenate([_nearest(x[s:s + BUILD_CHUNK], centroids, spherical)
+                                 for s in range(0, len(x), BUILD_CHUNK)])
+        sums = np.stack([np.bincount(labels, x[:, j], minlength=k) for j in range(x.shape[1])], axis=1)
+        counts = np.bincount(labels, minlength=k)
+        empty = counts == 0
+        # Re-seed empty clusters from random points
+        sums[empty] = x[rng.choice(len(x), int(empty.sum()))]
+        centroids = (sums / np.maximum(counts, 1)[:, None]).astype(np.float32)
+        if spherical:
+            centroids = normalize(centroids)
+    return centroids
+
+
+# ------------------- INDEX -------------------
+def _top(scores, k):
+    if len(scores) <= k:
+        return np.argsort(-scores)
+    best = np.argpartition(-scores, k)[:k]
+    return best[np.argsort(-scores[best])]
+
+
+def _reencoded(row, dtype):
+    # (scale, blob) of a listing_embeddings row in another dtype
+    blob, scale = encode(decode(row[3], row[1], row[2]), dtype)
+    return scale, blob
+
+
+class SimilarityIndex:
+    def __init__(self, directory=INDEX_DIR):
+        self.directory = Path(directory)
+        self.build_name = None
+        self.meta = {"last_id": 0}
+        self.ids = np.empty(0, dtype=np.int64)
+        self.vectors = None
+        self.scales = np.empty(0, dtype=np.float32)
+        self.centroids = self.offsets = self.codebooks = self.codes = None
+        # Embeddings written since the build, as float32 rows
+        self.last_id = 0
+        self.tail_ids = np.empty(0, dtype=np.int64)
+        self.tail_vectors = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.ids) + len(self.tail_ids)
+
+    # ------------------- BUILD -------------------
+    def build(self, conn, ivf=None, nlist=None, pq=None, dtype=EMBEDDING_DTYPE, log=None):
+        """Write a new index of every embedding in the table and make it current."""
+        count, last_id = conn.execute("SELECT COUNT(*), COALESCE(MAX(id), 0) FROM listing_embeddings").fetchone()
+        first = conn.execute("SELECT vector, dtype FROM listing_embeddings ORDER BY id DESC LIMIT 1").fetchone()
+        dim = len(first[0]) // np.dtype(first[1]).itemsize if first else 0
+        if ivf is None:
+            ivf = count >= IVF_MIN_VECTORS
+        nlist = min(nlist or int(2 * np.sqrt(count)), count) if ivf and count else 0
+
+        name = f"build-{last_id}-{time.time_ns()}"
+        out = self.directory / name
+        out.mkdir(parents=True)
+        ids = np.lib.format.open_memmap(out / "ids.npy", "w+", np.int64, (count,))
+        vectors = np.lib.format.open_memmap(out / "vectors.npy", "w+", dtype, (count, dim))
+        scales = np.lib.format.open_memmap(out / "scales.npy", "w+", np.float32, (count,))
+        # Newest first, so a vector of another length (an older model's) is the one skipped
+        rows = conn.execute("SELECT item_id, dtype, scale, vector FROM listing_embeddings ORDER BY id DESC")
+        n = 0
+        while chunk := rows.fetchmany(BUILD_CHUNK):
+            chunk = [r if r[1] == dtype else (r[0], dtype, *_reencoded(r, dtype)) for r in chunk]
+            chunk = [r for r in chunk if len(r[3]) == dim * np.dtype(dtype).itemsize]
+            ids[n:n + len(chunk)] = [r[0] for r in chunk]
+            scales[n:n + len(chunk)] = [r[2] for r in chunk]
+            vectors[n:n + len(chunk)] = np.frombuffer(b"".join(r[3] for r in chunk), dtype=dtype).reshape(-1, dim)
+            n += len(chunk)
+        if log:
+            log(f"{n} embeddings ({dim} dims, {dtype}) written")
+
+        meta = {"dtype": dtype, "dim": dim, "count": n, "last_id": last_id, "nlist": nlist, "pq": pq if nlist else None}
+        if nlist:
+            self._build_ivf(out, ids[:n], vectors[:n], scales[:n], nlist, meta["pq"], log)
+        del ids, vectors, scales
+        (out / "meta.json").write_text(json.dumps(meta))
+
+        # Readers switch over on their next refresh; the old build goes once
+        # it's no longer current (open memory maps stay valid on POSIX)
+        pointer = self.directory / "CURRENT"
+        (self.directory / "CURRENT.tmp").write_text(name)
+        os.replace(self.directory / "CURRENT.tmp", pointer)
+        for old in self.directory.glob("build-*"):
+            if old.name != name:
+                shutil.rmtree(old, ignore_errors=True)
+        return meta
+
+    def _build_ivf(self, out, ids, vectors, scales, nlist, pq, log):
+        rng = np.random.default_rng(0)
+        sample_rows = np.sort(rng.choice(len(ids), min(len(ids), nlist * KMEANS_SAMPLE_PER_CENTROID), replace=False))
+        sample = normalize(vectors[sample_rows].astype(np.float32))
+        centroids = kmeans(sample, nlist)
+        labels = np.concatenate([
+            _nearest(vectors[s:s + BUILD_CHUNK].astype(np.float32), centroids, spherical=True)
+            for s in range(0, len(ids), BUILD_CHUNK)
+        ])
+        # Each list's vectors contiguous, so probing a list reads one slice
+        order = np.argsort(labels, kind="stable")
+        np.save(out / "centroids.npy", centroids)
+        np.save(out / "offsets.npy", np.searchsorted(labels[order], np.arange(nlist + 1)))
+        for name, array in (("ids", ids), ("vectors", vectors), ("scales", scales)):
+            sorted_array = np.lib.format.open_memmap(out / f"{name}.ivf.npy", "w+", array.dtype, array.shape)
+            for s in range(0, len(order), BUILD_CHUNK):
+                sorted_array[s:s + BUILD_CHUNK] = array[order[s:s + BUILD_CHUNK]]
+            sorted_array.flush()
+            del sorted_array
+            os.replace(out / f"{name}.ivf.npy", out / f"{name}.npy")
+        if log:
+            log(f"{nlist} IVF lists")
+
+        if pq:
+            dim = vectors.shape[1]
+            if dim % pq:
+                raise ValueError(f"--pq {pq} doesn't divide the {dim} embedding dimensions")
+            vectors = np.load(out / "vectors.npy", mmap_mode="r")
+            scales = np.load(out / "scales.npy", mmap_mode="r")
+            sample_rows = np.sort(rng.choice(sample_rows, min(len(sample_rows), PQ_SAMPLE), replace=False))
+            sample = vectors[sample_rows].astype(np.float32) * scales[sample_rows, None]
+            sub = dim // pq
+            codebooks = np.stack([
+                kmeans(sample[:, j * sub:(j + 1) * sub], min(256, len(sample)), spherical=False) for j in range(pq)
+            ])
+            codes = np.lib.format.open_memmap(out / "codes.npy", "w+", np.uint8, (len(ids), pq))
+            for s in range(0, len(ids), BUILD_CHUNK):
+                chunk = vectors[s:s + BUILD_CHUNK].astype(np.float32) * scales[s:s + BUILD_CHUNK, None]
+                for j in range(pq):
+                    part = np.ascontiguousarray(chunk[:, j * sub:(j + 1) * sub])
+                    codes[s:s + BUILD_CHUNK, j] = _nearest(part, codebooks[j], spherical=False)
+            np.save(out / "codebooks.npy", codebooks)
+            del codes
+            if log:
+                log(f"{pq}-byte PQ codes")
+
+    # ------------------- REFRESH -------------------
+    def _load(self, name):
+        path = self.directory / name
+        self.meta = json.loads((path / "meta.json").read_text())
+        mapped = lambda f: np.load(path / f, mmap_mode="r") if (path / f).exists() else None
+        self.ids = mapped("ids.npy")[:self.meta["count"]]
+        self.vectors = mapped("vectors.npy")[:self.meta["count"]]
+        self.scales = mapped("scales.npy")[:self.meta["count"]]
+        self.centroids, self.offsets = mapped("centroids.npy"), mapped("offsets.npy")
+        # The codes are small and read at random; keep them in memory
+        self.codebooks = mapped("codebooks.npy")
+        self.codes = None if self.codebooks is None else np.array(mapped("codes.npy"))
+        self.build_name = name
+        self.last_id = self.meta["last_id"]
+        self.tail_ids = np.empty(0, dtype=np.int64)
+        self.tail_vectors = None
+
+    def refresh(self, conn):
+        """Switch to the current build if it changed, then load embeddings written since."""
+        pointer = self.directory / "CURRENT"
+        name = pointer.read_text().strip() if pointer.exists() else None
+        if name and name != self.build_name:
+            self._load(name)
+        rows = conn.execute(
+            "SELECT id, item_id, vector, dtype, scale FROM listing_embeddings WHERE id > ? ORDER BY id",
+            (self.last_id,)).fetchall()
+        if not rows:
+            return
+        self.last_id = rows[-1][0]
+        if not self.meta.get("dim"):
+            self.meta["dim"] = len(decode(*rows[-1][2:]))
+        rows = [r for r in rows if len(r[2]) // np.dtype(r[3]).itemsize == self.meta["dim"]]
+        if not rows:
+            return
+        added_ids = np.array([r[1] for r in rows], dtype=np.int64)
+        added = np.stack([decode(*r[2:]) for r in rows])
+        if self.tail_vectors is not None:
+            # Replaced embeddings
+            kept = ~np.isin(self.tail_ids, added_ids)
+            added_ids = np.concatenate([self.tail_ids[kept], added_ids])
+            added = np.concatenate([self.tail_vectors[kept], added])
+        self.tail_ids, self.tail_vectors = added_ids, added
+
+    # ------------------- SEARCH -------------------
+    def _score(self, start, stop, query):
+        # Exact scores of a slice of the mapped matrix, converted a chunk at a time
+        scores = np.empty(stop - start, dtype=np.float32)
+        buffer = np.empty((SCAN_CHUNK, self.vectors.shape[1]), dtype=np.float32)
+        for s in range(start, stop, SCAN_CHUNK):
+            e = min(s + SCAN_CHUNK, stop)
+            buffer[:e - s] = self.vectors[s:e]
+            scores[s - start:e - start] = buffer[:e - s] @ query
+        return scores * self.scales[start:stop]
+
+    def _search_ivf(self, query, k, nprobe):
+        lists = _top(self.centroids @ query, nprobe)
+        spans = [(int(self.offsets[i]), int(self.offsets[i + 1])) for i in lists]
+        rows = np.concatenate([np.arange(a, b) for a, b in spans]) if spans else np.empty(0, dtype=np.int64)
+        if self.codes is None:
+            return rows, np.concatenate([self._score(a, b, query) for a, b in spans] or [np.empty(0, np.float32)])
+        # Rank the probed lists by their PQ codes, re-score the best exactly
+        sub = len(query) // self.codes.shape[1]
+        tables = np.einsum("jcs,js->jc", self.codebooks, query.reshape(-1, sub))
+        approximate = tables[np.arange(self.codes.shape[1]), self.codes[rows]].sum(axis=1)
+        rows = np.sort(rows[_top(approximate, max(RERANK, k))])
+        exact = (self.vectors[rows].astype(np.float32) @ query) * self.scales[rows]
+        return rows, exact
+
+    def search(self, query, k=DEFAULT_K, exclude=(), nprobe=NPROBE, exact=False):
+        """[(item_id, cosine similarity)] of the k nearest listings, best first."""
+        query = normalize(query)
+        ids, scores = [], []
+        if self.vectors is not None and len(self.ids) and len(query) == self.vectors.shape[1]:
+            if self.centroids is not None and not exact:
+                rows, found = self._search_ivf(query, k + len(exclude), nprobe)
+            else:
+                found = self._score(0, len(self.ids), query)
+                rows = np.arange(len(found))
+            best = _top(found, k + len(exclude))
+            found_ids = np.asarray(self.ids[rows[best]])
+            # Listings whose embedding was replaced since the build are in the tail
+            fresh = ~np.isin(found_ids, self.tail_ids)
+            ids.append(found_ids[fresh])
+            scores.append(found[best][fresh])
+        if self.tail_vectors is not None and len(query) == self.tail_vectors.shape[1]:
+            found = self.tail_vectors @ query
+            best = _top(found, k + len(exclude))
+            ids.append(self.tail_ids[best])
+            scores.append(found[best])
+        if not ids:
+            return []
+        ids, scores = np.concatenate(ids), np.concatenate(scores)
+        hits = {}
+        for i in np.argsort(-scores, kind="stable"):
+            item_id = int(ids[i])
+            if item_id not in exclude and item_id not in hits:
+                # int8 rounding can overshoot a perfect match slightly
+                hits[item_id] = min(float(scores[i]), 1.0)
+        return list(hits.items())[:k]
+
+
+_index = SimilarityIndex()
+_rebuild_thread = None
+
+
+def _rebuild():
+    try:
+        with db_connection() as conn:
+            SimilarityIndex(_index.directory).build(conn)
+    except Exception:
+        logging.getLogger(__name__).exception("similarity index build failed")
+
+
+def similarity_index():
+    """The process-wide SimilarityIndex, with embeddings written since its build loaded."""
+    global _rebuild_thread
+    with _index._lock, db_connection() as conn:
+        _index.refresh(conn)
+        if len(_index.tail_ids) >= REBUILD_TAIL and (_rebuild_thread is None or not _rebuild_thread.is_alive()):
+            # Picked up by the next refresh once it is current
+            _rebuild_thread = threading.Thread(target=_rebuild, name="similarity-build", daemon=True)
+            _rebuild_thread.start()
+    return _index
+
+
+def _with_listings(hits, k):
+    listings = get_listings([item_id for item_id, _ in hits])
+    scores = dict(hits)
+    return [{**item, "similarity": scores[item["id"]]} for item in listings][:k]
+
+
+def search(vector, k=DEFAULT_K, exclude=()):
+    index = similarity_index()
+    with index._lock:
+        # Over-fetch: sold listings drop out
+        return index.search(vector, 2 * k, exclude)
+
+
+def similar_listings(item_id, k=DEFAULT_K):
+    """Active listings that look most like `item_id`, best first, with their "similarity"."""
+    vector = get_embedding(item_id)
+    if vector is None:
+        return []
+    return _with_listings(search(vector, k, exclude={item_id}), k)
+
+
+def find_near_duplicates(vector, threshold=DUPLICATE_THRESHOLD, k=5):
+    """Active listings whose photos look like near-copies of an embedding's."""
+    if vector is None:
+        return []
+    return _with_listings([(i, s) for i, s in search(vector, k) if s >= threshold], k)
+
+
+# ------------------- BACKFILL -------------------
+def backfill_embeddings(chunk_size=64, log=print):
+    """Embed the stored photo of every listing that has no embedding yet."""
+    from ai_core import load_cnn_model
+    from imagestore import original_path
+    from preprocess import preprocess_batch
+
+    model = load_cnn_model()
+    done = 0
+    after = 0
+    while True:
+        with db_connection() as conn:
+            rows = conn.execute("""
+                SELECT id, json_extract(data_json, '$.image_id') FROM items
+                WHERE id > ? AND json_extract(data_json, '$.image_id') IS NOT NULL
+                  AND id NOT IN (SELECT item_id FROM listing_embeddings)
+                ORDER BY id LIMIT ?
+            """, (after, chunk_size)).fetchall()
+        if not rows:
+            return done
+        after = rows[-1][0]
+        rows = [(item_id, original_path(image_id)) for item_id, image_id in rows if original_path(image_id).exists()]
+        if rows:
+            batch, _ = preprocess_batch([str(path) for _, path in rows])
+            _, embeddings = model.predict_with_embeddings(batch)
+            if embeddings is None:
+                raise RuntimeError("this inference backend has no embedding output; re-export it (inference.py)")
+            save_embeddings([item_id for item_id, _ in rows], [item_embedding(e[None]) for e in embeddings])
+            done += len(rows)
+        log(f"embedded {done} listings")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the listing similarity index or backfill embeddings")
+    sub = parser.add_subparsers(dest="command", required=True)
+    build = sub.add_parser("build", help="write a new index from listing_embeddings")
+    mode = build.add_mutually_exclusive_group()
+    mode.add_argument("--ivf", action="store_true", default=None, help="group vectors into IVF lists")
+    mode.add_argument("--exact", action="store_false", dest="ivf", help="exact scan only")
+    build.add_argument("--nlist", type=int, help="IVF lists (default: twice the square root of the vector count)")
+    build.add_argument("--pq", type=int, help="PQ code bytes per vector (must divide the dimensions)")
+    sub.add_parser("backfill", help="embed listings saved without an embedding")
+    args = parser.parse_args()
+
+    init_db()
+    if args.command == "build":
+        started = time.perf_counter()
+        with db_connection() as conn:
+            meta = SimilarityIndex().build(conn, args.ivf, args.nlist, args.pq, log=print)
+        print(f"index of {meta['count']} vectors built in {time.perf_counter() - started:.1f}s")
+    else:
+        backfill_embeddings()
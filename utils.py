@@ -2,14 +2,109 @@ import sqlite3
 import json
 from datetime import datetime
 from pathlib import Path
+from contextlib import contextmanager
+import difflib
 import hashlib
+import os
+import queue
+import re
+import threading
+
+from chat_bus import message_bus
+from geocode import bounding_box, distance_km, geocode
 
 # Use a path relative to current file (works on Streamlit Cloud)
 DB_PATH = Path(__file__).parent / "smartcycle.db"
 
+# ------------------- CONNECTIONS -------------------
+# Every data function borrows a long-lived connection from a per-database pool
+# instead of opening a new one. Connections keep sqlite3's prepared-statement
+# cache warm across calls, and WAL lets readers run alongside a writer.
+POOL_SIZE = int(os.environ.get("SMARTCYCLE_DB_POOL_SIZE", 8))
+STATEMENT_CACHE_SIZE = 256
+
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA cache_size=-16000",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA temp_store=MEMORY",
+)
+
+
+class ConnectionPool:
+    def __init__(self, path, size=POOL_SIZE):
+        self.path = str(path)
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+
+    def _connect(self):
+        conn = sqlite3.connect(
+            self.path,
+            timeout=5,
+            check_same_thread=False,
+            cached_statements=STATEMENT_CACHE_SIZE,
+        )
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        conn.create_function("distance_km", 4, distance_km, deterministic=True)
+        return conn
+
+    def acquire(self):
+        self._slots.acquire()
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        try:
+            return self._connect()
+        except Exception:
+            self._slots.release()
+            raise
+
+    def release(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        self._idle.put(conn)
+        self._slots.release()
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool():
+    # Keyed by pid as well so a forked worker never reuses its parent's handles
+    key = (os.getpid(), str(DB_PATH))
+    pool = _pools.get(key)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.setdefault(key, ConnectionPool(DB_PATH))
+    return pool
+
+
+@contextmanager
+def db_connection():
+    """Borrow a pooled connection; commits on success and rolls back on error."""
+    pool = get_pool()
+    conn = pool.acquire()
+    try:
+        with conn:
+            yield conn
+    finally:
+        pool.release(conn)
+
 # ------------------- DB INIT -------------------
 def init_db():
-    with sqlite3.connect(DB_PATH) as conn:
+    with db_connection() as conn:
         c = conn.cursor()
 
         c.execute("""
@@ -62,110 +157,914 @@ def init_db():
         """)
 
         conn.commit()
+        migrate(conn)
+
+# ------------------- MIGRATIONS -------------------
+# Schema changes after the base tables above. PRAGMA user_version records how
+# many have been applied; append new steps, never reorder them.
+def _migrate_listing_columns(c):
+    # Typed copies of the listing fields pages filter and sort on
+    for column in ("category", "model", "condition_score", "suggested_price", "co2_saved", "status"):
+        c.execute(f"ALTER TABLE items ADD COLUMN {column} {LISTING_COLUMN_TYPES[column]}")
+    c.execute(f"""
+        UPDATE items SET
+            category = json_extract(data_json, '$.analysis.category'),
+            model = json_extract(data_json, '$.analysis.model'),
+            condition_score = COALESCE(json_extract(data_json, '$.analysis.condition_score'), 0),
+            suggested_price = COALESCE(json_extract(data_json, '$.prices.suggested_price'), 0),
+            co2_saved = COALESCE(json_extract(data_json, '$.lca.co2_saved'), 0),
+            status = COALESCE(json_extract(data_json, '$.status'), 'active')
+    """)
+    for name in ("idx_items_category", "idx_items_model", "idx_items_price", "idx_items_condition"):
+        c.execute(f"DROP INDEX IF EXISTS {name}")
+    c.execute("CREATE INDEX idx_items_user ON items(user_email, id)")
+    c.execute("CREATE INDEX idx_items_category_price ON items(category, suggested_price)")
+    c.execute("CREATE INDEX idx_items_category_condition ON items(category, condition_score)")
+    c.execute("CREATE INDEX idx_items_category_created ON items(category, created_at)")
+    c.execute("CREATE INDEX idx_items_status_created ON items(status, created_at)")
+    c.execute("CREATE INDEX idx_items_created ON items(created_at)")
+    c.execute("CREATE INDEX idx_items_model ON items(model)")
+    c.execute("CREATE INDEX idx_items_price ON items(suggested_price)")
+    c.execute("CREATE INDEX idx_items_condition ON items(condition_score)")
+
+def _migrate_message_search(c):
+    # External-content FTS index: the text lives in messages/chatrooms and the
+    # index is kept current by triggers, so nothing is stored twice.
+    c.execute("""
+        CREATE VIEW message_search_source AS
+        SELECT m.id AS id, m.message AS message, m.sender_email AS sender_email, r.name AS room_name
+        FROM messages m JOIN chatrooms r ON r.id = m.chatroom_id
+    """)
+    c.execute("""
+        CREATE VIRTUAL TABLE messages_fts USING fts5(
+            message, sender_email, room_name,
+            content='message_search_source', content_rowid='id',
+            prefix='2 3'
+        )
+    """)
+    c.execute("""
+        CREATE TRIGGER messages_fts_insert AFTER INSERT ON messages BEGIN
+            INSERT INTO messages_fts(rowid, message, sender_email, room_name)
+            VALUES (new.id, new.message, new.sender_email,
+                    (SELECT name FROM chatrooms WHERE id = new.chatroom_id));
+        END
+    """)
+    c.execute("""
+        CREATE TRIGGER messages_fts_delete AFTER DELETE ON messages BEGIN
+            INSERT INTO messages_fts(messages_fts, rowid, message, sender_email, room_name)
+            VALUES ('delete', old.id, old.message, old.sender_email,
+                    (SELECT name FROM chatrooms WHERE id = old.chatroom_id));
+        END
+    """)
+    c.execute("""
+        CREATE TRIGGER messages_fts_update AFTER UPDATE OF message, sender_email ON messages BEGIN
+            INSERT INTO messages_fts(messages_fts, rowid, message, sender_email, room_name)
+            VALUES ('delete', old.id, old.message, old.sender_email,
+                    (SELECT name FROM chatrooms WHERE id = old.chatroom_id));
+            INSERT INTO messages_fts(rowid, message, sender_email, room_name)
+            VALUES (new.id, new.message, new.sender_email,
+                    (SELECT name FROM chatrooms WHERE id = new.chatroom_id));
+        END
+    """)
+    c.execute("""
+        CREATE TRIGGER messages_fts_room_rename AFTER UPDATE OF name ON chatrooms BEGIN
+            INSERT INTO messages_fts(messages_fts, rowid, message, sender_email, room_name)
+            SELECT 'delete', id, message, sender_email, old.name FROM messages WHERE chatroom_id = old.id;
+            INSERT INTO messages_fts(rowid, message, sender_email, room_name)
+            SELECT id, message, sender_email, new.name FROM messages WHERE chatroom_id = new.id;
+        END
+    """)
+    c.execute("INSERT INTO messages_fts(messages_fts) VALUES ('rebuild')")
+
+def _migrate_private_pairs(c):
+    # One row per DM, keyed by the two emails in sorted order
+    c.execute("""
+        CREATE TABLE private_pairs (
+            user_a TEXT NOT NULL,
+            user_b TEXT NOT NULL,
+            chatroom_id INTEGER NOT NULL,
+            PRIMARY KEY (user_a, user_b),
+            FOREIGN KEY (chatroom_id) REFERENCES chatrooms(id)
+        ) WITHOUT ROWID
+    """)
+    # Existing DMs are the two-member rooms; if a pair has several, keep the oldest
+    c.execute("""
+        INSERT OR IGNORE INTO private_pairs (user_a, user_b, chatroom_id)
+        SELECT MIN(user_email), MAX(user_email), chatroom_id
+        FROM chat_participants
+        GROUP BY chatroom_id
+        HAVING COUNT(*) = 2
+        ORDER BY chatroom_id
+    """)
+
+def _migrate_room_visibility(c):
+    c.execute("ALTER TABLE chatrooms ADD COLUMN is_private INTEGER NOT NULL DEFAULT 0")
+    c.execute("UPDATE chatrooms SET is_private = 1 WHERE id IN (SELECT chatroom_id FROM chat_participants)")
+    c.execute("CREATE INDEX idx_chatrooms_private ON chatrooms(is_private, id)")
+    c.execute("CREATE INDEX idx_chat_participants_user ON chat_participants(user_email, chatroom_id)")
+    c.execute("CREATE INDEX idx_messages_room ON messages(chatroom_id, id)")
+    # Highest message id each user has seen per room, for unread counts
+    c.execute("""
+        CREATE TABLE chat_reads (
+            user_email TEXT NOT NULL,
+            chatroom_id INTEGER NOT NULL,
+            last_read_id INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_email, chatroom_id)
+        ) WITHOUT ROWID
+    """)
+
+def _migrate_analysis_cache(c):
+    c.execute("""
+        CREATE TABLE analysis_cache (
+            cache_key TEXT PRIMARY KEY,
+            result_json TEXT NOT NULL,
+            created_at TEXT
+        ) WITHOUT ROWID
+    """)
+
+def _migrate_user_stats(c):
+    for column in ("water_saved", "energy_saved"):
+        c.execute(f"ALTER TABLE items ADD COLUMN {column} {LISTING_COLUMN_TYPES[column]}")
+    c.execute("""
+        UPDATE items SET
+            water_saved = COALESCE(json_extract(data_json, '$.lca.water_saved'), 0),
+            energy_saved = COALESCE(json_extract(data_json, '$.lca.energy_saved'), 0)
+    """)
+    # Covers the dashboard's per-item chart without touching the row (and its
+    # large data_json); also serves everything idx_items_user did
+    c.execute("DROP INDEX idx_items_user")
+    c.execute("""
+        CREATE INDEX idx_items_user_impact
+        ON items(user_email, id, model, co2_saved, water_saved, energy_saved)
+    """)
+
+    # Per-seller totals, kept current by triggers on items so every writer
+    # (the app, bulk import, recompute job) updates them
+    c.execute("""
+        CREATE TABLE user_stats (
+            user_email TEXT PRIMARY KEY,
+            items_listed INTEGER NOT NULL DEFAULT 0,
+            items_active INTEGER NOT NULL DEFAULT 0,
+            items_sold INTEGER NOT NULL DEFAULT 0,
+            co2_saved REAL NOT NULL DEFAULT 0,
+            water_saved REAL NOT NULL DEFAULT 0,
+            energy_saved REAL NOT NULL DEFAULT 0
+        ) WITHOUT ROWID
+    """)
+    add_new = """
+        INSERT INTO user_stats
+            (user_email, items_listed, items_active, items_sold, co2_saved, water_saved, energy_saved)
+        VALUES (new.user_email, 1, new.status = 'active', new.status = 'sold',
+                new.co2_saved, new.water_saved, new.energy_saved)
+        ON CONFLICT(user_email) DO UPDATE SET
+            items_listed = items_listed + 1,
+            items_active = items_active + excluded.items_active,
+            items_sold = items_sold + excluded.items_sold,
+            co2_saved = co2_saved + excluded.co2_saved,
+            water_saved = water_saved + excluded.water_saved,
+            energy_saved = energy_saved + excluded.energy_saved;
+    """
+    subtract_old = """
+        UPDATE user_stats SET
+            items_listed = items_listed - 1,
+            items_active = items_active - (old.status = 'active'),
+            items_sold = items_sold - (old.status = 'sold'),
+            co2_saved = co2_saved - old.co2_saved,
+            water_saved = water_saved - old.water_saved,
+            energy_saved = energy_saved - old.energy_saved
+        WHERE user_email = old.user_email;
+    """
+    c.execute(f"CREATE TRIGGER user_stats_insert AFTER INSERT ON items BEGIN {add_new} END")
+    c.execute(f"CREATE TRIGGER user_stats_delete AFTER DELETE ON items BEGIN {subtract_old} END")
+    c.execute(f"""
+        CREATE TRIGGER user_stats_update
+        AFTER UPDATE OF user_email, status, co2_saved, water_saved, energy_saved ON items
+        BEGIN {subtract_old} {add_new} END
+    """)
+    c.execute("""
+        INSERT INTO user_stats
+            (user_email, items_listed, items_active, items_sold, co2_saved, water_saved, energy_saved)
+        SELECT user_email, COUNT(*), SUM(status = 'active'), SUM(status = 'sold'),
+               SUM(co2_saved), SUM(water_saved), SUM(energy_saved)
+        FROM items GROUP BY user_email
+    """)
+
+def _migrate_repair_shops(c):
+    # Loaded from data/repair_shops.csv by shops.load_dataset()
+    c.execute("""
+        CREATE TABLE repair_shops (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            city TEXT,
+            lat REAL NOT NULL,
+            lon REAL NOT NULL,
+            rating REAL,
+            reviews INTEGER,
+            eta_days INTEGER,
+            repair_cost_estimate REAL,
+            services TEXT
+        )
+    """)
+
+def _migrate_locations(c):
+    # Coordinates geocoded from users.location; listings take their seller's
+    for table in ("users", "items"):
+        c.execute(f"ALTER TABLE {table} ADD COLUMN lat REAL")
+        c.execute(f"ALTER TABLE {table} ADD COLUMN lon REAL")
+
+    # R*Tree over located listings for radius queries, kept in step with
+    # items.lat/lon by triggers
+    c.execute("CREATE VIRTUAL TABLE items_geo USING rtree(id, min_lat, max_lat, min_lon, max_lon)")
+    add_new = """
+        INSERT INTO items_geo (id, min_lat, max_lat, min_lon, max_lon)
+        SELECT new.id, new.lat, new.lat, new.lon, new.lon
+        WHERE new.lat IS NOT NULL AND new.lon IS NOT NULL;
+    """
+    remove_old = "DELETE FROM items_geo WHERE id = old.id;"
+    c.execute(f"CREATE TRIGGER items_geo_insert AFTER INSERT ON items BEGIN {add_new} END")
+    c.execute(f"CREATE TRIGGER items_geo_delete AFTER DELETE ON items BEGIN {remove_old} END")
+    c.execute(f"CREATE TRIGGER items_geo_update AFTER UPDATE OF lat, lon ON items BEGIN {remove_old} {add_new} END")
+    _backfill_coordinates(c)
+
+def _migrate_listing_versions(c):
+    # Every write to a listing stamps it with the next catalog version, so a
+    # cache can fetch just what changed since the version it last saw
+    # (catalog.py). Deletes can't be fetched that way; they record the
+    # version at which they happened instead.
+    c.execute("ALTER TABLE items ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+    c.execute("""
+        CREATE TABLE catalog_state (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL,
+            deleted_version INTEGER NOT NULL
+        )
+    """)
+    c.execute("UPDATE items SET version = id")
+    c.execute("INSERT INTO catalog_state SELECT 1, COALESCE(MAX(id), 0), 0 FROM items")
+    c.execute("CREATE INDEX idx_items_version ON items(version)")
+    stamp_new = """
+        UPDATE catalog_state SET version = version + 1;
+        UPDATE items SET version = (SELECT version FROM catalog_state) WHERE id = new.id;
+    """
+    c.execute(f"CREATE TRIGGER items_version_insert AFTER INSERT ON items BEGIN {stamp_new} END")
+    c.execute(f"""
+        CREATE TRIGGER items_version_update
+        AFTER UPDATE OF user_email, data_json, category, model, condition_score, suggested_price,
+                        co2_saved, status, water_saved, energy_saved, lat, lon ON items
+        BEGIN {stamp_new} END
+    """)
+    c.execute("""
+        CREATE TRIGGER items_version_delete AFTER DELETE ON items BEGIN
+            UPDATE catalog_state SET version = version + 1, deleted_version = version + 1;
+        END
+    """)
+
+def _migrate_listing_search(c):
+    # External-content FTS index over each listing's model, category and the
+    # seller's description, like messages_fts; listings_vocab lists its terms
+    # for typo correction (see listing_search_query)
+    c.execute("""
+        CREATE VIEW listing_search_source AS
+        SELECT id, model, category, json_extract(data_json, '$.description') AS description
+        FROM items
+    """)
+    c.execute("""
+        CREATE VIRTUAL TABLE listings_fts USING fts5(
+            model, category, description,
+            content='listing_search_source', content_rowid='id',
+            prefix='2 3'
+        )
+    """)
+    # A hit on the model outranks one on the category, which outranks the description
+    c.execute("INSERT INTO listings_fts(listings_fts, rank) VALUES ('rank', 'bm25(10.0, 5.0, 1.0)')")
+    c.execute("CREATE VIRTUAL TABLE listings_vocab USING fts5vocab(listings_fts, 'row')")
+    add_new = """
+        INSERT INTO listings_fts(rowid, model, category, description)
+        VALUES (new.id, new.model, new.category, json_extract(new.data_json, '$.description'));
+    """
+    remove_old = """
+        INSERT INTO listings_fts(listings_fts, rowid, model, category, description)
+        VALUES ('delete', old.id, old.model, old.category, json_extract(old.data_json, '$.description'));
+    """
+    c.execute(f"CREATE TRIGGER listings_fts_insert AFTER INSERT ON items BEGIN {add_new} END")
+    c.execute(f"CREATE TRIGGER listings_fts_delete AFTER DELETE ON items BEGIN {remove_old} END")
+    # data_json also changes on re-pricing; only reindex when the text did
+    c.execute(f"""
+        CREATE TRIGGER listings_fts_update AFTER UPDATE OF model, category, data_json ON items
+        WHEN old.model IS NOT new.model OR old.category IS NOT new.category
+          OR json_extract(old.data_json, '$.description') IS NOT json_extract(new.data_json, '$.description')
+        BEGIN {remove_old} {add_new} END
+    """)
+    c.execute("INSERT INTO listings_fts(listings_fts) VALUES ('rebuild')")
+
+def _migrate_listing_embeddings(c):
+    # One image embedding per listing for similarity search (similarity.py).
+    # Replacing a listing's embedding gives it a new id, so an index can pick
+    # up everything written after the id it was built to.
+    c.execute("""
+        CREATE TABLE listing_embeddings (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            item_id INTEGER NOT NULL UNIQUE,
+            dtype TEXT NOT NULL,
+            scale REAL NOT NULL,
+            vector BLOB NOT NULL
+        )
+    """)
+    c.execute("""
+        CREATE TRIGGER listing_embeddings_delete AFTER DELETE ON items BEGIN
+            DELETE FROM listing_embeddings WHERE item_id = old.id;
+        END
+    """)
+
+def _migrate_repair_shop_versions(c):
+    # Bumped by every write to repair_shops, so each process's ShopIndex
+    # (shops.py) notices a re-import and rebuilds
+    c.execute("CREATE TABLE repair_shops_state (id INTEGER PRIMARY KEY CHECK (id = 1), version INTEGER NOT NULL)")
+    c.execute("INSERT INTO repair_shops_state VALUES (1, 0)")
+    for event in ("INSERT", "UPDATE", "DELETE"):
+        c.execute(f"""
+            CREATE TRIGGER repair_shops_version_{event.lower()} AFTER {event} ON repair_shops BEGIN
+                UPDATE repair_shops_state SET version = version + 1;
+            END
+        """)
+
+def _migrate_status_category_index(c):
+    # list_feed_categories skips through it one category at a time
+    c.execute("CREATE INDEX idx_items_status_category ON items(status, category)")
+
+MIGRATIONS = [
+    _migrate_listing_columns,
+    _migrate_message_search,
+    _migrate_private_pairs,
+    _migrate_room_visibility,
+    _migrate_analysis_cache,
+    _migrate_user_stats,
+    _migrate_repair_shops,
+    _migrate_locations,
+    _migrate_listing_versions,
+    _migrate_listing_search,
+    _migrate_listing_embeddings,
+    _migrate_repair_shop_versions,
+    _migrate_status_category_index,
+]
+
+def migrate(conn):
+    # Up to date (every rerun): read the version without taking the write lock
+    if conn.execute("PRAGMA user_version").fetchone()[0] == len(MIGRATIONS):
+        return
+    # IMMEDIATE so two processes starting together don't both apply a step;
+    # the version is read again under the lock
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        for number, step in enumerate(MIGRATIONS[version:], start=version + 1):
+            step(conn.cursor())
+            conn.execute(f"PRAGMA user_version={number}")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
 
 # ------------------- USER MANAGEMENT -------------------
 def create_user(name, email, password_hash, location):
+    lat, lon = geocode(location) or (None, None)
     try:
-        with sqlite3.connect(DB_PATH) as conn:
+        with db_connection() as conn:
             c = conn.cursor()
             created_at = datetime.now().isoformat()
             c.execute("""
-                INSERT INTO users (name, email, password, location, created_at)
-                VALUES (?, ?, ?, ?, ?)
-            """, (name, email, password_hash, location, created_at))
+                INSERT INTO users (name, email, password, location, created_at, lat, lon)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, (name, email, password_hash, location, created_at, lat, lon))
         return True, "User created successfully!"
     except sqlite3.IntegrityError:
         return False, "Email already registered."
 
 def get_user_by_email(email):
-    with sqlite3.connect(DB_PATH) as conn:
+    with db_connection() as conn:
         c = conn.cursor()
         c.execute("SELECT * FROM users WHERE email=?", (email,))
         return c.fetchone()
 
 def update_last_login(email):
-    with sqlite3.connect(DB_PATH) as conn:
+    with db_connection() as conn:
         c = conn.cursor()
         c.execute("UPDATE users SET last_login=? WHERE email=?", (datetime.now().isoformat(), email))
         conn.commit()
 
+def update_user_location(email, location):
+    """Change a user's location; their listings move with them. Returns (lat, lon) or None."""
+    coords = geocode(location)
+    lat, lon = coords or (None, None)
+    with db_connection() as conn:
+        conn.execute("UPDATE users SET location=?, lat=?, lon=? WHERE email=?", (location, lat, lon, email))
+        conn.execute("UPDATE items SET lat=?, lon=? WHERE user_email=?", (lat, lon, email))
+    return coords
+
+def get_user_coordinates(email):
+    """(lat, lon) of a user, or None if their location couldn't be geocoded."""
+    with db_connection() as conn:
+        row = conn.execute("SELECT lat, lon FROM users WHERE email=?", (email,)).fetchone()
+    return (row[0], row[1]) if row and row[0] is not None else None
+
+def _backfill_coordinates(c):
+    rows = c.execute("SELECT id, location FROM users WHERE lat IS NULL AND location IS NOT NULL").fetchall()
+    located = [(*coords, user_id) for user_id, coords in ((r[0], geocode(r[1])) for r in rows) if coords]
+    c.executemany("UPDATE users SET lat=?, lon=? WHERE id=?", located)
+    c.execute("""
+        UPDATE items SET lat = users.lat, lon = users.lon
+        FROM users
+        WHERE users.email = items.user_email AND items.lat IS NULL AND users.lat IS NOT NULL
+    """)
+    return len(located), c.rowcount
+
+def backfill_coordinates():
+    """Geocode users without coordinates and locate their listings; returns (users, listings)."""
+    with db_connection() as conn:
+        return _backfill_coordinates(conn.cursor())
+
 # ------------------- PASSWORD HASH -------------------
 def hash_password(password: str) -> str:
     return hashlib.sha256(password.encode()).hexdigest()
 
 # ------------------- LISTINGS -------------------
+LISTING_COLUMN_TYPES = {
+    "category": "TEXT",
+    "model": "TEXT",
+    "condition_score": "REAL NOT NULL DEFAULT 0",
+    "suggested_price": "REAL NOT NULL DEFAULT 0",
+    "co2_saved": "REAL NOT NULL DEFAULT 0",
+    "status": "TEXT NOT NULL DEFAULT 'active'",
+    "water_saved": "REAL NOT NULL DEFAULT 0",
+    "energy_saved": "REAL NOT NULL DEFAULT 0",
+}
+LISTING_COLUMNS = tuple(LISTING_COLUMN_TYPES)
+
+def listing_columns(item_data):
+    """Values for the typed items columns, in LISTING_COLUMNS order."""
+    analysis = item_data.get("analysis", {})
+    lca = item_data.get("lca", {})
+    return (
+        analysis.get("category"),
+        analysis.get("model"),
+        analysis.get("condition_score", 0),
+        item_data.get("prices", {}).get("suggested_price", 0),
+        lca.get("co2_saved", 0),
+        item_data.get("status", "active"),
+        lca.get("water_saved", 0),
+        lca.get("energy_saved", 0),
+    )
+
 def save_listing(user_email, item_data):
-    with sqlite3.connect(DB_PATH) as conn:
+    return save_listings(user_email, [item_data])[0]
+
+def save_listings(user_email, items_data):
+    """Insert several listings in one transaction, located at their seller; returns their ids."""
+    created_at = datetime.now().isoformat()
+    with db_connection() as conn:
         c = conn.cursor()
-        c.execute("""
-            INSERT INTO items (user_email, data_json, created_at)
+        lat, lon = c.execute("SELECT lat, lon FROM users WHERE email=?", (user_email,)).fetchone() or (None, None)
+        c.executemany(f"""
+            INSERT INTO items (user_email, data_json, created_at, lat, lon, {", ".join(LISTING_COLUMNS)})
+            VALUES (?, ?, ?, ?, ?, {", ".join("?" * len(LISTING_COLUMNS))})
+        """, [
+            (user_email, json.dumps(item_data), created_at, lat, lon, *listing_columns(item_data))
+            for item_data in items_data
+        ])
+        # One transaction holds the write lock, so the ids are consecutive
+        last = c.execute("SELECT last_insert_rowid()").fetchone()[0]
+    return list(range(last - len(items_data) + 1, last + 1))
+
+def imported_sources(user_email):
+    """`import_source` of every listing the bulk importer created for a user."""
+    with db_connection() as conn:
+        rows = conn.execute("""
+            SELECT json_extract(data_json, '$.import_source') FROM items
+            WHERE user_email=? AND json_extract(data_json, '$.import_source') IS NOT NULL
+        """, (user_email,)).fetchall()
+    return {row[0] for row in rows}
+
+USER_LISTING_PAGE_SIZE = 10
+
+def get_user_listings_page(user_email, before_id=None, limit=USER_LISTING_PAGE_SIZE):
+    """One page of a user's listings, newest first, as lightweight summaries.
+
+    Summaries hold the typed columns plus description and image_id; the base64
+    photo of listings saved before the blob store is left out (see
+    get_listing_inline_image). Returns (summaries, before_id of the next page
+    or None).
+    """
+    where, params = ["user_email = ?"], [user_email]
+    if before_id is not None:
+        where.append("id < ?")
+        params.append(before_id)
+    with db_connection() as conn:
+        rows = conn.execute(f"""
+            SELECT id, model, category, condition_score, suggested_price, status,
+                   json_extract(data_json, '$.description'),
+                   json_extract(data_json, '$.image_id'),
+                   json_type(data_json, '$.image') = 'text'
+            FROM items WHERE {" AND ".join(where)}
+            ORDER BY id DESC LIMIT ?
+        """, (*params, limit + 1)).fetchall()
+
+    keys = ("id", "model", "category", "condition_score", "suggested_price", "status",
+            "description", "image_id", "has_inline_image")
+    summaries = [dict(zip(keys, row)) for row in rows[:limit]]
+    return summaries, (summaries[-1]["id"] if len(rows) > limit else None)
+
+def get_listing_inline_image(item_id):
+    """Base64 photo stored inside an older listing's data_json, if any."""
+    with db_connection() as conn:
+        row = conn.execute("SELECT json_extract(data_json, '$.image') FROM items WHERE id = ?", (item_id,)).fetchone()
+    return row[0] if row else None
+
+def set_listing_status(item_id, user_email, status):
+    """Change the status of one of a user's listings; returns whether it was found."""
+    with db_connection() as conn:
+        c = conn.execute("""
+            UPDATE items SET status = ?, data_json = json_set(data_json, '$.status', ?)
+            WHERE id = ? AND user_email = ?
+        """, (status, status, item_id, user_email))
+    return c.rowcount > 0
+
+def get_user_stats(user_email):
+    """Totals over a user's listings, read from the trigger-maintained user_stats row."""
+    with db_connection() as conn:
+        row = conn.execute("""
+            SELECT items_listed, items_active, items_sold, co2_saved, water_saved, energy_saved
+            FROM user_stats WHERE user_email = ?
+        """, (user_email,)).fetchone()
+    keys = ("items_listed", "items_active", "items_sold", "co2_saved", "water_saved", "energy_saved")
+    stats = dict(zip(keys, row or (0,) * len(keys)))
+    stats["green_score"] = min(stats["items_listed"] * 10, 100)
+    return stats
+
+def get_listing_impacts(user_email):
+    """(model, co2, water, energy) per listing, oldest first, from the covering index."""
+    with db_connection() as conn:
+        return conn.execute("""
+            SELECT model, co2_saved, water_saved, energy_saved FROM items
+            WHERE user_email = ? ORDER BY id
+        """, (user_email,)).fetchall()
+
+# ------------------- ANALYSIS CACHE -------------------
+def get_cached_analysis(cache_key):
+    with db_connection() as conn:
+        row = conn.execute("SELECT result_json FROM analysis_cache WHERE cache_key=?", (cache_key,)).fetchone()
+    return json.loads(row[0]) if row else None
+
+def save_cached_analysis(cache_key, result):
+    with db_connection() as conn:
+        conn.execute("""
+            INSERT OR REPLACE INTO analysis_cache (cache_key, result_json, created_at)
             VALUES (?, ?, ?)
-        """, (user_email, json.dumps(item_data), datetime.now().isoformat()))
+        """, (cache_key, json.dumps(result), datetime.now().isoformat()))
 
-def load_user_listings(user_email):
-    with sqlite3.connect(DB_PATH) as conn:
-        c = conn.cursor()
-        c.execute("SELECT data_json FROM items WHERE user_email=? ORDER BY id DESC", (user_email,))
-        rows = c.fetchall()
-    return [json.loads(row[0]) for row in rows]
+# ------------------- FEED -------------------
+FEED_PAGE_SIZE = 24
+
+# sort name -> (sort column, direction); relevance needs a search
+FEED_SORTS = {
+    "relevance": ("fts_rank", "ASC"),
+    "newest": ("created_at", "DESC"),
+    "price_asc": ("suggested_price", "ASC"),
+    "price_desc": ("suggested_price", "DESC"),
+    "condition": ("condition_score", "DESC"),
+}
+
+# How close (difflib ratio) an indexed word must be to replace a search word
+# that matches nothing
+SEARCH_TYPO_CUTOFF = 0.75
+# Most indexed words a search word that matches nothing is compared with
+SEARCH_TYPO_CANDIDATES = 1000
+
+def _typo_candidates(conn, word):
+    """Indexed words sharing the first two letters of `word`, within two of its length."""
+    prefix = word[:2]
+    # A range of listings_vocab, read per word rather than held in memory
+    return [term for (term,) in conn.execute("""
+        SELECT term FROM listings_vocab
+        WHERE term >= ? AND term < ? AND length(term) BETWEEN ? AND ?
+        LIMIT ?
+    """, (prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1), len(word) - 2, len(word) + 2, SEARCH_TYPO_CANDIDATES))]
+
+def listing_search_query(conn, text):
+    """FTS5 query for listings_fts: every word must match.
+
+    An indexed word matches as itself and anything else as the start of
+    one ("lap" finds laptops). A word that is neither is taken as a typo and
+    replaced by the closest indexed words sharing its first two letters.
+    """
+    terms = []
+    for word in re.findall(r"\w+", text.lower()):
+        # A whole word streams from its doclist; a prefix has to merge those
+        # of every word it starts, so it is only used when needed
+        for term in (f'"{word}"', f'"{word}"*'):
+            if conn.execute("SELECT 1 FROM listings_fts WHERE listings_fts MATCH ? LIMIT 1", (term,)).fetchone():
+                terms.append(term)
+                break
+        else:
+            close = difflib.get_close_matches(word, _typo_candidates(conn, word), n=3, cutoff=SEARCH_TYPO_CUTOFF)
+            terms.append("(" + " OR ".join(f'"{w}"' for w in close) + ")" if close else f'"{word}"')
+    return " AND ".join(terms)
+
+# Matches above which a search filters the feed's sort order instead of
+# driving the query (see _search_filter)
+SEARCH_DENSE_MATCHES = 2000
+# Matches above which Best Match ranks only the newest this many; bm25 costs
+# a couple of microseconds a match, and the older ones follow newest first
+RELEVANCE_WINDOW = 20000
+
+def _search_filter(conn, match):
+    """WHERE clause keeping listings that match an FTS query (its one parameter).
+
+    A rare word's few matches are read from listings_fts and sorted. A
+    common word's matches are collected into a lookup once and the feed is
+    read in sort order through its usual index, which fills a page quickly;
+    the unary + keeps SQLite from driving the query from the matches.
+    """
+    matches = conn.execute(
+        "SELECT COUNT(*) FROM (SELECT 1 FROM listings_fts WHERE listings_fts MATCH ? LIMIT ?)",
+        (match, SEARCH_DENSE_MATCHES),
+    ).fetchone()[0]
+    column = "id" if matches < SEARCH_DENSE_MATCHES else "+id"
+    return f"{column} IN (SELECT rowid FROM listings_fts WHERE listings_fts MATCH ?)"
+
+def _relevance_window(conn, match):
+    """Id of the oldest match Best Match ranks, or None when it ranks them all."""
+    rows = conn.execute(
+        "SELECT rowid FROM listings_fts WHERE listings_fts MATCH ? ORDER BY rowid DESC LIMIT 2 OFFSET ?",
+        (match, RELEVANCE_WINDOW - 1),
+    ).fetchall()
+    return rows[0][0] if len(rows) == 2 else None
+
+def best_match_truncated(search):
+    """Whether Best Match for `search` ranks only the newest RELEVANCE_WINDOW matches."""
+    if not re.search(r"\w", search or ""):
+        return False
+    with db_connection() as conn:
+        return _relevance_window(conn, listing_search_query(conn, search)) is not None
+
+# Listings in a radius' bounding box above which the feed is walked in sort
+# order instead of being read out of the R*Tree (see _geo_filter)
+GEO_DENSE_AREA = 2000
+
+def _geo_filter(conn, near, radius_km):
+    """WHERE clause and params keeping listings within radius_km of near (lat, lon).
+
+    In a quiet area the R*Tree yields the few listings inside the bounding
+    box and only those are sorted. In a crowded one that would mean sorting
+    tens of thousands of rows, so instead the feed is read in sort order
+    through its usual index and a page fills after a short stretch.
+    """
+    box = bounding_box(near[0], near[1], radius_km)
+    in_box = conn.execute("""
+        SELECT COUNT(*) FROM (
+            SELECT 1 FROM items_geo
+            WHERE max_lat >= ? AND min_lat <= ? AND max_lon >= ? AND min_lon <= ?
+            LIMIT ?
+        )
+    """, (*box, GEO_DENSE_AREA)).fetchone()[0]
+    exact = "distance_km(lat, lon, ?, ?) <= ?"
+    if in_box < GEO_DENSE_AREA:
+        clause = f"""id IN (
+            SELECT id FROM items_geo
+            WHERE max_lat >= ? AND min_lat <= ? AND max_lon >= ? AND min_lon <= ?
+        ) AND {exact}"""
+    else:
+        clause = f"lat BETWEEN ? AND ? AND lon BETWEEN ? AND ? AND {exact}"
+    return clause, [*box, near[0], near[1], radius_km]
+
+def get_feed_page(category=None, model=None, search=None, min_price=None, max_price=None,
+                  min_condition=None, status=None, near=None, radius_km=None,
+                  sort="newest", cursor=None, limit=FEED_PAGE_SIZE):
+    """One page of listings across all users.
+
+    Filtering, ordering and keyset pagination all happen in a single query
+    over the typed, indexed listing columns. Pass the returned cursor back in
+    to get the next page; it is None once the feed is exhausted.
+
+    `search` is matched against model, category and description through
+    listings_fts (see listing_search_query); sort="relevance" ranks the
+    matches by it. Past RELEVANCE_WINDOW matches only the newest are ranked,
+    and once they run out the rest follow newest first, the cursor then
+    being (None, id).
+
+    `near` (lat, lon) with `radius_km` keeps listings within that distance
+    (see _geo_filter).
+    """
+    if sort == "relevance" and not re.search(r"\w", search or ""):
+        sort = "newest"
+    key_expr, direction = FEED_SORTS[sort]
+    where, params = [], []
+
+    if category:
+        where.append("category = ?")
+        params.append(category)
+    if model:
+        where.append("model = ?")
+        params.append(model)
+    if min_price is not None:
+        where.append("suggested_price >= ?")
+        params.append(min_price)
+    if max_price is not None:
+        where.append("suggested_price <= ?")
+        params.append(max_price)
+    if min_condition is not None:
+        where.append("condition_score >= ?")
+        params.append(min_condition)
+    if status:
+        where.append("status = ?")
+        params.append(status)
+
+    with db_connection() as conn:
+        if near is not None and radius_km is not None:
+            clause, geo_params = _geo_filter(conn, near, radius_km)
+            where.insert(0, clause)
+            params[:0] = geo_params
+        source = "items"
+        match = listing_search_query(conn, search) if search else ""
+        oldest_ranked = None
+        unranked = match and sort == "relevance" and cursor is not None and cursor[0] is None
+        if unranked:
+            # Past the ranked matches: the older ones, newest first
+            key_expr, direction = "id", "DESC"
+            cursor = (cursor[1], cursor[1])
+        elif match and sort == "relevance":
+            oldest_ranked = _relevance_window(conn, match)
+            source = """items JOIN (
+                SELECT rowid AS fts_id, rank AS fts_rank FROM listings_fts
+                WHERE listings_fts MATCH ? AND rowid >= ?
+            ) ON fts_id = id"""
+            params[:0] = [match, oldest_ranked or 0]
+        if match and source == "items":
+            where.insert(0, _search_filter(conn, match))
+            params.insert(0, match)
+        if cursor is not None:
+            # Spelled out (rather than a row-value compare) so SQLite can seek the index
+            op = "<" if direction == "DESC" else ">"
+            where.append(f"{key_expr} {op}= ? AND ({key_expr} {op} ? OR id {op} ?)")
+            params.extend([cursor[0], cursor[0], cursor[1]])
+        sql = f"""
+            SELECT id, user_email, data_json, {key_expr}
+            FROM {source}
+            {"WHERE " + " AND ".join(where) if where else ""}
+            ORDER BY {key_expr} {direction}, id {direction}
+            LIMIT ?
+        """
+        rows = conn.execute(sql, params + [limit + 1]).fetchall()
+
+    items = []
+    for item_id, email, data_json, _ in rows[:limit]:
+        item = json.loads(data_json)
+        item["id"] = item_id
+        item["user"] = email
+        items.append(item)
+
+    next_cursor = None
+    if len(rows) > limit:
+        last = rows[limit - 1]
+        next_cursor = (None if unranked else last[3], last[0])
+    elif oldest_ranked is not None:
+        # The ranked matches ran out; fill the page from the older ones
+        next_cursor = (None, oldest_ranked)
+        if len(items) < limit:
+            more, next_cursor = get_feed_page(category, model, search, min_price, max_price, min_condition, status,
+                                              near, radius_km, sort, next_cursor, limit - len(items))
+            items += more
+    return items, next_cursor
+
+def get_listings(item_ids, status="active"):
+    """Listings (as in the feed) by id, in the order given, skipping missing ones or other statuses."""
+    if not item_ids:
+        return []
+    with db_connection() as conn:
+        rows = conn.execute(f"""
+            SELECT id, user_email, data_json FROM items
+            WHERE id IN ({", ".join("?" * len(item_ids))}) AND (? IS NULL OR status = ?)
+        """, [*item_ids, status, status]).fetchall()
+    found = {item_id: {**json.loads(data_json), "id": item_id, "user": email} for item_id, email, data_json in rows}
+    return [found[i] for i in item_ids if i in found]
+
+def list_feed_categories(status="active"):
+    """Categories with at least one listing of `status` (None for any)."""
+    where = "category IS NOT NULL" + (" AND status = ?1" if status else "")
+    with db_connection() as conn:
+        # A loose index scan: one seek per category to the next one up, so
+        # the cost doesn't grow with the number of listings
+        rows = conn.execute(f"""
+            WITH RECURSIVE c(category) AS (
+                SELECT MIN(category) FROM items WHERE {where}
+                UNION ALL
+                SELECT (SELECT MIN(category) FROM items WHERE {where} AND category > c.category)
+                FROM c WHERE c.category IS NOT NULL
+            )
+            SELECT category FROM c WHERE category IS NOT NULL
+        """, (status,) if status else ()).fetchall()
+    return [r[0] for r in rows]
 
 # ------------------- CHATROOMS & MESSAGES -------------------
 
-def create_chatroom(name):
-    with sqlite3.connect(DB_PATH) as conn:
+def create_chatroom(name, is_private=False):
+    with db_connection() as conn:
         c = conn.cursor()
         created_at = datetime.now().isoformat()
-        c.execute("INSERT INTO chatrooms (name, created_at) VALUES (?, ?)", (name, created_at))
+        c.execute("INSERT INTO chatrooms (name, created_at, is_private) VALUES (?, ?, ?)",
+                  (name, created_at, int(is_private)))
         return c.lastrowid
 
 def send_message(chatroom_id, sender_email, message):
-    with sqlite3.connect(DB_PATH) as conn:
+    with db_connection() as conn:
         c = conn.cursor()
         c.execute("""
             INSERT INTO messages (chatroom_id, sender_email, message, created_at)
             VALUES (?, ?, ?, ?)
         """, (chatroom_id, sender_email, message, datetime.now().isoformat()))
+        message_id = c.lastrowid
+    # Only after the commit, so subscribers can already read it
+    message_bus.publish(chatroom_id, message_id)
+    return message_id
 
-def get_chatroom_messages(chatroom_id):
-    with sqlite3.connect(DB_PATH) as conn:
-        c = conn.cursor()
-        c.execute("SELECT sender_email, message, created_at FROM messages WHERE chatroom_id=? ORDER BY id ASC", (chatroom_id,))
-        rows = c.fetchall()
-    return [{"sender": r[0], "message": r[1], "time": r[2]} for r in rows]
+def latest_message_id(chatroom_id):
+    with db_connection() as conn:
+        row = conn.execute("SELECT MAX(id) FROM messages WHERE chatroom_id=?", (chatroom_id,)).fetchone()
+    return row[0] or 0
 
-def search_messages(query, user_email):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
+MESSAGE_PAGE_SIZE = 50
 
-    q = f"%{query}%"
+def get_chatroom_messages(chatroom_id, limit=MESSAGE_PAGE_SIZE, after_id=None, before_id=None):
+    """Up to `limit` messages of a room, oldest first.
 
-    c.execute("""
-        SELECT m.id, m.chatroom_id, m.sender_email, m.message, m.created_at, c.name
-        FROM messages m
-        JOIN chatrooms c ON m.chatroom_id = c.id
-        WHERE
-            (
-                -- public chats
-                m.chatroom_id NOT IN (
-                    SELECT chatroom_id FROM chat_participants
-                )
-                OR
-                -- private chats user participates in
-                m.chatroom_id IN (
-                    SELECT chatroom_id FROM chat_participants
-                    WHERE user_email = ?
-                )
-            )
-        AND (
-            m.sender_email LIKE ?
-            OR m.message LIKE ?
-            OR c.name LIKE ?
-        )
-        ORDER BY m.created_at DESC
-    """, (user_email, q, q, q))
+    By default the latest ones; with `after_id` the ones that arrived since
+    that message, with `before_id` the page of history just before it.
+    """
+    if after_id is not None:
+        sql = """
+            SELECT id, sender_email, message, created_at FROM messages
+            WHERE chatroom_id=? AND id > ? ORDER BY id ASC LIMIT ?
+        """
+        params = (chatroom_id, after_id, limit)
+    elif before_id is not None:
+        sql = """
+            SELECT id, sender_email, message, created_at FROM messages
+            WHERE chatroom_id=? AND id < ? ORDER BY id DESC LIMIT ?
+        """
+        params = (chatroom_id, before_id, limit)
+    else:
+        sql = """
+            SELECT id, sender_email, message, created_at FROM messages
+            WHERE chatroom_id=? ORDER BY id DESC LIMIT ?
+        """
+        params = (chatroom_id, limit)
+
+    with db_connection() as conn:
+        rows = conn.execute(sql, params).fetchall()
+    if after_id is None:
+        rows.reverse()
+    return [{"id": r[0], "sender": r[1], "message": r[2], "time": r[3]} for r in rows]
+
+def mark_chat_read(chatroom_id, user_email, message_id):
+    with db_connection() as conn:
+        conn.execute("""
+            INSERT INTO chat_reads (user_email, chatroom_id, last_read_id) VALUES (?, ?, ?)
+            ON CONFLICT (user_email, chatroom_id)
+            DO UPDATE SET last_read_id = MAX(last_read_id, excluded.last_read_id)
+        """, (user_email, chatroom_id, message_id))
+
+SEARCH_PAGE_SIZE = 20
+
+# snippet() wraps matches in these; the page escapes the text and swaps them for tags
+SNIPPET_START = "\x02"
+SNIPPET_END = "\x03"
 
-    rows = c.fetchall()
-    conn.close()
+def fts_query(text):
+    """Turn free text into an FTS5 query: every word must match as a prefix."""
+    terms = re.findall(r"\w+", text.lower())
+    return " ".join(f'"{t}"*' for t in terms)
+
+def search_messages(query, user_email, limit=SEARCH_PAGE_SIZE, offset=0):
+    match = fts_query(query)
+    if not match:
+        return []
+
+    with db_connection() as conn:
+        c = conn.cursor()
+        c.execute("""
+            SELECT m.id, m.chatroom_id, m.sender_email, m.message, m.created_at, r.name,
+                   snippet(messages_fts, 0, ?, ?, '…', 16)
+            FROM messages_fts
+            JOIN messages m ON m.id = messages_fts.rowid
+            JOIN chatrooms r ON r.id = m.chatroom_id
+            LEFT JOIN chat_participants me
+                ON me.chatroom_id = m.chatroom_id AND me.user_email = ?
+            WHERE messages_fts MATCH ?
+            AND (r.is_private = 0 OR me.user_email IS NOT NULL)
+            ORDER BY bm25(messages_fts)
+            LIMIT ? OFFSET ?
+        """, (SNIPPET_START, SNIPPET_END, user_email, match, limit, offset))
+
+        rows = c.fetchall()
 
     return [{
         "message_id": r[0],
@@ -173,113 +1072,112 @@ def search_messages(query, user_email):
         "sender": r[2],
         "message": r[3],
         "time": r[4],
-        "chatroom_name": r[5]
+        "chatroom_name": r[5],
+        "snippet": r[6]
     } for r in rows]
 
 
 def get_or_create_private_chat(user1, user2):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
+    user_a, user_b = sorted((user1, user2))
+    lookup = "SELECT chatroom_id FROM private_pairs WHERE user_a = ? AND user_b = ?"
 
-    # existing private chat?
-    c.execute("""
-        SELECT chatroom_id
-        FROM chat_participants
-        GROUP BY chatroom_id
-        HAVING COUNT(*) = 2
-        AND SUM(user_email = ?) = 1
-        AND SUM(user_email = ?) = 1
-    """, (user1, user2))
-
-    row = c.fetchone()
-    if row:
-        conn.close()
-        return row[0]
-
-    chat_name = f"Private: {user1} ↔ {user2}"
-
-    c.execute(
-        "INSERT INTO chatrooms (name, created_at) VALUES (?, ?)",
-        (chat_name, datetime.now().isoformat())
-    )
-    chatroom_id = c.lastrowid
-
-    c.executemany("""
-        INSERT INTO chat_participants (chatroom_id, user_email)
-        VALUES (?, ?)
-    """, [
-        (chatroom_id, user1),
-        (chatroom_id, user2)
-    ])
-
-    conn.commit()
-    conn.close()
-    return chatroom_id
-
-
-
-def user_can_access_chat(chatroom_id, user_email):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-
-    # Public chat
-    c.execute("""
-        SELECT 1 FROM chatrooms
-        WHERE id = ?
-        AND id NOT IN (SELECT chatroom_id FROM chat_participants)
-    """, (chatroom_id,))
-    if c.fetchone():
-        conn.close()
-        return True
-
-    # Private chat
-    c.execute("""
-        SELECT 1 FROM chat_participants
-        WHERE chatroom_id = ? AND user_email = ?
-    """, (chatroom_id, user_email))
-
-    allowed = c.fetchone() is not None
-    conn.close()
-    return allowed
+    with db_connection() as conn:
+        c = conn.cursor()
 
+        # existing private chat?
+        row = c.execute(lookup, (user_a, user_b)).fetchone()
+        if row:
+            return row[0]
 
+        # Take the write lock, then look again: another session may have
+        # created the room between our lookup and now.
+        c.execute("BEGIN IMMEDIATE")
+        row = c.execute(lookup, (user_a, user_b)).fetchone()
+        if row:
+            return row[0]
 
-def list_user_chats(user_email):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
+        chat_name = f"Private: {user1} ↔ {user2}"
 
-    # Public chats
-    c.execute("""
-        SELECT id, name
-        FROM chatrooms
-        WHERE id NOT IN (
-            SELECT chatroom_id FROM chat_participants
+        c.execute(
+            "INSERT INTO chatrooms (name, created_at, is_private) VALUES (?, ?, 1)",
+            (chat_name, datetime.now().isoformat())
         )
-    """)
-    public_rooms = c.fetchall()
+        chatroom_id = c.lastrowid
 
-    # Private chats user participates in
-    c.execute("""
-        SELECT c.id, c.name
-        FROM chatrooms c
-        JOIN chat_participants cp ON c.id = cp.chatroom_id
-        WHERE cp.user_email = ?
-    """, (user_email,))
-    private_rooms = c.fetchall()
+        c.executemany("""
+            INSERT OR IGNORE INTO chat_participants (chatroom_id, user_email)
+            VALUES (?, ?)
+        """, [
+            (chatroom_id, user1),
+            (chatroom_id, user2)
+        ])
 
-    conn.close()
+        c.execute(
+            "INSERT INTO private_pairs (user_a, user_b, chatroom_id) VALUES (?, ?, ?)",
+            (user_a, user_b, chatroom_id)
+        )
 
-    rooms = public_rooms + private_rooms
-    return [{"id": r[0], "name": r[1]} for r in rooms]
+    return chatroom_id
 
 
 
+def user_can_access_chat(chatroom_id, user_email):
+    with db_connection() as conn:
+        c = conn.cursor()
 
-    
+        # Public chat, or a private chat the user participates in
+        c.execute("""
+            SELECT 1 FROM chatrooms r
+            WHERE r.id = ?
+            AND (
+                r.is_private = 0
+                OR EXISTS (
+                    SELECT 1 FROM chat_participants
+                    WHERE chatroom_id = r.id AND user_email = ?
+                )
+            )
+        """, (chatroom_id, user_email))
 
+        return c.fetchone() is not None
 
 
 
+# unread counts stop here; the page shows "99+"
+UNREAD_CAP = 100
 
+def list_user_chats(user_email):
+    """Rooms the user can open, with last-message time and unread count."""
+    with db_connection() as conn:
+        c = conn.cursor()
 
+        c.execute("""
+            WITH accessible(id) AS (
+                -- public chats
+                SELECT id FROM chatrooms WHERE is_private = 0
+                UNION ALL
+                -- private chats user participates in
+                SELECT chatroom_id FROM chat_participants WHERE user_email = ?
+            )
+            SELECT r.id, r.name, r.is_private,
+                   (SELECT created_at FROM messages
+                    WHERE chatroom_id = r.id ORDER BY id DESC LIMIT 1),
+                   (SELECT COUNT(*) FROM (
+                        SELECT 1 FROM messages
+                        WHERE chatroom_id = r.id AND id > COALESCE(rd.last_read_id, 0)
+                        AND sender_email != ?
+                        LIMIT ?
+                   ))
+            FROM accessible a
+            JOIN chatrooms r ON r.id = a.id
+            LEFT JOIN chat_reads rd ON rd.user_email = ? AND rd.chatroom_id = r.id
+            ORDER BY r.is_private, r.id
+        """, (user_email, user_email, UNREAD_CAP, user_email))
+        rows = c.fetchall()
 
+    return [{
+        "id": r[0],
+        "name": r[1],
+        "is_private": bool(r[2]),
+        "last_message_at": r[3],
+        "unread": r[4]
+    } for r in rows]